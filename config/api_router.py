@@ -2,11 +2,15 @@ from django.conf import settings
 from rest_framework.routers import DefaultRouter
 from rest_framework.routers import SimpleRouter
 
+from edman.partner.api.views import LeadRollupViewSet
+from edman.partner.api.views import PartnerLeadViewSet
 from edman.users.api.views import UserViewSet
 
 router = DefaultRouter() if settings.DEBUG else SimpleRouter()
 
 router.register("users", UserViewSet)
+router.register("partner-leads", PartnerLeadViewSet)
+router.register("partner-lead-rollups", LeadRollupViewSet, basename="partner-lead-rollup")
 
 
 app_name = "api"
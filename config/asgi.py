@@ -0,0 +1,37 @@
+"""
+ASGI config for edman project.
+
+Serves the /hh/events/ webhook receiver on redis.asyncio without tying up a
+thread per request. Run it with any ASGI server, e.g.
+
+    uvicorn config.asgi:application --workers 4
+
+Sync views keep working under ASGI; Django runs them in a thread pool. hh.ru webhook
+POSTs skip Django's middleware and go straight to edman.hh.asgi.events_app.
+
+"""
+
+import os
+import sys
+from pathlib import Path
+
+from django.core.asgi import get_asgi_application
+
+# This allows easy placement of apps within the interior
+# edman directory.
+BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
+sys.path.append(str(BASE_DIR / "edman"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.production")
+
+django_application = get_asgi_application()
+
+# Imported after Django is set up
+from edman.hh.asgi import events_app  # noqa: E402
+
+HH_EVENTS_PATH = "/hh/events/"
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == HH_EVENTS_PATH:
+        return await events_app(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -22,8 +22,59 @@ if READ_DOT_ENV_FILE:
 DEBUG = env.bool("DJANGO_DEBUG", False)
 # Control partner auth debug dumps
 PARTNER_AUTH_DEBUG_DUMPS = env.bool("PARTNER_AUTH_DEBUG_DUMPS", default=False)
+# Debug dumps are gzipped and evicted oldest first above these sizes (per session / in total)
+PARTNER_AUTH_DEBUG_DUMPS_SESSION_MAX_BYTES = env.int("PARTNER_AUTH_DEBUG_DUMPS_SESSION_MAX_BYTES", default=5 * 1024 * 1024)
+PARTNER_AUTH_DEBUG_DUMPS_MAX_BYTES = env.int("PARTNER_AUTH_DEBUG_DUMPS_MAX_BYTES", default=200 * 1024 * 1024)
 # Control partner auth browser visibility
 PARTNER_AUTH_SHOW_BROWSER = env.bool("PARTNER_AUTH_SHOW_BROWSER", default=False)
+# Seconds the partner login keeps checking the page for success or a challenge
+# (time spent waiting for the user's code is not counted)
+PARTNER_AUTH_CHECK_SECONDS = env.int("PARTNER_AUTH_CHECK_SECONDS", default=40)
+# Page that opens only for a logged-in Yandex session (anyone else is sent to Passport),
+# used to check a stored partner session without a browser
+PARTNER_AUTH_PROFILE_URL = env("PARTNER_AUTH_PROFILE_URL", default="https://id.yandex.ru/")
+# Partner auth worker pool: concurrent browsers overall and per user
+PARTNER_AUTH_MAX_BROWSERS = env.int("PARTNER_AUTH_MAX_BROWSERS", default=2)
+PARTNER_AUTH_MAX_BROWSERS_PER_USER = env.int("PARTNER_AUTH_MAX_BROWSERS_PER_USER", default=1)
+# Pre-warmed auth contexts kept by each auth worker process (0 disables), their idle TTL
+# in seconds, and whether they are opened on the apps' auth URLs in advance
+PARTNER_AUTH_WARM_POOL_SIZE = env.int("PARTNER_AUTH_WARM_POOL_SIZE", default=0)
+PARTNER_AUTH_WARM_POOL_TTL = env.int("PARTNER_AUTH_WARM_POOL_TTL", default=300)
+PARTNER_AUTH_WARM_POOL_PRENAVIGATE = env.bool("PARTNER_AUTH_WARM_POOL_PRENAVIGATE", default=True)
+# Persistent per-account browser profiles for lead enrichment (empty disables), with the
+# HTTP disk cache size per profile and eviction of whole profiles by total size and age
+PARTNER_ENRICH_PROFILES_DIR = env("PARTNER_ENRICH_PROFILES_DIR", default="")
+PARTNER_ENRICH_CACHE_MAX_BYTES = env.int("PARTNER_ENRICH_CACHE_MAX_BYTES", default=200 * 1024 * 1024)
+PARTNER_ENRICH_PROFILES_MAX_BYTES = env.int("PARTNER_ENRICH_PROFILES_MAX_BYTES", default=2 * 1024 * 1024 * 1024)
+PARTNER_ENRICH_PROFILES_MAX_AGE = env.int("PARTNER_ENRICH_PROFILES_MAX_AGE", default=14 * 24 * 3600)
+# How long a repeated hh.ru webhook delivery is dropped before reaching Celery
+HH_EVENT_DEDUP_TTL = env.int("HH_EVENT_DEDUP_TTL", default=24 * 3600)
+# Redis stream the /hh/events/ receiver appends to and consume_hh_events reads
+# (empty: queue each event to Celery instead),
+# its approximate length cap and the Redis timeout in seconds before falling back to Celery
+HH_EVENTS_STREAM = env("HH_EVENTS_STREAM", default="")
+HH_EVENTS_STREAM_MAXLEN = env.int("HH_EVENTS_STREAM_MAXLEN", default=100_000)
+HH_EVENTS_STREAM_TIMEOUT = env.float("HH_EVENTS_STREAM_TIMEOUT", default=0.5)
+# consume_hh_events: consumer group, events per batch, idle milliseconds before another
+# consumer claims a pending event, and deliveries after which a failing event is dropped
+HH_EVENTS_GROUP = env("HH_EVENTS_GROUP", default="hh-events")
+HH_EVENTS_BATCH_SIZE = env.int("HH_EVENTS_BATCH_SIZE", default=100)
+HH_EVENTS_CLAIM_IDLE_MS = env.int("HH_EVENTS_CLAIM_IDLE_MS", default=60_000)
+HH_EVENTS_MAX_DELIVERIES = env.int("HH_EVENTS_MAX_DELIVERIES", default=5)
+# Seconds a compiled employer route stays in the cache (changes invalidate it anyway)
+HH_ROUTES_CACHE_TTL = env.int("HH_ROUTES_CACHE_TTL", default=3600)
+# Outbound HTTP (edman.utils.http): connect/read timeouts in seconds, retries with
+# exponential backoff on 429/5xx, the longest Retry-After in seconds waited for,
+# and keep-alive pools (hosts kept, connections per host)
+HTTP_CONNECT_TIMEOUT = env.float("HTTP_CONNECT_TIMEOUT", default=5)
+HTTP_READ_TIMEOUT = env.float("HTTP_READ_TIMEOUT", default=30)
+HTTP_RETRIES = env.int("HTTP_RETRIES", default=3)
+HTTP_BACKOFF_FACTOR = env.float("HTTP_BACKOFF_FACTOR", default=0.5)
+HTTP_MAX_RETRY_AFTER = env.float("HTTP_MAX_RETRY_AFTER", default=30)
+HTTP_POOL_HOSTS = env.int("HTTP_POOL_HOSTS", default=20)
+HTTP_POOL_MAXSIZE = env.int("HTTP_POOL_MAXSIZE", default=10)
+# zlib-compress stored partner sessions (storage_state JSON)
+PARTNER_SESSION_COMPRESS = env.bool("PARTNER_SESSION_COMPRESS", default=True)
 
 # Local time zone. Choices are
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
@@ -78,6 +129,7 @@ DJANGO_APPS = [
     "django.contrib.sites",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     # "django.contrib.humanize", # Handy template tags
     "django.contrib.admin",
     "django.forms",
@@ -312,6 +364,11 @@ CELERY_TASK_TIME_LIMIT = 5 * 60
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#task-soft-time-limit
 # TODO: set to whatever value is adequate in your circumstances
 CELERY_TASK_SOFT_TIME_LIMIT = 60
+# https://docs.celeryq.dev/en/stable/userguide/configuration.html#task-routes
+# Partner logins launch a full browser, keep them off the general queue
+CELERY_TASK_ROUTES = {
+    "edman.partner.tasks.run_auth_session": {"queue": "partner_auth"},
+}
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#beat-scheduler
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#worker-send-task-events
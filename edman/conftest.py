@@ -1,3 +1,7 @@
+import os
+import time
+from contextlib import contextmanager
+
 import pytest
 
 from edman.users.models import User
@@ -12,3 +16,25 @@ def _media_storage(settings, tmpdir) -> None:
 @pytest.fixture
 def user(db) -> User:
     return UserFactory()
+
+
+@pytest.fixture
+def perf_budget(django_assert_max_num_queries):
+    """
+    with perf_budget(queries=5, seconds=0.5): ... fails if the block runs more
+    queries. Seed more rows than a page so N+1 queries show up.
+    Wall-clock budgets depend on the machine, so they are only checked with
+    PERF_BUDGET_TIMING=1 (e.g. on a dedicated runner).
+    """
+    check_time = os.environ.get("PERF_BUDGET_TIMING") == "1"
+
+    @contextmanager
+    def check(queries, seconds=None):
+        start = time.perf_counter()
+        with django_assert_max_num_queries(queries):
+            yield
+        elapsed = time.perf_counter() - start
+        if check_time and seconds is not None:
+            assert elapsed < seconds, f"took {elapsed:.3f}s, budget {seconds}s"
+
+    return check
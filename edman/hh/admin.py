@@ -1,8 +1,18 @@
 from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+from edman.utils.admin import ScalableAdminMixin
+from edman.utils.phones import normalize_phone
 
 # Register your models here.
 from .models import App, Employer, Resume, Contact
 
+User = get_user_model()
+
+# Most resumes a contact search by resume name/title expands to
+RESUME_MATCH_LIMIT = 1000
+
 @admin.register(App)
 class AppAdmin(admin.ModelAdmin):
     list_display = ("id", "redirect_uri", "client_id")
@@ -12,14 +22,65 @@ class EmployerAdmin(admin.ModelAdmin):
     list_display = ("user_id", "owner", "subscription", "app")
 
 @admin.register(Resume)
-class ResumeAdmin(admin.ModelAdmin):
+class ResumeAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ("id", "date", "last_name", "title")
-    search_fields = ("id", "last_name", "owner__email", "title")
+    # Prefix match on UPPER(column) indexes; numeric terms also match the id,
+    # an email the resumes of that owner (owner_id index)
+    search_fields = ("^last_name", "^first_name", "^title")
+    raw_id_fields = ("owner",)
     list_per_page = 50
 
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if "@" in term:
+            # Resolved to ids first, so the planner combines plain index scans
+            owner_ids = list(User.objects.filter(email__iexact=term).values_list("pk", flat=True))
+            if owner_ids:
+                results |= queryset.filter(owner_id__in=owner_ids)
+        return results, may_have_duplicates
+
+
+class ContactTypeFilter(admin.SimpleListFilter):
+    """Fixed hh contact types, instead of a SELECT DISTINCT over every contact"""
+    title = "type"
+    parameter_name = "type"
+
+    def lookups(self, request, model_admin):
+        return [(contact_type, contact_type) for contact_type in Contact.PHONE_TYPES + ("email", "telegram", "whatsapp")]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(type=self.value())
+        return queryset
+
+
 @admin.register(Contact)
-class ContactAdmin(admin.ModelAdmin):
+class ContactAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ("id", "type", "value", "resume")
-    search_fields = ("id", "value", "resume__last_name", "resume__first_name", "resume__title")
-    list_filter = ("type",)
-    list_per_page = 50
\ No newline at end of file
+    list_select_related = ("resume",)
+    # Exact value (UPPER(value) index); phone digits also match phone_normalized
+    # by prefix, numeric terms the id, other terms the resume's last/first name
+    # or title by prefix. Contacts of a resume: ?resume__id__exact=
+    search_fields = ("=value",)
+    list_filter = (ContactTypeFilter,)
+    raw_id_fields = ("resume",)
+    list_per_page = 50
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        digits = normalize_phone(search_term)
+        if len(digits) >= 5:
+            results |= queryset.filter(phone_normalized__startswith=digits)
+        term = search_term.strip()
+        if term and not term.isdigit():
+            # Resume ids are resolved first: OR-ing an IN (subquery) into the
+            # contact search makes Postgres scan every contact
+            resume_ids = list(
+                Resume.objects.filter(
+                    Q(last_name__istartswith=term) | Q(first_name__istartswith=term) | Q(title__istartswith=term)
+                ).values_list("pk", flat=True)[:RESUME_MATCH_LIMIT]
+            )
+            if resume_ids:
+                results |= queryset.filter(resume_id__in=resume_ids)
+        return results, may_have_duplicates
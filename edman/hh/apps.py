@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class HhConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'edman.hh'
+
+    def ready(self):
+        import edman.hh.signals  # noqa: F401, PLC0415
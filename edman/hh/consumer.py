@@ -0,0 +1,96 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from redis.exceptions import ResponseError
+
+from .pipeline import process_events
+
+logger = logging.getLogger(__name__)
+
+
+class EventConsumer:
+    """
+    Reads hh events from the HH_EVENTS_STREAM Redis stream as one consumer of a
+    consumer group and processes them in micro-batches. Entries are acked only
+    after their batch is processed, so delivery is at-least-once: a crashed
+    consumer's entries stay pending and are claimed by another one after
+    claim_idle_ms. The WebhookEvent keys drop the repeats this can produce.
+    """
+
+    def __init__(self, client, consumer, stream=None, group=None, batch_size=None, block_ms=5000):
+        self.client = client
+        self.consumer = consumer
+        self.stream = stream or settings.HH_EVENTS_STREAM
+        self.group = group or getattr(settings, "HH_EVENTS_GROUP", "hh-events")
+        self.batch_size = batch_size or getattr(settings, "HH_EVENTS_BATCH_SIZE", 100)
+        self.block_ms = block_ms
+        self.claim_idle_ms = getattr(settings, "HH_EVENTS_CLAIM_IDLE_MS", 60_000)
+        self.max_deliveries = getattr(settings, "HH_EVENTS_MAX_DELIVERIES", 5)
+
+    def ensure_group(self):
+        try:
+            self.client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as exc:
+            if "BUSYGROUP" not in str(exc):
+                raise
+
+    def read_batch(self):
+        """Entries pending too long on other consumers first, then new ones"""
+        _next_id, entries, *_deleted = self.client.xautoclaim(
+            self.stream, self.group, self.consumer,
+            min_idle_time=self.claim_idle_ms, start_id="0-0", count=self.batch_size,
+        )
+        if entries:
+            return entries
+        response = self.client.xreadgroup(
+            self.group, self.consumer, {self.stream: ">"}, count=self.batch_size, block=self.block_ms
+        )
+        return response[0][1] if response else []
+
+    def run_once(self):
+        """Process one batch, returning the number of entries read"""
+        entries = self.read_batch()
+        if not entries:
+            return 0
+        close_old_connections()
+        done, batch = [], []
+        for entry_id, fields in entries:
+            try:
+                batch.append((entry_id, json.loads(fields[b"data"])))
+            except (TypeError, KeyError, ValueError):
+                logger.error("Dropping malformed hh event %s from %s", entry_id, self.stream)
+                done.append(entry_id)
+        failed = process_events([data for _entry_id, data in batch])
+        failed_events = {id(data) for data, _error in failed}
+        retry: list[bytes] = []
+        for entry_id, data in batch:
+            (retry if id(data) in failed_events else done).append(entry_id)
+        done.extend(self.give_up(retry))
+        if done:
+            self.client.xack(self.stream, self.group, *done)
+        return len(entries)
+
+    def give_up(self, entry_ids):
+        """Entries among the failed ones that were delivered max_deliveries times"""
+        exhausted = []
+        for entry_id in entry_ids:
+            pending = self.client.xpending_range(
+                self.stream, self.group, min=entry_id, max=entry_id, count=1
+            )
+            if pending and pending[0]["times_delivered"] >= self.max_deliveries:
+                logger.error("Giving up on hh event %s after %s deliveries", entry_id, self.max_deliveries)
+                exhausted.append(entry_id)
+        return exhausted
+
+    def run(self):
+        self.ensure_group()
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                # The batch stays pending and is claimed again after claim_idle_ms
+                logger.exception("hh event batch failed")
+                time.sleep(1)
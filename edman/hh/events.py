@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import weakref
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from .pipeline import event_key
+from .tasks import event_processor
+
+logger = logging.getLogger(__name__)
+
+DEDUP_KEY_PREFIX = "hh_event_seen_"
+
+# One redis.asyncio pool per event loop (ASGI), one thread-safe sync pool (WSGI)
+_stream_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis]" = weakref.WeakKeyDictionary()
+_redis_client: redis.Redis | None = None
+
+
+def validate_event(data):
+    """Error message for a webhook body that isn't an hh.ru event, None if it is"""
+    if not isinstance(data, dict):
+        return "Event must be a JSON object"
+    if not data.get("subscription_id") or not data.get("action_type"):
+        return "subscription_id and action_type are required"
+    if not isinstance(data.get("payload") or {}, dict):
+        return "payload must be a JSON object"
+    return None
+
+
+def parse_event(body):
+    """(event, None) for a valid webhook body, (None, error message) otherwise"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None, "Invalid JSON"
+    error = validate_event(data)
+    if error:
+        return None, error
+    return data, None
+
+
+def dedup_timeout():
+    return getattr(settings, "HH_EVENT_DEDUP_TTL", 24 * 3600)
+
+
+def get_redis_client():
+    """Sync Redis client of the WSGI receiver; its connection pool is shared by all threads"""
+    global _redis_client
+    if _redis_client is None:
+        timeout = getattr(settings, "HH_EVENTS_STREAM_TIMEOUT", 0.5)
+        _redis_client = redis.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=timeout, socket_connect_timeout=timeout
+        )
+    return _redis_client
+
+
+def get_stream_client():
+    """
+    Async Redis client for the running event loop. redis.asyncio connections are
+    bound to the loop they were opened on, so each loop gets its own pool; an ASGI
+    worker runs one loop, so that is one pool per worker.
+    """
+    loop = asyncio.get_running_loop()
+    client = _stream_clients.get(loop)
+    if client is None:
+        timeout = getattr(settings, "HH_EVENTS_STREAM_TIMEOUT", 0.5)
+        client = aioredis.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=timeout, socket_connect_timeout=timeout
+        )
+        _stream_clients[loop] = client
+    return client
+
+
+def claim_event(key):
+    """
+    True the first time a key is seen within HH_EVENT_DEDUP_TTL. Both paths are a
+    single SET NX with expiry on Redis, so concurrent repeats can't both win.
+    """
+    if getattr(settings, "HH_EVENTS_STREAM", ""):
+        return bool(get_redis_client().set(f"{DEDUP_KEY_PREFIX}{key}", 1, nx=True, ex=dedup_timeout()))
+    return cache.add(f"{DEDUP_KEY_PREFIX}{key}", 1, timeout=dedup_timeout())
+
+
+async def aclaim_event(key):
+    """claim_event on the event loop; with HH_EVENTS_STREAM it goes straight to Redis"""
+    if getattr(settings, "HH_EVENTS_STREAM", ""):
+        return bool(await get_stream_client().set(f"{DEDUP_KEY_PREFIX}{key}", 1, nx=True, ex=dedup_timeout()))
+    return await cache.aadd(f"{DEDUP_KEY_PREFIX}{key}", 1, timeout=dedup_timeout())
+
+
+def release_event(key):
+    """Forget a claimed key, so a redelivery of an event that was not queued gets through"""
+    if getattr(settings, "HH_EVENTS_STREAM", ""):
+        get_redis_client().delete(f"{DEDUP_KEY_PREFIX}{key}")
+    else:
+        cache.delete(f"{DEDUP_KEY_PREFIX}{key}")
+
+
+async def arelease_event(key):
+    if getattr(settings, "HH_EVENTS_STREAM", ""):
+        await get_stream_client().delete(f"{DEDUP_KEY_PREFIX}{key}")
+    else:
+        await cache.adelete(f"{DEDUP_KEY_PREFIX}{key}")
+
+
+def publish_event(data):
+    """
+    Append an event to the HH_EVENTS_STREAM Redis stream. False when no stream is
+    configured or Redis can't take it, so the caller falls back to the broker.
+    """
+    stream = getattr(settings, "HH_EVENTS_STREAM", "")
+    if not stream:
+        return False
+    try:
+        get_redis_client().xadd(
+            stream,
+            {"data": json.dumps(data)},
+            maxlen=getattr(settings, "HH_EVENTS_STREAM_MAXLEN", 100_000),
+            approximate=True,
+        )
+    except RedisError:
+        logger.warning("Could not append hh event to stream %s", stream, exc_info=True)
+        return False
+    return True
+
+
+async def apublish_event(data):
+    stream = getattr(settings, "HH_EVENTS_STREAM", "")
+    if not stream:
+        return False
+    try:
+        await get_stream_client().xadd(
+            stream,
+            {"data": json.dumps(data)},
+            maxlen=getattr(settings, "HH_EVENTS_STREAM_MAXLEN", 100_000),
+            approximate=True,
+        )
+    except RedisError:
+        logger.warning("Could not append hh event to stream %s", stream, exc_info=True)
+        return False
+    return True
+
+
+def receive_event(body):
+    """
+    Validate, deduplicate and queue a webhook body. Returns (status, text) of the
+    response; used by the Django view.
+    """
+    data, error = parse_event(body)
+    if error:
+        return 400, error
+    key = event_key(data)
+    # hh.ru retries deliveries: drop repeats before any work is queued
+    if key and not claim_event(key):
+        return 200, "Ok"
+    try:
+        if not publish_event(data):
+            event_processor.delay(data)
+    except Exception:
+        if key:
+            release_event(key)
+        raise
+    return 200, "Ok"
+
+
+async def areceive_event(body):
+    """receive_event for the bare ASGI receiver, on the loop's redis.asyncio client"""
+    data, error = parse_event(body)
+    if error:
+        return 400, error
+    key = event_key(data)
+    if key and not await aclaim_event(key):
+        return 200, "Ok"
+    try:
+        if not await apublish_event(data):
+            await sync_to_async(event_processor.delay, thread_sensitive=False)(data)
+    except Exception:
+        if key:
+            await arelease_event(key)
+        raise
+    return 200, "Ok"
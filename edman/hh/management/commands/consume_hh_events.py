@@ -0,0 +1,30 @@
+import os
+import socket
+
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from edman.hh.consumer import EventConsumer
+
+
+class Command(BaseCommand):
+    help = "Consume hh webhook events from the HH_EVENTS_STREAM Redis stream in micro-batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, help="Events per batch (default HH_EVENTS_BATCH_SIZE)")
+        parser.add_argument("--block", type=int, default=5000, help="Milliseconds to wait for new events")
+        parser.add_argument("--consumer", help="Consumer name in the group (default host-pid)")
+
+    def handle(self, *args, **options):
+        if not settings.HH_EVENTS_STREAM:
+            raise CommandError("HH_EVENTS_STREAM is not set")
+        consumer = EventConsumer(
+            redis.Redis.from_url(settings.REDIS_URL),
+            options["consumer"] or f"{socket.gethostname()}-{os.getpid()}",
+            batch_size=options["batch_size"],
+            block_ms=options["block"],
+        )
+        self.stdout.write(f"Consuming {consumer.stream} as {consumer.consumer} in group {consumer.group}")
+        consumer.run()
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the /hh/events/ webhook receiver in this process: drives config.asgi with "
+        "concurrent unique events and reports requests per second for one worker. Events are "
+        "really queued (HH_EVENTS_STREAM or Celery), for a subscription no employer has."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000, help="Events to post")
+        parser.add_argument("--concurrency", type=int, default=50, help="Requests in flight")
+        parser.add_argument("--host", default="localhost", help="Host header, must be in ALLOWED_HOSTS")
+
+    def handle(self, *args, **options):
+        latencies, statuses, elapsed = asyncio.run(self.run(options))
+        latencies.sort()
+        failed = sum(status != 200 for status in statuses)
+        self.stdout.write(
+            f"{len(latencies)} requests, concurrency {options['concurrency']}: "
+            f"{len(latencies) / elapsed:.0f} req/s per worker, "
+            f"p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms, "
+            f"{failed} non-200"
+        )
+
+    async def run(self, options):
+        from config.asgi import application as app
+
+        subscription_id = f"loadtest-{uuid.uuid4().hex}"
+        remaining = iter(range(options["requests"]))
+        latencies, statuses = [], []
+
+        async def worker():
+            for i in remaining:
+                body = json.dumps({
+                    "id": str(i),
+                    "subscription_id": subscription_id,
+                    "action_type": "NEW_RESPONSE_OR_INVITATION_VACANCY",
+                    "payload": {"resume_id": f"loadtest-{i}", "vacancy_id": "1"},
+                }).encode()
+                started = time.perf_counter()
+                statuses.append(await post(app, options["host"], body))
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(options["concurrency"])))
+        return latencies, statuses, time.perf_counter() - started
+
+
+async def post(app, host, body):
+    """POST a JSON body to /hh/events/ through the ASGI app, return the status code"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/hh/events/",
+        "raw_path": b"/hh/events/",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", host.encode()),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": (host, 80),
+    }
+    request = [{"type": "http.request", "body": body, "more_body": False}]
+    done = asyncio.Event()
+    status = None
+
+    async def receive():
+        if request:
+            return request.pop()
+        # The client stays connected until the response is sent
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return status
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the index without locking writes to a large hh_contact
+    atomic = False
+
+    dependencies = [
+        ('hh', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contact',
+            name='phone_normalized',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        AddIndexConcurrently(
+            model_name='contact',
+            index=models.Index(fields=['phone_normalized'], name='hh_contact_phone_norm', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
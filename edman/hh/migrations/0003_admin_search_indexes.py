@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:14
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking writes to large hh tables
+    atomic = False
+
+    dependencies = [
+        ('hh', '0002_phone_normalized'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='contact',
+            index=models.Index(django.db.models.functions.text.Upper('value'), name='hh_contact_value_upper'),
+        ),
+        AddIndexConcurrently(
+            model_name='resume',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('last_name'), name='text_pattern_ops'), name='hh_resume_last_name_prefix'),
+        ),
+        AddIndexConcurrently(
+            model_name='resume',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('first_name'), name='text_pattern_ops'), name='hh_resume_first_name_prefix'),
+        ),
+        AddIndexConcurrently(
+            model_name='resume',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('title'), name='text_pattern_ops'), name='hh_resume_title_prefix'),
+        ),
+    ]
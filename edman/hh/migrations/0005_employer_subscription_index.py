@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hh', '0004_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='employer',
+            name='subscription',
+            field=models.PositiveIntegerField(db_index=True, null=True),
+        ),
+    ]
@@ -1,8 +1,12 @@
 from django.db import models
+from django.db.models.functions import Upper
+from django.contrib.postgres.indexes import OpClass
 from django.utils import timezone
 from django.contrib.sites.models import Site
 from django.contrib.auth import get_user_model
 
+from edman.utils.phones import normalize_phone
+
 User = get_user_model()
 
 class App(models.Model):
@@ -19,7 +23,8 @@ class Employer(models.Model):
     user_email = models.EmailField()
     access_token = models.CharField(max_length=255)
     refresh_token = models.CharField(max_length=255)
-    subscription = models.PositiveIntegerField(null=True)
+    # Webhook subscription id, events are routed by it (edman.hh.routing)
+    subscription = models.PositiveIntegerField(null=True, db_index=True)
 
     def __str__(self):
         return f"{self.user_id} {self.user_email}"
@@ -33,14 +38,64 @@ class Resume(models.Model):
     date = models.DateTimeField(default=timezone.now)
     raw_json = models.JSONField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Admin "^last_name", "^first_name", "^title" search: UPPER(column) LIKE 'TERM%'
+            models.Index(
+                OpClass(Upper("last_name"), name="text_pattern_ops"), name="hh_resume_last_name_prefix",
+            ),
+            models.Index(
+                OpClass(Upper("first_name"), name="text_pattern_ops"), name="hh_resume_first_name_prefix",
+            ),
+            models.Index(
+                OpClass(Upper("title"), name="text_pattern_ops"), name="hh_resume_title_prefix",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.id} {self.last_name}"
 
 
 class Contact(models.Model):
+    PHONE_TYPES = ("cell", "home", "work")
+
     resume = models.ForeignKey(Resume, on_delete=models.CASCADE, related_name="contacts")
     type = models.CharField(max_length=50)
     value = models.CharField(max_length=255)
+    # Digits-only value of phone contacts, same form as PartnerLead.phone_normalized
+    phone_normalized = models.CharField(max_length=32, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            # Admin "=value" search: UPPER(value) = UPPER('term')
+            models.Index(Upper("value"), name="hh_contact_value_upper"),
+            # Not partial, so that LIKE 'prefix%' can use it
+            models.Index(
+                fields=["phone_normalized"], name="hh_contact_phone_norm", opclasses=["varchar_pattern_ops"],
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.resume}: {self.value}"
+
+    def save(self, *args, **kwargs):
+        self.set_phone_normalized()
+        super().save(*args, **kwargs)
+
+    def set_phone_normalized(self):
+        """Fill phone_normalized from value; bulk_create doesn't call save()"""
+        self.phone_normalized = normalize_phone(self.value) if self.type in self.PHONE_TYPES else ""
+
+
+class WebhookEvent(models.Model):
+    """
+    hh.ru webhook deliveries already taken for processing, one row per event key
+    (see edman.hh.pipeline.event_key). The unique key makes repeats of a delivery a
+    no-op even when the Redis dedup key has expired.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    action_type = models.CharField(max_length=100, blank=True)
+    received_at = models.DateTimeField(default=timezone.now, db_index=True)
 
     def __str__(self):
-        return f"{self.resume}: {self.value}"
\ No newline at end of file
+        return self.key
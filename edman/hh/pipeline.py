@@ -0,0 +1,249 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from edman.utils.http import get_session
+
+from .models import Contact, Resume, WebhookEvent
+from .routing import get_routes
+
+logger = logging.getLogger(__name__)
+
+RESUME_ACTIONS = ("NEW_RESPONSE_OR_INVITATION_VACANCY", "NEW_NEGOTIATION_VACANCY")
+
+
+def event_key(data):
+    """
+    Idempotency key of a webhook delivery: hh.ru's event id when present,
+    otherwise (subscription, resume, vacancy). None if the event can't be keyed.
+    """
+    subscription_id = data.get("subscription_id")
+    if data.get("id"):
+        return f"{subscription_id}:{data['id']}"
+    payload = data.get("payload") or {}
+    if payload.get("resume_id"):
+        return f"{subscription_id}:{payload['resume_id']}:{payload.get('vacancy_id') or ''}"
+    return None
+
+
+def process_events(events):
+    """
+    Process a batch of webhook events with one query per model instead of one per
+    event: processed keys and bulk inserts of resumes and contacts. Employers come
+    from the cached routing table (edman.hh.routing), resumes are fetched
+    concurrently. Keys are recorded in the transaction that saves the resumes, so
+    a crash before it commits leaves the batch to its redelivery, and one after
+    can't save it twice. Returns (event, error) for the events whose resume
+    couldn't be fetched; their keys are not recorded, so a retry gets through.
+    """
+    fresh = unseen_events(events)
+    if not fresh:
+        return []
+    routes = get_routes(data.get("subscription_id") for _key, data in fresh)
+    jobs = []
+    for key, data in fresh:
+        route = routes[str(data.get("subscription_id"))]
+        if route and data.get("action_type") in RESUME_ACTIONS:
+            jobs.append((key, data, route))
+    failed, fetched = [], {}
+    for (key, data, route), (resume_data, error) in zip(jobs, fetch_resumes(jobs)):
+        if error is not None:
+            logger.warning("Could not fetch resume for hh event %s", key, exc_info=error)
+            failed.append((key, data, error))
+        else:
+            fetched[id(data)] = (route, resume_data)
+    failed_events = {id(data) for _key, data, _error in failed}
+    done = [(key, data) for key, data in fresh if id(data) not in failed_events]
+
+    with transaction.atomic():
+        recorded = record_events(done)
+        # Another worker may have recorded (and saved) some of them meanwhile
+        saved = [fetched[id(data)] for key, data in done if id(data) in fetched and (not key or key in recorded)]
+        save_resumes(saved)
+    for route, resume_data in saved:
+        try:
+            notify(route, resume_data)
+        except Exception:
+            # The resume is saved and its key recorded: a retry would only skip it
+            logger.exception("Could not queue notifications for hh resume %s", resume_data.get("id"))
+    return [(data, error) for _key, data, error in failed]
+
+
+def unseen_events(events):
+    """
+    (key, event) for the batch's events whose keys aren't recorded yet, once per
+    key. Events without a key are always processed.
+    """
+    keyed = [(event_key(data), data) for data in events]
+    seen = set(
+        WebhookEvent.objects.filter(key__in=[key for key, _data in keyed if key]).values_list("key", flat=True)
+    )
+    fresh = []
+    for key, data in keyed:
+        if key in seen:
+            continue
+        if key:
+            seen.add(key)
+        fresh.append((key, data))
+    return fresh
+
+
+def record_events(keyed):
+    """
+    Insert the WebhookEvent rows of (key, event) pairs, returning the keys this
+    transaction inserted. A key another transaction is inserting waits for it to
+    commit and is then left out, so only one of them saves the resume.
+    """
+    keyed = [(key, data) for key, data in keyed if key]
+    if not keyed:
+        return set()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {WebhookEvent._meta.db_table} (key, action_type, received_at)
+            SELECT key, action_type, %s FROM unnest(%s::varchar[], %s::varchar[]) AS event(key, action_type)
+            ON CONFLICT (key) DO NOTHING
+            RETURNING key
+            """,
+            [
+                timezone.now(),
+                [key for key, _data in keyed],
+                [data.get("action_type") or "" for _key, data in keyed],
+            ],
+        )
+        return {key for (key,) in cursor.fetchall()}
+
+
+def fetch_resumes(jobs):
+    """
+    Fetch the resumes of (key, event, route) jobs concurrently over the pooled HTTP
+    session, returning (resume, None) or (None, error) per job in order.
+    """
+    if not jobs:
+        return []
+
+    def fetch(route, data):
+        return fetch_resume(route, data["payload"]["resume_id"])
+
+    # At most one thread per pooled connection to api.hh.ru
+    workers = min(len(jobs), getattr(settings, "HTTP_POOL_MAXSIZE", 10))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch, route, data) for _key, data, route in jobs]
+    results = []
+    for future in futures:
+        error = future.exception()
+        results.append((None, error) if error is not None else (future.result(), None))
+    return results
+
+
+def fetch_resume(route, resume_id):
+    headers = {"Authorization": f"Bearer {route['access_token']}"}
+    response = get_session().get(f"https://api.hh.ru/resumes/{resume_id}", headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+
+def save_resumes(fetched):
+    """Bulk insert the fetched resumes and their contacts, returning the resumes"""
+    resumes = Resume.objects.bulk_create(
+        Resume(
+            owner_id=route["owner_id"],
+            last_name=resume_data.get("last_name"),
+            first_name=resume_data.get("first_name"),
+            title=resume_data.get("title"),
+            raw_json=resume_data,
+        )
+        for route, resume_data in fetched
+    )
+    contacts = []
+    for (_route, resume_data), resume in zip(fetched, resumes):
+        for item in resume_data.get("contact", []):
+            type_obj = item.get("type") or {}
+            contact_type = type_obj.get("id")
+            value = item.get("contact_value")
+            if contact_type and value:
+                contact_obj = Contact(resume=resume, type=contact_type, value=value)
+                contact_obj.set_phone_normalized()
+                contacts.append(contact_obj)
+    Contact.objects.bulk_create(contacts)
+    return resumes
+
+
+def notify(route, resume_data):
+    """Queue the employer's messenger greetings and Bitrix leads for a new resume"""
+    from .views import send_message
+
+    contact = resume_data.get("contact", [])
+    # Поиск подключенных мессенджеров
+    for item in contact:
+        if item.get("kind") != "phone":
+            continue
+        for sender in route["senders"]:
+            if sender["type"] == "waweb":
+                cleaned = re.sub(r'\D', '', item.get("contact_value") or "")
+                headers = {"apikey": sender["key"]}
+                payload = {
+                    "number": cleaned,
+                    "text": sender["text"],
+                    "linkPreview": True,
+                }
+                send_message.delay(sender["uri"], payload, headers)
+
+    last_name = resume_data.get("last_name")
+    first_name = resume_data.get("first_name")
+    title = resume_data.get("title")
+    area = resume_data.get("area")
+    city = area.get("name") if area else None
+    skill_set = resume_data.get("skill_set", [])
+    for bitrix in route["bitrixes"]:
+        headers = {
+            "Content-Type": "application/json"
+        }
+        payload = {
+            "fields": {
+                "TITLE": f"Резюме {last_name} {first_name} - {title}",
+                "NAME": first_name,
+                "LAST_NAME": last_name,
+                "SECOND_NAME": resume_data.get("middle_name"),
+                "BIRTHDATE": resume_data.get("birth_date"),
+                "ADDRESS_CITY": city,
+                "COMMENTS": f"Навыки: {', '.join(skill_set)}",
+                "SOURCE_ID": bitrix["source_id"],
+                "ASSIGNED_BY_ID": bitrix["assign_by_id"],
+                "SOURCE_DESCRIPTION": route["user_id"],
+            },
+            "params": {
+                "REGISTER_SONET_EVENT": "Y"
+            }
+        }
+        # Добавление контактов в payload
+        emails = []
+        phones = []
+        ims = []
+
+        for item in contact:
+            type_obj = item.get("type") or {}
+            contact_type = type_obj.get("id")
+            value = item.get("contact_value")
+            if contact_type and value:
+                if contact_type == "email":
+                    emails.append({"VALUE": value, "VALUE_TYPE": "WORK"})
+                elif contact_type == "cell":
+                    phones.append({"VALUE": value, "VALUE_TYPE": "WORK"})
+                elif contact_type == "telegram":
+                    ims.append({"VALUE": value, "VALUE_TYPE": "TELEGRAM"})
+                elif contact_type == "whatsapp":
+                    ims.append({"VALUE": value, "VALUE_TYPE": "WHATSAPP"})
+
+        if emails:
+            payload["fields"]["EMAIL"] = emails
+        if phones:
+            payload["fields"]["PHONE"] = phones
+        if ims:
+            payload["fields"]["IM"] = ims
+
+        send_message.delay(bitrix["uri"] + "crm.lead.add", payload, headers)
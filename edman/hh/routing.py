@@ -0,0 +1,90 @@
+import time
+from typing import Any
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Employer
+
+VERSION_KEY = "hh_routes_version"
+
+
+class LocalRoutes:
+    """Routes of the current version in this process: {subscription: route or None}"""
+
+    def __init__(self):
+        self.version: int | None = None
+        self.routes: dict[str, dict[str, Any] | None] = {}
+
+
+_local = LocalRoutes()
+
+
+def compile_route(employer):
+    """Everything event processing needs from an employer, as a plain picklable dict"""
+    return {
+        "employer_id": employer.id,
+        "owner_id": employer.owner_id,
+        "user_id": employer.user_id,
+        "access_token": employer.access_token,
+        "senders": [
+            {"type": sender.type, "uri": sender.uri, "key": sender.key, "text": sender.text}
+            for sender in employer.senders.all()
+        ],
+        "bitrixes": [
+            {"uri": bitrix.uri, "source_id": bitrix.source_id, "assign_by_id": bitrix.assign_by_id}
+            for bitrix in employer.bitrixes.all()
+        ],
+    }
+
+
+def routes_version():
+    # Seeded from the clock so an evicted version never comes back to a stale one
+    return cache.get_or_set(VERSION_KEY, time.time_ns, timeout=None)
+
+
+def get_routes(subscriptions):
+    """
+    Routes of the given subscription ids, {subscription: route or None}. Served from
+    this process, then from the cache, then from one query for whatever is left;
+    unknown subscriptions are cached as None too. A warm call costs one cache read
+    of the routes version and no queries.
+    """
+    subscriptions = {str(s) for s in subscriptions}
+    version = routes_version()
+    if _local.version != version:
+        _local.version, _local.routes = version, {}
+    local = _local.routes
+
+    missing = subscriptions - local.keys()
+    if missing:
+        cached = cache.get_many([f"hh_route_{version}_{s}" for s in missing])
+        for subscription in missing:
+            key = f"hh_route_{version}_{subscription}"
+            if key in cached:
+                local[subscription] = cached[key] or None
+        missing -= local.keys()
+    if missing:
+        routes = dict.fromkeys(missing)
+        queryset = (
+            Employer.objects.filter(subscription__in=[int(s) for s in missing if s.isdigit()])
+            .prefetch_related("senders", "bitrixes")
+            .order_by("id")
+        )
+        for employer in queryset:
+            if routes[str(employer.subscription)] is None:
+                routes[str(employer.subscription)] = compile_route(employer)
+        timeout = getattr(settings, "HH_ROUTES_CACHE_TTL", 3600)
+        # False marks a known miss, the cache can't tell a stored None from no entry
+        cache.set_many({f"hh_route_{version}_{s}": route or False for s, route in routes.items()}, timeout=timeout)
+        local.update(routes)
+    return {s: local[s] for s in subscriptions}
+
+
+def invalidate_routes():
+    """Drop every cached route, in all processes, by moving to a new routes version"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+    _local.version = None
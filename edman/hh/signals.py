@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from edman.sender.models import Bitrix
+from edman.sender.models import Sender
+
+from .models import Employer
+from .routing import invalidate_routes
+
+
+@receiver(post_save, sender=Employer)
+@receiver(post_delete, sender=Employer)
+@receiver(post_save, sender=Sender)
+@receiver(post_delete, sender=Sender)
+@receiver(post_save, sender=Bitrix)
+@receiver(post_delete, sender=Bitrix)
+@receiver(m2m_changed, sender=Sender.employers.through)
+@receiver(m2m_changed, sender=Bitrix.employers.through)
+def invalidate_routes_on_change(sender, **kwargs):
+    # After commit, so a concurrent reader can't cache the old rows again
+    transaction.on_commit(invalidate_routes)
@@ -0,0 +1,12 @@
+from celery import shared_task
+
+from .pipeline import process_events
+
+
+# Named after its old home in edman.hh.views, so events already queued still run
+@shared_task(name="edman.hh.views.event_processor")
+def event_processor(data):
+    """Process one event queued by the receiver when HH_EVENTS_STREAM is off"""
+    for _event, error in process_events([data]):
+        raise error
+    return data
@@ -1,3 +1,543 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import pytest
+import requests
+from django.contrib.admin.sites import site as admin_site
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from redis.exceptions import ConnectionError as RedisConnectionError
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+
+from edman.hh import events
+from edman.hh import pipeline
+from edman.hh import routing
+from edman.hh import tasks
+from edman.hh import views
+from edman.hh.consumer import EventConsumer
+from edman.hh.models import App
+from edman.hh.models import Contact
+from edman.hh.models import Employer
+from edman.hh.models import Resume
+from edman.hh.models import WebhookEvent
+from edman.hh.pipeline import event_key
+from edman.hh.routing import get_routes
+from edman.sender.models import Bitrix
+from edman.sender.models import Sender
+from edman.utils import http
+from edman.utils.admin import EstimatedCountPaginator
+
+
+RESUME = {
+    "last_name": "Ivanov",
+    "first_name": "Ivan",
+    "title": "Driver",
+    "area": {"name": "Moscow"},
+    "skill_set": ["driving"],
+    "contact": [
+        {"kind": "phone", "type": {"id": "cell"}, "contact_value": "+7 999 000-00-00"},
+        {"kind": "email", "type": {"id": "email"}, "contact_value": "ivan@example.com"},
+    ],
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Dedup keys and employer routes, rows behind them are rolled back between tests
+    cache.clear()
+
+
+@pytest.mark.django_db
+class TestHotViewBudgets:
+    """Query and time budgets of the hh pages and admin, seeded past one page"""
+
+    @pytest.fixture
+    def seeded(self, user):
+        app = App.objects.create(
+            site=Site.objects.get_current(), redirect_uri="https://edman.test/hh/finish/", client_id="id", client_secret="secret"
+        )
+        Employer.objects.bulk_create(
+            Employer(
+                owner=user, app=app, user_id=str(i), user_email=f"hr{i}@example.com",
+                access_token="token", refresh_token="refresh", subscription=i,
+            )
+            for i in range(60)
+        )
+        resumes = Resume.objects.bulk_create(Resume(owner=user, last_name=f"Ivanov {i}") for i in range(60))
+        Contact.objects.bulk_create(
+            Contact(resume=resume, type=contact_type, value=value)
+            for resume in resumes
+            for contact_type, value in (("cell", "+7 999 000-00-00"), ("email", "hr@example.com"))
+        )
+
+    def test_auth_page(self, client, user, seeded, perf_budget):
+        client.force_login(user)
+        with perf_budget(queries=5, seconds=0.5):
+            response = client.get("/hh/")
+        assert response.status_code == 200
+
+    def test_event_handler(self, client, perf_budget):
+        # No transaction and no queries: the receiver only queues the event
+        event = {"subscription_id": "1", "action_type": "NEW_NEGOTIATION_VACANCY"}
+        with mock.patch.object(tasks.event_processor, "delay") as delay, perf_budget(queries=0, seconds=0.2):
+            response = client.post("/hh/events/", data=event, content_type="application/json")
+        assert response.status_code == 200
+        delay.assert_called_once()
+
+    @pytest.mark.parametrize(
+        ("url", "queries"),
+        [
+            ("/admin/hh/employer/", 7),
+            ("/admin/hh/resume/", 7),
+            ("/admin/hh/contact/", 7),
+            ("/admin/hh/contact/?q=999", 7),
+        ],
+    )
+    def test_admin(self, admin_client, seeded, perf_budget, url, queries):
+        with perf_budget(queries=queries, seconds=0.5):
+            response = admin_client.get(url)
+        assert response.status_code == 200
+
+
+@pytest.mark.django_db
+class TestEventDedup:
+    event = {
+        "id": "123456",
+        "subscription_id": "1",
+        "action_type": "NEW_NEGOTIATION_VACANCY",
+        "payload": {"resume_id": "abc", "vacancy_id": "42"},
+    }
+
+    @pytest.fixture
+    def employer(self, user):
+        app = App.objects.create(
+            site=Site.objects.get_current(), redirect_uri="https://edman.test/hh/finish/", client_id="id", client_secret="secret"
+        )
+        return Employer.objects.create(
+            owner=user, app=app, user_id="1", user_email="hr@example.com",
+            access_token="token", refresh_token="refresh", subscription=1,
+        )
+
+    def test_event_key(self):
+        assert event_key(self.event) == "1:123456"
+        assert event_key({**self.event, "id": None}) == "1:abc:42"
+        assert event_key({"subscription_id": "1"}) is None
+
+    def test_repeated_delivery_is_queued_once(self, client):
+        with mock.patch.object(tasks.event_processor, "delay") as delay:
+            for _ in range(3):
+                response = client.post("/hh/events/", data=self.event, content_type="application/json")
+                assert response.status_code == 200
+        delay.assert_called_once()
+
+    def test_failed_enqueue_releases_key(self, client):
+        with mock.patch.object(tasks.event_processor, "delay", side_effect=ConnectionError), pytest.raises(ConnectionError):
+            client.post("/hh/events/", data=self.event, content_type="application/json")
+        with mock.patch.object(tasks.event_processor, "delay") as delay:
+            client.post("/hh/events/", data=self.event, content_type="application/json")
+        delay.assert_called_once()
+
+    def test_processor_skips_processed_event(self, employer):
+        with mock.patch.object(pipeline, "fetch_resume", return_value=RESUME) as fetch:
+            tasks.event_processor(self.event)
+            tasks.event_processor(self.event)
+        fetch.assert_called_once_with(get_routes([1])["1"], "abc")
+        assert Resume.objects.count() == 1
+        assert WebhookEvent.objects.filter(key="1:123456").count() == 1
+
+    def test_failed_processing_can_be_retried(self, employer):
+        with (
+            mock.patch.object(pipeline, "fetch_resume", side_effect=requests.HTTPError),
+            pytest.raises(requests.HTTPError),
+        ):
+            tasks.event_processor(self.event)
+        assert not WebhookEvent.objects.exists()
+
+
+class TestEventReceiver:
+    event = {
+        "id": "654321",
+        "subscription_id": "1",
+        "action_type": "NEW_NEGOTIATION_VACANCY",
+        "payload": {"resume_id": "abc", "vacancy_id": "42"},
+    }
+
+    @pytest.mark.parametrize(
+        "body",
+        ["not json", "[]", '{"subscription_id": "1"}', '{"subscription_id": "1", "action_type": "X", "payload": 1}'],
+    )
+    def test_rejects_invalid_events(self, client, body):
+        with mock.patch.object(tasks.event_processor, "delay") as delay:
+            response = client.post("/hh/events/", data=body, content_type="application/json")
+        assert response.status_code == 400
+        delay.assert_not_called()
+
+    def test_appends_to_stream(self, client, settings):
+        settings.HH_EVENTS_STREAM = "hh:events"
+        stream = mock.Mock(set=mock.Mock(return_value=True), xadd=mock.Mock())
+        with (
+            mock.patch.object(events, "get_redis_client", return_value=stream),
+            mock.patch.object(tasks.event_processor, "delay") as delay,
+        ):
+            response = client.post("/hh/events/", data=self.event, content_type="application/json")
+        assert response.status_code == 200
+        delay.assert_not_called()
+        (name, fields), _kwargs = stream.xadd.call_args
+        assert name == "hh:events"
+        assert json.loads(fields["data"]) == self.event
+        stream.set.assert_called_once_with("hh_event_seen_1:654321", 1, nx=True, ex=settings.HH_EVENT_DEDUP_TTL)
+
+    def test_asgi_receiver_appends_to_stream(self, settings):
+        settings.HH_EVENTS_STREAM = "hh:events"
+        stream = mock.Mock(set=mock.AsyncMock(return_value=True), xadd=mock.AsyncMock())
+        with (
+            mock.patch.object(events, "get_stream_client", return_value=stream),
+            mock.patch.object(tasks.event_processor, "delay") as delay,
+        ):
+            status, _text = asyncio.run(events.areceive_event(json.dumps(self.event)))
+        assert status == 200
+        delay.assert_not_called()
+        stream.set.assert_awaited_once_with("hh_event_seen_1:654321", 1, nx=True, ex=settings.HH_EVENT_DEDUP_TTL)
+        stream.xadd.assert_awaited_once()
+
+    def test_wsgi_receiver_shares_one_redis_client(self, monkeypatch):
+        monkeypatch.setattr(events, "_redis_client", None)
+        assert events.get_redis_client() is events.get_redis_client()
+
+    def test_falls_back_to_celery_when_redis_fails(self, client, settings):
+        settings.HH_EVENTS_STREAM = "hh:events"
+        stream = mock.Mock(set=mock.Mock(return_value=True), xadd=mock.Mock(side_effect=RedisConnectionError))
+        with (
+            mock.patch.object(events, "get_redis_client", return_value=stream),
+            mock.patch.object(tasks.event_processor, "delay") as delay,
+        ):
+            response = client.post("/hh/events/", data=self.event, content_type="application/json")
+        assert response.status_code == 200
+        delay.assert_called_once_with(self.event)
+
+    def test_loadtest_command(self):
+        out = StringIO()
+        with mock.patch.object(tasks.event_processor, "delay") as delay:
+            call_command("loadtest_hh_events", requests=20, concurrency=5, host="testserver", stdout=out)
+        assert delay.call_count == 20
+        assert "req/s per worker" in out.getvalue()
+        assert "0 non-200" in out.getvalue()
+
+
+def make_event(i, subscription_id=1):
+    return {
+        "id": str(i),
+        "subscription_id": str(subscription_id),
+        "action_type": "NEW_RESPONSE_OR_INVITATION_VACANCY",
+        "payload": {"resume_id": f"r{i}", "vacancy_id": "42"},
+    }
+
+
+@pytest.mark.django_db
+class TestEventPipeline:
+    @pytest.fixture
+    def employers(self, user):
+        app = App.objects.create(
+            site=Site.objects.get_current(), redirect_uri="https://edman.test/hh/finish/", client_id="id", client_secret="secret"
+        )
+        employers = []
+        for i in range(1, 4):
+            employer = Employer.objects.create(
+                owner=user, app=app, user_id=str(i), user_email=f"hr{i}@example.com",
+                access_token="token", refresh_token="refresh", subscription=i,
+            )
+            Sender.objects.create(type="waweb", uri="https://wa.example.com/send", key="key").employers.add(employer)
+            Bitrix.objects.create(
+                uri="https://b24.example.com/rest/1/x/", crm_category_id=1, assign_by_id=1, source_id="HH"
+            ).employers.add(employer)
+            employers.append(employer)
+        return employers
+
+    def run_batch(self, events):
+        with (
+            mock.patch.object(pipeline, "fetch_resume", return_value=RESUME),
+            mock.patch.object(views.send_message, "delay") as send,
+            CaptureQueriesContext(connection) as queries,
+        ):
+            failed = pipeline.process_events(events)
+        return failed, len(queries), send
+
+    def test_batch_queries_do_not_grow_with_batch_size(self, employers):
+        _failed, cold, _send = self.run_batch([make_event(i, i % 3 + 1) for i in range(3)])
+        _failed, small, _send = self.run_batch([make_event(i, i % 3 + 1) for i in range(3, 6)])
+        failed, large, send = self.run_batch([make_event(i, i % 3 + 1) for i in range(6, 66)])
+        assert failed == []
+        # Employers, senders and bitrixes only while the routes are cold
+        assert cold == small + 3
+        assert small == large
+        assert Resume.objects.count() == 66
+        assert Contact.objects.count() == 66 * 2
+        assert Contact.objects.filter(phone_normalized="79990000000").count() == 66
+        # A whatsapp greeting and a Bitrix lead per resume
+        assert send.call_count == 60 * 2
+
+    def test_skips_duplicates_and_unknown_subscriptions(self, employers):
+        events = [make_event(1), make_event(1), make_event(2, subscription_id=99), make_event(3, subscription_id="x")]
+        failed, _queries, _send = self.run_batch(events)
+        assert failed == []
+        assert Resume.objects.count() == 1
+        assert WebhookEvent.objects.count() == 3
+
+    def test_failed_fetch_is_returned_and_released(self, employers):
+        def fetch(employer, resume_id):
+            if resume_id == "r2":
+                raise requests.HTTPError
+            return RESUME
+
+        events = [make_event(1), make_event(2)]
+        with mock.patch.object(pipeline, "fetch_resume", side_effect=fetch), mock.patch.object(views.send_message, "delay"):
+            failed = pipeline.process_events(events)
+        assert [event for event, _error in failed] == [events[1]]
+        assert Resume.objects.count() == 1
+        assert list(WebhookEvent.objects.values_list("key", flat=True)) == ["1:1"]
+
+    def test_fetches_resumes_concurrently(self, employers):
+        # Every fetch waits for the other two: sequential fetches would break the barrier
+        barrier = threading.Barrier(3, timeout=5)
+
+        def fetch(employer, resume_id):
+            barrier.wait()
+            return RESUME
+
+        with mock.patch.object(pipeline, "fetch_resume", side_effect=fetch), mock.patch.object(views.send_message, "delay"):
+            failed = pipeline.process_events([make_event(i) for i in range(3)])
+        assert failed == []
+        assert Resume.objects.count() == 3
+
+    def test_failed_save_records_no_keys(self, employers):
+        with mock.patch.object(pipeline, "save_resumes", side_effect=DatabaseError), pytest.raises(DatabaseError):
+            self.run_batch([make_event(1)])
+        assert not WebhookEvent.objects.exists()
+
+        self.run_batch([make_event(1)])
+        assert Resume.objects.count() == 1
+
+    def test_failed_notify_keeps_keys(self, employers):
+        with mock.patch.object(pipeline, "notify", side_effect=ConnectionError):
+            failed, _queries, _send = self.run_batch([make_event(1), make_event(2)])
+        assert failed == []
+        assert WebhookEvent.objects.count() == 2
+
+        self.run_batch([make_event(1), make_event(2)])
+        assert Resume.objects.count() == 2
+
+    def test_key_recorded_meanwhile_is_not_saved_again(self, employers):
+        event = make_event(1)
+        WebhookEvent.objects.create(key=event_key(event))
+        with mock.patch.object(pipeline, "unseen_events", return_value=[(event_key(event), event)]):
+            self.run_batch([event])
+        assert not Resume.objects.exists()
+
+
+@pytest.mark.django_db
+class TestRouting:
+    @pytest.fixture
+    def employer(self, user):
+        app = App.objects.create(
+            site=Site.objects.get_current(), redirect_uri="https://edman.test/hh/finish/", client_id="id", client_secret="secret"
+        )
+        employer = Employer.objects.create(
+            owner=user, app=app, user_id="7", user_email="hr@example.com",
+            access_token="token", refresh_token="refresh", subscription=7,
+        )
+        Sender.objects.create(type="waweb", uri="https://wa.example.com/send", key="key").employers.add(employer)
+        return employer
+
+    def test_warm_routes_cost_no_queries(self, employer, django_assert_num_queries):
+        with django_assert_num_queries(3):
+            routes = get_routes(["7", "8", "x"])
+        assert routes["7"]["access_token"] == "token"
+        assert routes["7"]["senders"] == [
+            {"type": "waweb", "uri": "https://wa.example.com/send", "key": "key", "text": None}
+        ]
+        assert routes["8"] is None
+        assert routes["x"] is None
+        with django_assert_num_queries(0):
+            assert get_routes([7, 8]) == {"7": routes["7"], "8": None}
+
+    def test_shared_cache_serves_other_processes(self, employer, django_assert_num_queries):
+        route = get_routes(["7"])["7"]
+        routing._local.routes.clear()
+        with django_assert_num_queries(0):
+            assert get_routes(["7"])["7"] == route
+
+    def test_changes_invalidate_routes(self, employer, django_capture_on_commit_callbacks):
+        get_routes(["7"])
+        with django_capture_on_commit_callbacks(execute=True):
+            Bitrix.objects.create(
+                uri="https://b24.example.com/rest/1/x/", crm_category_id=1, assign_by_id=1, source_id="HH"
+            ).employers.add(employer)
+        assert len(get_routes(["7"])["7"]["bitrixes"]) == 1
+        with django_capture_on_commit_callbacks(execute=True):
+            employer.access_token = "new token"
+            employer.save()
+        assert get_routes(["7"])["7"]["access_token"] == "new token"
+        with django_capture_on_commit_callbacks(execute=True):
+            employer.delete()
+        assert get_routes(["7"])["7"] is None
+
+
+@pytest.mark.django_db
+class TestEventConsumer:
+    def make_consumer(self, entries, times_delivered=1):
+        client = mock.Mock()
+        client.xautoclaim.return_value = [b"0-0", [], []]
+        client.xreadgroup.return_value = [[b"hh:events", entries]]
+        client.xpending_range.return_value = [{"times_delivered": times_delivered}]
+        return EventConsumer(client, "test", stream="hh:events", batch_size=10)
+
+    def test_acks_processed_and_malformed_entries(self):
+        consumer = self.make_consumer([(b"1-0", {b"data": json.dumps(make_event(1))}), (b"2-0", {b"data": b"{"})])
+        with mock.patch("edman.hh.consumer.process_events", return_value=[]) as process:
+            assert consumer.run_once() == 2
+        process.assert_called_once_with([make_event(1)])
+        consumer.client.xack.assert_called_once_with("hh:events", "hh-events", b"2-0", b"1-0")
+
+    @pytest.mark.parametrize(("times_delivered", "acked"), [(1, False), (5, True)])
+    def test_failed_entries_stay_pending(self, times_delivered, acked):
+        event = make_event(1)
+        consumer = self.make_consumer([(b"1-0", {b"data": json.dumps(event)})], times_delivered)
+        with mock.patch("edman.hh.consumer.process_events", side_effect=lambda events: [(events[0], RuntimeError())]):
+            consumer.run_once()
+        assert consumer.client.xack.called is acked
+
+    def test_reclaims_stale_entries_first(self):
+        consumer = self.make_consumer([])
+        consumer.client.xautoclaim.return_value = [b"0-0", [(b"1-0", {b"data": json.dumps(make_event(1))})], []]
+        with mock.patch("edman.hh.consumer.process_events", return_value=[]):
+            consumer.run_once()
+        consumer.client.xreadgroup.assert_not_called()
+        consumer.client.xack.assert_called_once_with("hh:events", "hh-events", b"1-0")
+
+
+class TestHttpClient:
+    def test_one_session_per_process(self):
+        session = http.get_session()
+        assert http.get_session() is session
+        with mock.patch("os.getpid", return_value=-1):
+            assert http.get_session() is not session
+
+    def test_isolated_sessions_share_pools(self):
+        session = http.isolated_session()
+        assert session is not http.get_session()
+        assert session.get_adapter("https://api.hh.ru/") is http.get_session().get_adapter("https://api.hh.ru/")
+
+    def test_shared_session_keeps_no_cookies(self):
+        session = http.get_session()
+        response = mock.Mock(_original_response=mock.Mock(msg=mock.Mock(get_all=lambda *_args: ["sid=1; Path=/"])))
+        request = requests.Request("GET", "https://api.hh.ru/me").prepare()
+        requests.cookies.extract_cookies_to_jar(session.cookies, request, response)
+        assert not session.cookies
+
+    def test_default_timeout(self):
+        adapter = http.get_session().get_adapter("https://api.hh.ru/")
+        request = requests.Request("GET", "https://api.hh.ru/me").prepare()
+        with mock.patch.object(HTTPAdapter, "send") as send:
+            adapter.send(request)
+            adapter.send(request, timeout=2)
+        assert send.call_args_list[0].kwargs["timeout"] == (5, 30)
+        assert send.call_args_list[1].kwargs["timeout"] == 2
+
+    @pytest.mark.parametrize(
+        ("method", "status", "retried"),
+        [("GET", 503, True), ("GET", 429, True), ("POST", 429, True), ("POST", 503, False), ("GET", 404, False)],
+    )
+    def test_retries(self, method, status, retried):
+        retry = http.get_session().get_adapter("https://api.hh.ru/").max_retries
+        assert retry.is_retry(method, status) is retried
+
+    @pytest.mark.parametrize(("header", "wait"), [("3600", 30), ("2", 2)])
+    def test_retry_after_is_capped(self, settings, header, wait):
+        settings.HTTP_MAX_RETRY_AFTER = 30
+        retry = http.get_session().get_adapter("https://api.hh.ru/").max_retries
+        response = HTTPResponse(status=429, headers={"Retry-After": header})
+        assert retry.get_retry_after(response) == wait
+        assert retry.new(total=1).get_retry_after(response) == wait
+
+
+@pytest.mark.django_db
+class TestScalableAdmin:
+    @pytest.fixture
+    def contacts(self, user):
+        resumes = Resume.objects.bulk_create(Resume(owner=user, last_name=f"Ivanov {i}") for i in range(5000))
+        Contact.objects.bulk_create(
+            Contact(resume=resume, type="cell", value=f"+7 999 {i:07d}", phone_normalized=f"7999{i:07d}")
+            for i, resume in enumerate(resumes)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE hh_resume")
+            cursor.execute("ANALYZE hh_contact")
+
+    @pytest.mark.parametrize(
+        ("model", "term"),
+        [
+            (Contact, "79990001234"),
+            (Contact, "hr@example.com"),
+            (Contact, "ivanov 1234"),
+            (Resume, "ivanov 12"),
+            (Resume, "12"),
+            (Resume, "python"),
+        ],
+    )
+    def test_search_uses_indexes(self, contacts, model, term):
+        model_admin = admin_site._registry[model]
+        queryset, _ = model_admin.get_search_results(RequestFactory().get("/"), model.objects.all(), term)
+
+        assert "Seq Scan" not in queryset.explain()
+
+    def test_phone_prefix_uses_index(self, contacts):
+        plan = Contact.objects.filter(phone_normalized__startswith="7999000123").explain()
+
+        assert "hh_contact_phone_norm" in plan
+        assert "Seq Scan" not in plan
+
+    def test_estimated_count_skips_count_query(self, contacts):
+        paginator = EstimatedCountPaginator(Contact.objects.order_by("pk"), 50)
+        paginator.exact_below = 1000
+
+        with CaptureQueriesContext(connection) as queries:
+            count = paginator.count
+
+        assert 4000 < count < 6000
+        assert paginator.count_is_estimate
+        assert not any("COUNT(" in query["sql"] for query in queries.captured_queries)
+
+    def test_exact_count_below_threshold(self, contacts):
+        paginator = EstimatedCountPaginator(Contact.objects.filter(resume__last_name="Ivanov 1"), 50)
+
+        assert paginator.count == 1
+        assert not paginator.count_is_estimate
+
+    def test_search_by_owner_email(self, contacts, user):
+        model_admin = admin_site._registry[Resume]
+        queryset, _ = model_admin.get_search_results(RequestFactory().get("/"), Resume.objects.all(), user.email.upper())
+
+        assert queryset.count() == 5000
+
+    def test_contact_search_by_resume_name(self, contacts):
+        model_admin = admin_site._registry[Contact]
+        queryset, _ = model_admin.get_search_results(RequestFactory().get("/"), Contact.objects.all(), "Ivanov 4999")
+
+        assert list(queryset.values_list("value", flat=True)) == ["+7 999 0004999"]
+
+    def test_changelist_marks_estimated_count(self, contacts, admin_client):
+        with mock.patch.object(EstimatedCountPaginator, "exact_below", 1000):
+            response = admin_client.get(reverse("admin:hh_contact_changelist"))
+
+        assert response.status_code == 200
+        assert '<span title="Approximate count">~' in response.content.decode()
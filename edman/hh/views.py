@@ -1,9 +1,8 @@
-import re
 import uuid
-import json
 import redis
 import requests
 from celery import shared_task
+from django.db import transaction
 from django.shortcuts import render, redirect
 from django.contrib.sites.models import Site
 from django.views.decorators.csrf import csrf_exempt
@@ -12,7 +11,10 @@ from django.contrib.auth import get_user_model
 from django.http import HttpResponseBadRequest, HttpResponse
 
 from django.contrib import messages
-from .models import App, Employer, Resume, Contact
+from edman.utils.http import get_session
+from .events import receive_event
+from .models import App, Employer
+from .routing import invalidate_routes
 User = get_user_model()
 
 r = redis.Redis(host='localhost', port=6379, db=0)
@@ -22,7 +24,7 @@ TOKEN_URL = "https://hh.ru/oauth/token"
 @shared_task()
 def send_message(url, payload, headers):
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=10)
+        resp = get_session().post(url, json=payload, headers=headers, timeout=10)
         resp.raise_for_status()
         return resp.text
     except requests.exceptions.HTTPError as err:
@@ -46,7 +48,7 @@ def refresh_hh_token(employer_id: int):
         "refresh_token": refresh_token,
     }
 
-    response = requests.post(TOKEN_URL, data=data, headers=headers)
+    response = get_session().post(TOKEN_URL, data=data, headers=headers)
     if response.status_code != 200:
         raise Exception(
             f"Failed to refresh token: {response.status_code} {response.text}"
@@ -61,6 +63,7 @@ def refresh_hh_token(employer_id: int):
         access_token=new_access_token,
         refresh_token=new_refresh_token,
     )
+    invalidate_routes()
 
     # планируем следующий запуск: время жизни + 10 секунд
     refresh_hh_token.apply_async(
@@ -68,127 +71,17 @@ def refresh_hh_token(employer_id: int):
         countdown=expires_in + 10,
     )
 
-
-@shared_task()
-def event_processor(data):
-    subscription_id = data.get("subscription_id")
-    employer = Employer.objects.filter(subscription=subscription_id).first()
-    if employer:
-        action_type = data.get("action_type")
-        if action_type in ["NEW_RESPONSE_OR_INVITATION_VACANCY", "NEW_NEGOTIATION_VACANCY"]:
-            payload = data.get("payload")
-            resume_id = payload.get("resume_id")
-            headers = {"Authorization": f"Bearer {employer.access_token}"}
-            resume_url = f"https://api.hh.ru/resumes/{resume_id}"
-            resume_data = requests.get(resume_url, headers=headers)
-            resume_data.raise_for_status()
-            resume_data = resume_data.json()
-            last_name = resume_data.get("last_name")
-            first_name = resume_data.get("first_name")
-            title = resume_data.get("title")
-            contact = resume_data.get("contact", [])
-            middle_name = resume_data.get("middle_name")
-            birth_date_value = resume_data.get("birth_date")
-            area = resume_data.get("area")
-            city = area.get("name") if area else None
-            skill_set = resume_data.get("skill_set", [])
-
-            # Сохраняем резюме
-            resume = Resume.objects.create(
-                owner=employer.owner,
-                last_name=last_name,
-                first_name=first_name,
-                title=title,
-                raw_json=resume_data
-            )
-
-            # Сохраняем контакты
-            for item in contact:
-                kind = item.get("kind")
-                type_obj = item.get("type") or {}
-                contact_type = type_obj.get("id")
-                value = item.get("contact_value")
-                if contact_type and value:
-                    Contact.objects.create(
-                        resume=resume,
-                        type=contact_type,
-                        value=value
-                    )
-                # Поиск подключенных мессенджеров 
-                senders = employer.senders.all()
-                if senders:
-                    for sender in senders:
-                        if sender.type == "waweb" and kind == "phone":
-                            cleaned = re.sub(r'\D', '', value)
-                            headers = {"apikey": sender.key}
-                            payload = {
-                                "number": cleaned,
-                                "text": sender.text,
-                                "linkPreview": True,
-                            }
-
-                            send_message.delay(sender.uri, payload, headers)
-
-            bitrixes = employer.bitrixes.all()
-            if bitrixes:
-                for bitrix in bitrixes:
-                    headers = {
-                        "Content-Type": "application/json"
-                    }
-                    payload = {
-                        "fields": {
-                            "TITLE": f"Резюме {last_name} {first_name} - {title}",
-                            "NAME": first_name,
-                            "LAST_NAME": last_name,
-                            "SECOND_NAME": middle_name,
-                            "BIRTHDATE": birth_date_value,
-                            "ADDRESS_CITY": city,
-                            "COMMENTS": f"Навыки: {', '.join(skill_set)}",
-                            "SOURCE_ID": bitrix.source_id,
-                            "ASSIGNED_BY_ID": bitrix.assign_by_id,
-                            "SOURCE_DESCRIPTION": employer.user_id,
-                        },
-                        "params": {
-                            "REGISTER_SONET_EVENT": "Y"
-                        }
-                    }
-                    # Добавление контактов в payload
-                    emails = []
-                    phones = []
-                    ims = []
-
-                    for item in contact:
-                        kind = item.get("kind")
-                        type_obj = item.get("type") or {}
-                        contact_type = type_obj.get("id")
-                        value = item.get("contact_value")
-                        if contact_type and value:
-                            if contact_type == "email":
-                                emails.append({"VALUE": value, "VALUE_TYPE": "WORK"})
-                            elif contact_type == "cell":
-                                phones.append({"VALUE": value, "VALUE_TYPE": "WORK"})
-                            elif contact_type == "telegram":
-                                ims.append({"VALUE": value, "VALUE_TYPE": "TELEGRAM"})
-                            elif contact_type == "whatsapp":
-                                ims.append({"VALUE": value, "VALUE_TYPE": "WHATSAPP"})
-
-                    if emails:
-                        payload["fields"]["EMAIL"] = emails
-                    if phones:
-                        payload["fields"]["PHONE"] = phones
-                    if ims:
-                        payload["fields"]["IM"] = ims
-
-                    send_message.delay(bitrix.uri + "crm.lead.add", payload, headers)
-
-    return data
-
 @csrf_exempt
+@transaction.non_atomic_requests
 def event_handler(request):
+    """
+    Webhook receiver: hands the event to the HH_EVENTS_STREAM Redis stream (or the
+    Celery broker) without touching the database. This is the WSGI path, on the sync
+    Redis client; under ASGI, config.asgi routes these POSTs to edman.hh.asgi instead.
+    """
     if request.method == "POST":
-        data = json.loads(request.body)
-        event_processor.delay(data)
-        return HttpResponse("Ok")
+        status, text = receive_event(request.body)
+        return HttpResponse(text, status=status)
     else:
         return redirect("auth_page")
 
@@ -239,7 +132,7 @@ def auth_finish(request):
         "client_secret": app_obj.client_secret,
         "redirect_uri": app_obj.redirect_uri,
     }
-    response = requests.post(TOKEN_URL, data=data)
+    response = get_session().post(TOKEN_URL, data=data)
     if response.status_code != 200:
         return HttpResponseBadRequest(f"Failed to get token {response.text}")
     tokens = response.json()
@@ -249,7 +142,7 @@ def auth_finish(request):
 
     # Информация о текущем пользователе
     headers = {"Authorization": f"Bearer {access_token}"}
-    user_data = requests.get("https://api.hh.ru/me", headers=headers)
+    user_data = get_session().get("https://api.hh.ru/me", headers=headers)
     if user_data.status_code != 200:
         return HttpResponseBadRequest(f"Failed to get user {user_data.text}")
     user_data = user_data.json()
@@ -281,7 +174,7 @@ def auth_finish(request):
             ]
         }
         api_url = "https://api.hh.ru/webhook/subscriptions"
-        subscribe = requests.post(api_url, json=subscribe_data, headers=headers)
+        subscribe = get_session().post(api_url, json=subscribe_data, headers=headers)
         if subscribe.status_code != 201:
             return HttpResponseBadRequest(f"Failed to subscribe {subscribe.text}")
         subscribe_id = subscribe.json().get("id")
@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import App, PartnerAccount, PartnerLead
+from django.utils.translation import gettext_lazy as _
+
+from edman.utils.admin import ScalableAdminMixin
+
+from .models import App, LeadFacet, LeadRollup, PartnerAccount, PartnerLead
 
 @admin.register(App)
 class AppAdmin(admin.ModelAdmin):
@@ -12,8 +16,40 @@ class PartnerAccountAdmin(admin.ModelAdmin):
     list_filter = ("is_active", "app", "user")
     search_fields = ("name", "login", "user__username", "user__email")
 
+class LeadFacetListFilter(admin.SimpleListFilter):
+    """
+    Filter choices from the LeadFacet table instead of a SELECT DISTINCT over
+    every lead. parameter_name is the PartnerLead field, as with a plain filter.
+    """
+
+    def lookups(self, request, model_admin):
+        values = (
+            LeadFacet.objects.filter(field=self.parameter_name, count__gt=0)
+            .exclude(value="")
+            .order_by("value")
+            .values_list("value", flat=True)
+            .distinct()
+        )
+        return [(value, value) for value in values]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.parameter_name: self.value()})
+        return queryset
+
+
+class StatusListFilter(LeadFacetListFilter):
+    title = _("Status")
+    parameter_name = "status"
+
+
+class CityListFilter(LeadFacetListFilter):
+    title = _("City")
+    parameter_name = "target_city"
+
+
 @admin.register(PartnerLead)
-class PartnerLeadAdmin(admin.ModelAdmin):
+class PartnerLeadAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = (
         "external_id", 
         "first_name", 
@@ -24,7 +60,23 @@ class PartnerLeadAdmin(admin.ModelAdmin):
         "lead_created_at",
         "account"
     )
-    list_filter = ("status", "target_city", "account", "created_at" if hasattr(PartnerLead, 'created_at') else "lead_created_at")
+    list_select_related = ("account",)
+    # No date_hierarchy: it runs a DISTINCT over the dates of every lead
+    list_filter = (StatusListFilter, CityListFilter, "account", "lead_created_at")
+    # Every column here has a pg_trgm index (migration 0004), so the OR'ed ILIKEs
+    # combine into a bitmap index scan.
     search_fields = ("external_id", "first_name", "last_name", "phone", "status")
-    date_hierarchy = "lead_created_at"
+    autocomplete_fields = ("account",)
     list_per_page = 50
+
+@admin.register(LeadFacet)
+class LeadFacetAdmin(admin.ModelAdmin):
+    list_display = ("user", "field", "value", "count")
+    list_filter = ("field",)
+    raw_id_fields = ("user",)
+
+@admin.register(LeadRollup)
+class LeadRollupAdmin(admin.ModelAdmin):
+    list_display = ("account", "day", "status", "target_city", "creator_username", "count")
+    list_filter = ("status",)
+    raw_id_fields = ("account",)
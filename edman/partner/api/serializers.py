@@ -0,0 +1,41 @@
+from rest_framework import serializers
+
+from edman.partner.models import PartnerLead
+
+
+class PartnerLeadSerializer(serializers.ModelSerializer[PartnerLead]):
+    class Meta:
+        model = PartnerLead
+        fields = [
+            "id",
+            "account",
+            "external_id",
+            "lead_created_at",
+            "updated_ts",
+            "first_name",
+            "last_name",
+            "phone",
+            "phone_normalized",
+            "target_city",
+            "status",
+            "eats_order_number",
+            "rewarded_at",
+            "closed_reason",
+            "utm_campaign",
+            "utm_content",
+            "utm_medium",
+            "utm_source",
+            "utm_term",
+            "creator_username",
+            "reward",
+            "complaint_status",
+            "updated_at",
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sparse fieldset requested with ?fields=, passed in by the view
+        fields = self.context.get("fields")
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
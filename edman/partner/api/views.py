@@ -0,0 +1,213 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import cast
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+from django.utils.http import quote_etag
+from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import ValidationError
+from rest_framework.mixins import ListModelMixin
+from rest_framework.mixins import RetrieveModelMixin
+from rest_framework.pagination import Cursor
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet
+from rest_framework.viewsets import ViewSet
+
+from edman.partner.models import PartnerAccount
+from edman.partner.models import PartnerLead
+from edman.partner.rollups import GROUP_BY
+from edman.partner.rollups import rollup_totals
+
+from .serializers import PartnerLeadSerializer
+
+
+class PartnerLeadCursorPagination(CursorPagination):
+    """
+    Oldest change first: a sync client follows `next` until it is null, then
+    comes back later with updated_since set to the last updated_at it saw.
+
+    The cursor holds the (updated_at, id) of the row a page continues from, so
+    leads sharing an updated_at (a bulk update) page like any others.
+    CursorPagination's own cursor holds updated_at only and pages through ties
+    with an OFFSET, which stops at offset_cutoff.
+    """
+
+    ordering = ("updated_at", "id")
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request) or self.page_size
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        position = None
+        if self.cursor:
+            position = decode_position(self.cursor.position)
+            if position is None:
+                raise NotFound(self.invalid_cursor_message)
+            updated_at, pk = position
+            if reverse:
+                queryset = queryset.filter(Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=pk))
+            else:
+                queryset = queryset.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=pk))
+
+        ordering = ("-updated_at", "-id") if reverse else self.ordering
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.display_page_controls = self.has_next or self.has_previous
+        return self.page
+
+    def get_next_link(self):
+        if not (self.has_next and self.page):
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=encode_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not (self.has_previous and self.page):
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=encode_position(self.page[0])))
+
+
+def encode_position(lead):
+    return f"{lead.updated_at.isoformat()}|{lead.pk}"
+
+
+def decode_position(position):
+    """(updated_at, id) from a cursor position, None if it's missing or malformed"""
+    try:
+        updated_at, pk = (position or "").split("|")
+        return datetime.fromisoformat(updated_at), int(pk)
+    except ValueError:
+        return None
+
+
+class PartnerLeadViewSet(RetrieveModelMixin, ListModelMixin, GenericViewSet):
+    """
+    Leads of the user's partner accounts.
+
+    ?fields=id,status,phone returns only these fields, ?updated_since=<ISO 8601>
+    only leads changed after that moment. Responses carry ETag and Last-Modified
+    and answer 304 to a matching If-None-Match / If-Modified-Since.
+    """
+
+    serializer_class = PartnerLeadSerializer
+    queryset = PartnerLead.objects.all()
+    pagination_class = PartnerLeadCursorPagination
+    lookup_field = "pk"
+
+    def get_requested_fields(self):
+        fields = self.request.query_params.get("fields")
+        if not fields:
+            return None
+        allowed = set(PartnerLeadSerializer.Meta.fields)
+        return [name for name in fields.split(",") if name in allowed]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["fields"] = self.get_requested_fields()
+        return context
+
+    def get_queryset(self, *args, **kwargs):
+        account_ids = list(PartnerAccount.objects.filter(user=self.request.user).values_list("id", flat=True))
+        queryset = self.queryset.filter(account_id__in=account_ids)
+
+        updated_since = self.request.query_params.get("updated_since")
+        if updated_since:
+            since = parse_datetime(updated_since)
+            if since is None:
+                raise ValidationError({"updated_since": "Expected an ISO 8601 datetime."})
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            queryset = queryset.filter(updated_at__gt=since)
+
+        fields = self.get_requested_fields()
+        if fields:
+            # Load only what gets serialized, plus what the cursor orders by
+            queryset = queryset.only("id", "updated_at", *fields)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        # A page is validated by its (id, updated_at) rows and whether more follow:
+        # a write moves a lead to the end of the sync order and a delete drops it,
+        # either changes them. That costs the page query alone, no COUNT over every
+        # lead, and a 304 skips serialization
+        paginator = cast(PartnerLeadCursorPagination, self.paginator)
+        page = paginator.paginate_queryset(self.filter_queryset(self.get_queryset()), request, view=self)
+        rows = [[lead.pk, lead.updated_at.isoformat()] for lead in page]
+        last_modified = max((lead.updated_at for lead in page), default=None)
+        return self.conditional_response(
+            request,
+            lambda: self.get_paginated_response(self.get_serializer(page, many=True).data),
+            last_modified,
+            rows,
+            paginator.has_next,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self.conditional_response(
+            request, lambda: Response(self.get_serializer(instance).data), instance.updated_at, instance.pk
+        )
+
+    def conditional_response(self, request, get_response, last_modified, *state):
+        """
+        ETag from the URL (page cursor, fields) and the state of the rows behind
+        it, checked before get_response() builds the response.
+        """
+        key = json.dumps([request.user.pk, request.get_full_path(), str(last_modified), *state])
+        etag = quote_etag(hashlib.md5(key.encode(), usedforsecurity=False).hexdigest())
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp) or get_response()
+        response["ETag"] = etag
+        if timestamp is not None:
+            response["Last-Modified"] = http_date(timestamp)
+        return response
+
+
+class LeadRollupViewSet(ViewSet):
+    """
+    Lead counts grouped by ?group_by=day|status|target_city|creator_username,
+    optionally for one ?account and leads created between ?since and ?until
+    (YYYY-MM-DD). Served from the rollup table, not the leads.
+    """
+
+    def list(self, request):
+        params = request.query_params
+        group_by = params.get("group_by", "status")
+        if group_by not in GROUP_BY:
+            raise ValidationError({"group_by": f"Expected one of: {', '.join(GROUP_BY)}."})
+        dates = {}
+        for name in ("since", "until"):
+            if params.get(name):
+                dates[name] = parse_date(params[name])
+                if dates[name] is None:
+                    raise ValidationError({name: "Expected a YYYY-MM-DD date."})
+
+        account_ids = list(PartnerAccount.objects.filter(user=request.user).values_list("id", flat=True))
+        account = params.get("account")
+        if account:
+            account_ids = [pk for pk in account_ids if str(pk) == account]
+
+        rows = rollup_totals(account_ids, group_by, **dates)
+        return Response(
+            {
+                "group_by": group_by,
+                "results": [{"value": value, "count": count} for value, count in rows],
+            }
+        )
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PartnerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'edman.partner'
+
+    def ready(self):
+        import edman.partner.signals  # noqa: F401, PLC0415
@@ -0,0 +1,97 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import LeadFacet, PartnerLead
+
+# PartnerLead fields offered as filter dropdowns in LeadListView
+FACET_FIELDS = ('target_city', 'status', 'creator_username')
+
+VERSION_KEY_PREFIX = "partner_lead_facets_version_"
+FACETS_KEY_PREFIX = "partner_lead_facets_"
+
+
+def facet_values(lead_values):
+    """Facet values of one lead, from a dict or a tuple ordered like FACET_FIELDS"""
+    if isinstance(lead_values, dict):
+        return tuple(str(lead_values.get(field) or '') for field in FACET_FIELDS)
+    return tuple(str(value or '') for value in lead_values)
+
+
+def count_change(deltas, before, after):
+    """
+    Record in deltas (a Counter) that a lead went from the facet values
+    `before` to `after`. Use before=None for a new lead.
+    """
+    for index, field in enumerate(FACET_FIELDS):
+        old = before[index] if before else None
+        new = after[index]
+        if old == new:
+            continue
+        if old is not None:
+            deltas[(field, old)] -= 1
+        deltas[(field, new)] += 1
+
+
+def apply_facet_deltas(user_id, deltas):
+    """Add the counted changes to the user's facet table and invalidate the cached facets"""
+    changed = False
+    for (field, value), delta in deltas.items():
+        if not delta:
+            continue
+        changed = True
+        facets = LeadFacet.objects.filter(user_id=user_id, field=field, value=value)
+        if facets.update(count=F('count') + delta):
+            continue
+        _facet, created = LeadFacet.objects.get_or_create(
+            user_id=user_id, field=field, value=value, defaults={'count': delta}
+        )
+        if not created:
+            # Created concurrently by another batch in the meantime
+            facets.update(count=F('count') + delta)
+    if changed:
+        bump_facets_version(user_id)
+
+
+def rebuild_facets(user_id):
+    """Recount the user's facets from PartnerLead (backfill, or after leads were deleted)"""
+    leads = PartnerLead.objects.filter(account__user_id=user_id)
+    rows = []
+    for field in FACET_FIELDS:
+        for value, count in leads.values_list(field).annotate(count=Count('id')).order_by():
+            rows.append(LeadFacet(user_id=user_id, field=field, value=value or '', count=count))
+    with transaction.atomic():
+        LeadFacet.objects.filter(user_id=user_id).delete()
+        LeadFacet.objects.bulk_create(rows)
+    bump_facets_version(user_id)
+
+
+def bump_facets_version(user_id):
+    cache.set(f"{VERSION_KEY_PREFIX}{user_id}", time.time_ns(), timeout=None)
+
+
+def get_facets(user_id):
+    """
+    {field: [(value, count), ...]} for every facet field, sorted by value.
+    Served from the cache under the user's current facet version, so after
+    the first request this is a single cache lookup (plus the version).
+    """
+    version = cache.get(f"{VERSION_KEY_PREFIX}{user_id}", 0)
+    key = f"{FACETS_KEY_PREFIX}{user_id}_{version}"
+    facets = cache.get(key)
+    if facets is None:
+        facets = {field: [] for field in FACET_FIELDS}
+        rows = (
+            LeadFacet.objects.filter(user_id=user_id, count__gt=0)
+            .exclude(value='')
+            .order_by('field', 'value')
+            .values_list('field', 'value', 'count')
+        )
+        for field, value, count in rows:
+            if field in facets:
+                facets[field].append((value, count))
+        cache.set(key, facets, timeout=3600)
+    return facets
+
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from edman.hh.models import Contact
+from edman.partner.models import PartnerLead
+
+
+class Command(BaseCommand):
+    help = "Fill phone_normalized of partner leads and hh phone contacts stored before it existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        leads = PartnerLead.objects.filter(phone_normalized="").exclude(phone__isnull=True).exclude(phone="")
+        contacts = Contact.objects.filter(phone_normalized="", type__in=Contact.PHONE_TYPES)
+        for queryset in (leads, contacts):
+            self._backfill(queryset, batch_size)
+
+    def _backfill(self, queryset, batch_size):
+        model = queryset.model
+        updated = 0
+        last_pk = 0
+        # Walk by primary key so every batch is an index range scan
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk).order_by("pk")[:batch_size])
+            if not batch:
+                break
+            for obj in batch:
+                obj.set_phone_normalized()
+            model.objects.bulk_update(batch, ["phone_normalized"])
+            updated += len(batch)
+            last_pk = batch[-1].pk
+        self.stdout.write(f"{model.__name__}: normalized {updated} phones")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from edman.partner.facets import rebuild_facets
+from edman.partner.models import PartnerAccount
+
+
+class Command(BaseCommand):
+    help = "Recount the lead filter facets (city, status, creator) from PartnerLead"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, help="Only rebuild this user's facets")
+
+    def handle(self, *args, **options):
+        if options["user"]:
+            user_ids = [options["user"]]
+        else:
+            user_ids = list(PartnerAccount.objects.values_list("user_id", flat=True).distinct())
+        for user_id in user_ids:
+            rebuild_facets(user_id)
+            self.stdout.write(f"Rebuilt lead facets for user {user_id}")
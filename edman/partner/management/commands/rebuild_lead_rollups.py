@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from edman.partner.models import PartnerAccount
+from edman.partner.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recount the per-day lead rollups (status, city, creator) from PartnerLead"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", type=int, help="Only rebuild this account's rollups")
+
+    def handle(self, *args, **options):
+        if options["account"]:
+            account_ids = [options["account"]]
+        else:
+            account_ids = list(PartnerAccount.objects.values_list("id", flat=True))
+        for account_id in account_ids:
+            rebuild_rollups(account_id)
+            self.stdout.write(f"Rebuilt lead rollups for account {account_id}")
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_lead_facets(apps, schema_editor):
+    PartnerLead = apps.get_model('partner', 'PartnerLead')
+    LeadFacet = apps.get_model('partner', 'LeadFacet')
+    for field in ('target_city', 'status', 'creator_username'):
+        rows = (
+            PartnerLead.objects.values_list('account__user_id', field)
+            .annotate(count=models.Count('id'))
+            .order_by()
+        )
+        LeadFacet.objects.bulk_create(
+            [LeadFacet(user_id=user_id, field=field, value=value or '', count=count) for user_id, value, count in rows],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partner', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeadFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=50, verbose_name='Field')),
+                ('value', models.CharField(max_length=255, verbose_name='Value')),
+                ('count', models.IntegerField(default=0, verbose_name='Count')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lead_facets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Lead Facet',
+                'verbose_name_plural': 'Lead Facets',
+                'unique_together': {('user', 'field', 'value')},
+            },
+        ),
+        migrations.RunPython(backfill_lead_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:55
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking writes to a large partner_partnerlead
+    atomic = False
+
+    dependencies = [
+        ('partner', '0002_leadfacet'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='partnerlead',
+            index=models.Index(models.F('account'), models.OrderBy(models.F('lead_created_at'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='partner_lead_account_created'),
+        ),
+        AddIndexConcurrently(
+            model_name='partnerlead',
+            index=models.Index(models.F('account'), models.F('status'), models.OrderBy(models.F('lead_created_at'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='partner_lead_status_created'),
+        ),
+        AddIndexConcurrently(
+            model_name='partnerlead',
+            index=models.Index(models.F('account'), models.F('target_city'), models.OrderBy(models.F('lead_created_at'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), condition=models.Q(('target_city', ''), _negated=True), name='partner_lead_city_created'),
+        ),
+        AddIndexConcurrently(
+            model_name='partnerlead',
+            index=models.Index(models.F('account'), models.F('creator_username'), models.OrderBy(models.F('lead_created_at'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), condition=models.Q(('creator_username', ''), _negated=True), name='partner_lead_creator_created'),
+        ),
+    ]
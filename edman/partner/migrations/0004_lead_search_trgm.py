@@ -0,0 +1,61 @@
+import logging
+
+from django.db import DatabaseError, migrations
+
+logger = logging.getLogger(__name__)
+
+# icontains on Postgres compiles to UPPER(column::text) LIKE UPPER('%term%'),
+# so the trigram indexes are built on the same expression.
+TRIGRAM_INDEXES = {
+    'partner_lead_external_id_trgm': 'external_id',
+    'partner_lead_phone_trgm': 'phone',
+    'partner_lead_first_name_trgm': 'first_name',
+    'partner_lead_last_name_trgm': 'last_name',
+    'partner_lead_status_trgm': 'status',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT installed_version FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        extension = cursor.fetchone()
+    if extension is None:
+        # Minimal Postgres builds ship without contrib; search still works, unindexed
+        logger.warning("pg_trgm is not available, lead substring search is left unindexed")
+        return
+    if extension[0] is None:
+        try:
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except DatabaseError as e:
+            raise DatabaseError(
+                "Could not create the pg_trgm extension. The database user needs the CREATE "
+                "privilege on the database (Postgres 13+) or superuser rights; otherwise have "
+                "an administrator run CREATE EXTENSION pg_trgm; and migrate again."
+            ) from e
+    for name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+            f"ON partner_partnerlead USING gin (UPPER({column}) gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('partner', '0003_lead_list_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the index without locking writes to a large partner_partnerlead
+    atomic = False
+
+    dependencies = [
+        ('partner', '0004_lead_search_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='partnerlead',
+            name='phone_normalized',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='Normalized Phone'),
+        ),
+        AddIndexConcurrently(
+            model_name='partnerlead',
+            index=models.Index(fields=['phone_normalized'], name='partner_lead_phone_norm', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
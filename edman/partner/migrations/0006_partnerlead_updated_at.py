@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+import django.utils.timezone
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, Max, Value
+
+BATCH_SIZE = 10_000
+
+
+def backfill_updated_at(apps, schema_editor):
+    """
+    AddField gave every existing lead the same updated_at. Spread them one
+    microsecond apart in id order, ending now, in batches that commit one by one.
+    """
+    PartnerLead = apps.get_model('partner', 'PartnerLead')
+    last_id = PartnerLead.objects.aggregate(last_id=Max('id'))['last_id']
+    if last_id is None:
+        return
+    now = django.utils.timezone.now()
+    updated_at = ExpressionWrapper(
+        Value(now) - (last_id - F('id')) * Value(timedelta(microseconds=1)),
+        output_field=models.DateTimeField(),
+    )
+    for start in range(0, last_id + 1, BATCH_SIZE):
+        PartnerLead.objects.filter(id__gte=start, id__lt=start + BATCH_SIZE).update(updated_at=updated_at)
+
+
+class Migration(migrations.Migration):
+    # Build the index without locking writes to a large partner_partnerlead
+    atomic = False
+
+    dependencies = [
+        ('partner', '0005_phone_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='partnerlead',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='partnerlead',
+            index=models.Index(fields=['account', 'updated_at', 'id'], name='partner_lead_account_updated'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def backfill_lead_rollups(apps, schema_editor):
+    PartnerLead = apps.get_model('partner', 'PartnerLead')
+    LeadRollup = apps.get_model('partner', 'LeadRollup')
+    rows = (
+        PartnerLead.objects.annotate(day=TruncDate('lead_created_at'))
+        .values_list('account_id', 'day', 'status', 'target_city', 'creator_username')
+        .annotate(count=models.Count('id'))
+        .order_by()
+    )
+    LeadRollup.objects.bulk_create(
+        [
+            LeadRollup(
+                account_id=account_id, day=day, status=status or '', target_city=city or '',
+                creator_username=creator or '', count=count,
+            )
+            for account_id, day, status, city, creator, count in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partner', '0006_partnerlead_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeadRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(blank=True, null=True, verbose_name='Day')),
+                ('status', models.CharField(blank=True, max_length=255, verbose_name='Status')),
+                ('target_city', models.CharField(blank=True, max_length=255, verbose_name='City')),
+                ('creator_username', models.CharField(blank=True, max_length=255, verbose_name='Creator')),
+                ('count', models.IntegerField(default=0, verbose_name='Count')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lead_rollups', to='partner.partneraccount')),
+            ],
+            options={
+                'verbose_name': 'Lead Rollup',
+                'verbose_name_plural': 'Lead Rollups',
+                'constraints': [models.UniqueConstraint(fields=('account', 'day', 'status', 'target_city', 'creator_username'), name='partner_lead_rollup_unique', nulls_distinct=False)],
+            },
+        ),
+        migrations.RunPython(backfill_lead_rollups, migrations.RunPython.noop),
+    ]
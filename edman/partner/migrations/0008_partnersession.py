@@ -0,0 +1,57 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:07
+
+import json
+import zlib
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def move_session_data(apps, schema_editor):
+    PartnerAccount = apps.get_model('partner', 'PartnerAccount')
+    PartnerSession = apps.get_model('partner', 'PartnerSession')
+    compressed = getattr(settings, 'PARTNER_SESSION_COMPRESS', True)
+    accounts = PartnerAccount.objects.exclude(session_data={}).values_list('id', 'session_data')
+    for account_id, state in accounts.iterator(chunk_size=100):
+        data = json.dumps(state, separators=(',', ':')).encode()
+        PartnerSession.objects.create(
+            account_id=account_id, data=zlib.compress(data) if compressed else data, compressed=compressed,
+        )
+
+
+def restore_session_data(apps, schema_editor):
+    PartnerAccount = apps.get_model('partner', 'PartnerAccount')
+    PartnerSession = apps.get_model('partner', 'PartnerSession')
+    for session in PartnerSession.objects.iterator(chunk_size=100):
+        data = bytes(session.data)
+        state = json.loads(zlib.decompress(data) if session.compressed else data)
+        PartnerAccount.objects.filter(pk=session.account_id).update(session_data=state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partner', '0007_leadrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartnerSession',
+            fields=[
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='session', serialize=False, to='partner.partneraccount')),
+                ('data', models.BinaryField(verbose_name='Session Data')),
+                ('compressed', models.BooleanField(default=False, verbose_name='Compressed')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Partner Session',
+                'verbose_name_plural': 'Partner Sessions',
+            },
+        ),
+        migrations.RunPython(move_session_data, restore_session_data),
+        migrations.RemoveField(
+            model_name='partneraccount',
+            name='session_data',
+        ),
+    ]
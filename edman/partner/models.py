@@ -1,7 +1,14 @@
+import json
+import zlib
+
 from django.db import models
+from django.db.models import F
+from django.db.models import Q
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 
+from edman.utils.phones import normalize_phone
+
 class App(models.Model):
     name = models.CharField(_("Name"), max_length=255)
     auth_url = models.URLField(_("Auth URL"))
@@ -19,8 +26,7 @@ class PartnerAccount(models.Model):
     app = models.ForeignKey(App, on_delete=models.CASCADE, related_name="accounts")
     name = models.CharField(_("Account Name"), max_length=255)
     login = models.CharField(_("Login"), max_length=255)
-    # Storing session data (cookies, localStorage)
-    session_data = models.JSONField(_("Session Data"), default=dict, blank=True)
+    # Session data (cookies, localStorage) lives in PartnerSession, loaded only where it's used
     
     is_active = models.BooleanField(_("Active"), default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -34,6 +40,43 @@ class PartnerAccount(models.Model):
     def __str__(self):
         return f"{self.name}"
 
+class PartnerSession(models.Model):
+    """
+    Playwright storage_state of an account: cookies and localStorage, often
+    megabytes of JSON. Kept out of PartnerAccount so that account lists and
+    joins never read it; stored zlib compressed when PARTNER_SESSION_COMPRESS.
+    """
+    account = models.OneToOneField(PartnerAccount, on_delete=models.CASCADE, primary_key=True, related_name="session")
+    data = models.BinaryField(_("Session Data"))
+    compressed = models.BooleanField(_("Compressed"), default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Partner Session")
+        verbose_name_plural = _("Partner Sessions")
+
+    def __str__(self):
+        return f"{self.account_id}"
+
+    @classmethod
+    def load(cls, account_id):
+        """The account's storage_state, {} if none is stored"""
+        row = cls.objects.filter(account_id=account_id).values_list('data', 'compressed').first()
+        if not row:
+            return {}
+        data, compressed = row
+        data = bytes(data)
+        return json.loads(zlib.decompress(data) if compressed else data)
+
+    @classmethod
+    def store(cls, account_id, state):
+        data = json.dumps(state, separators=(',', ':')).encode()
+        compressed = getattr(settings, 'PARTNER_SESSION_COMPRESS', True)
+        if compressed:
+            data = zlib.compress(data)
+        cls.objects.update_or_create(account_id=account_id, defaults={'data': data, 'compressed': compressed})
+
+
 class PartnerLead(models.Model):
     account = models.ForeignKey(PartnerAccount, on_delete=models.CASCADE, related_name="leads")
     external_id = models.CharField(_("External ID"), max_length=255, db_index=True)
@@ -55,11 +98,95 @@ class PartnerLead(models.Model):
     reward = models.CharField(_("Reward"), max_length=255, blank=True)
     complaint_status = models.CharField(_("Complaint Status"), max_length=255, blank=True)
     phone = models.CharField(_("Phone"), max_length=255, blank=True, null=True)
+    # Digits-only phone (see normalize_phone) for exact/prefix lookups and matching hh contacts
+    phone_normalized = models.CharField(_("Normalized Phone"), max_length=32, blank=True, default="")
+    # Last write by us (unlike updated_ts, which comes from the partner), for incremental API sync
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = _("Partner Lead")
         verbose_name_plural = _("Partner Leads")
         unique_together = ('account', 'external_id')
+        # Lead list access paths: leads of an account, optionally narrowed by one
+        # facet, newest first in keyset order. Blank city/creator are never
+        # filtered on, so those indexes skip them.
+        indexes = [
+            models.Index(
+                F('account'), F('lead_created_at').desc(nulls_last=True), F('id').desc(),
+                name='partner_lead_account_created',
+            ),
+            models.Index(
+                F('account'), F('status'), F('lead_created_at').desc(nulls_last=True), F('id').desc(),
+                name='partner_lead_status_created',
+            ),
+            models.Index(
+                F('account'), F('target_city'), F('lead_created_at').desc(nulls_last=True), F('id').desc(),
+                name='partner_lead_city_created',
+                condition=~Q(target_city=''),
+            ),
+            models.Index(
+                F('account'), F('creator_username'), F('lead_created_at').desc(nulls_last=True), F('id').desc(),
+                name='partner_lead_creator_created',
+                condition=~Q(creator_username=''),
+            ),
+            # API incremental sync: updated_since filter in updated_at, id cursor order
+            models.Index(fields=['account', 'updated_at', 'id'], name='partner_lead_account_updated'),
+            # pattern_ops so that LIKE 'prefix%' uses the index too. Not partial:
+            # the planner can't prove phone_normalized <> '' from a LIKE.
+            models.Index(
+                fields=['phone_normalized'], name='partner_lead_phone_norm', opclasses=['varchar_pattern_ops'],
+            ),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.external_id})"
+
+    def save(self, *args, **kwargs):
+        self.set_phone_normalized()
+        super().save(*args, **kwargs)
+
+    def set_phone_normalized(self):
+        """Fill phone_normalized from phone; bulk_create doesn't call save()"""
+        self.phone_normalized = normalize_phone(self.phone)
+
+class LeadFacet(models.Model):
+    """Distinct filter values of a user's leads with their counts, kept up to date by ingestion"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="lead_facets")
+    field = models.CharField(_("Field"), max_length=50)
+    value = models.CharField(_("Value"), max_length=255)
+    count = models.IntegerField(_("Count"), default=0)
+
+    class Meta:
+        verbose_name = _("Lead Facet")
+        verbose_name_plural = _("Lead Facets")
+        unique_together = ('user', 'field', 'value')
+
+    def __str__(self):
+        return f"{self.field}={self.value} ({self.count})"
+
+
+class LeadRollup(models.Model):
+    """
+    Lead counts of an account per day, status, city and creator, kept up to date
+    by ingestion. Dashboards aggregate these rows instead of the leads.
+    """
+    account = models.ForeignKey(PartnerAccount, on_delete=models.CASCADE, related_name="lead_rollups")
+    day = models.DateField(_("Day"), null=True, blank=True)
+    status = models.CharField(_("Status"), max_length=255, blank=True)
+    target_city = models.CharField(_("City"), max_length=255, blank=True)
+    creator_username = models.CharField(_("Creator"), max_length=255, blank=True)
+    count = models.IntegerField(_("Count"), default=0)
+
+    class Meta:
+        verbose_name = _("Lead Rollup")
+        verbose_name_plural = _("Lead Rollups")
+        constraints = [
+            models.UniqueConstraint(
+                fields=['account', 'day', 'status', 'target_city', 'creator_username'],
+                name='partner_lead_rollup_unique',
+                nulls_distinct=False,
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} {self.day} {self.status} ({self.count})"
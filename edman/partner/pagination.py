@@ -0,0 +1,96 @@
+import base64
+from datetime import datetime
+
+from django.db.models import F, Q
+
+
+class KeysetPage:
+    """
+    One page of leads, newest first by (lead_created_at, id). Pages are picked
+    with a WHERE on the first/last row already seen instead of an OFFSET, and
+    the total is counted only up to count_cap, so any page renders in constant
+    time. Leads without lead_created_at come last.
+
+    With account_ids (the accounts the queryset spans) each account's page is
+    read in order from its own (account, lead_created_at, id) index and the
+    pages are merged; one index can't give that order across several accounts,
+    so the database would sort every matching lead instead.
+    """
+
+    def __init__(self, queryset, per_page, after=None, before=None, count_cap=1000, account_ids=None):
+        self.per_page = per_page
+        self.account_ids = account_ids
+        after = decode_cursor(after)
+        before = decode_cursor(before) if not after else None
+
+        if before:
+            rows = self._fetch(
+                queryset.filter(_before(*before)),
+                (F('lead_created_at').asc(nulls_first=True), 'id'),
+                per_page + 1,
+            )
+            self.has_previous = len(rows) > per_page
+            self.has_next = True
+            rows = rows[:per_page][::-1]
+        else:
+            rows_after = queryset.filter(_after(*after)) if after else queryset
+            rows = self._fetch(rows_after, (F('lead_created_at').desc(nulls_last=True), '-id'), per_page + 1)
+            self.has_next = len(rows) > per_page
+            self.has_previous = after is not None
+            rows = rows[:per_page]
+
+        self.object_list = rows
+        self.next_cursor = encode_cursor(rows[-1]) if self.has_next and rows else None
+        self.previous_cursor = encode_cursor(rows[0]) if self.has_previous and rows else None
+
+        # Total of the whole list, not what's left after the cursor.
+        # COUNT over a LIMITed subquery: stops after count_cap + 1 rows
+        count = queryset.order_by()[:count_cap + 1].count()
+        self.count = min(count, count_cap)
+        self.count_capped = count > count_cap
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _fetch(self, queryset, ordering, limit):
+        if self.account_ids and len(self.account_ids) > 1:
+            # UNION ALL of per-account LIMITed index scans, merged (Merge Append)
+            pages = [
+                queryset.filter(account_id=account_id).order_by(*ordering)[:limit]
+                for account_id in self.account_ids
+            ]
+            queryset = pages[0].union(*pages[1:], all=True)
+        return list(queryset.order_by(*ordering)[:limit])
+
+
+def encode_cursor(lead):
+    created = lead.lead_created_at.isoformat() if lead.lead_created_at else ''
+    return base64.urlsafe_b64encode(f"{created}|{lead.pk}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(lead_created_at or None, id) from a cursor, None if it's missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        created, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return (datetime.fromisoformat(created) if created else None), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _after(created, pk):
+    # Rows that come after (created, pk) in newest-first order, NULL dates last
+    if created is None:
+        return Q(lead_created_at__isnull=True, id__lt=pk)
+    return (
+        Q(lead_created_at__lt=created)
+        | Q(lead_created_at=created, id__lt=pk)
+        | Q(lead_created_at__isnull=True)
+    )
+
+
+def _before(created, pk):
+    if created is None:
+        return Q(lead_created_at__isnull=False) | Q(lead_created_at__isnull=True, id__gt=pk)
+    return Q(lead_created_at__gt=created) | Q(lead_created_at=created, id__gt=pk)
@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import LeadRollup, PartnerLead
+
+# LeadRollup dimensions besides the day, in rollup key order
+ROLLUP_FIELDS = ('status', 'target_city', 'creator_username')
+# What dashboards may group by
+GROUP_BY = ('day',) + ROLLUP_FIELDS
+
+
+def rollup_key(lead_values):
+    """(day, status, target_city, creator_username) of one lead, from a dict of its fields"""
+    created = lead_values.get('lead_created_at')
+    day = timezone.localdate(created) if created else None
+    return (day,) + tuple(str(lead_values.get(field) or '') for field in ROLLUP_FIELDS)
+
+
+def count_rollup_change(deltas, before, after):
+    """Record in deltas (a Counter) that a lead moved from rollup key `before` (None if new) to `after`"""
+    if before == after:
+        return
+    if before is not None:
+        deltas[before] -= 1
+    deltas[after] += 1
+
+
+def apply_rollup_deltas(account_id, deltas):
+    """Add the counted changes to the account's rollup rows"""
+    for (day, status, city, creator), delta in deltas.items():
+        if not delta:
+            continue
+        key = {'day': day, 'status': status, 'target_city': city, 'creator_username': creator}
+        rollups = LeadRollup.objects.filter(account_id=account_id, **key)
+        if rollups.update(count=F('count') + delta):
+            continue
+        _rollup, created = LeadRollup.objects.get_or_create(account_id=account_id, **key, defaults={'count': delta})
+        if not created:
+            # Created concurrently by another batch in the meantime
+            rollups.update(count=F('count') + delta)
+
+
+def rebuild_rollups(account_id):
+    """Recount the account's rollups from PartnerLead (backfill)"""
+    rows = (
+        PartnerLead.objects.filter(account_id=account_id)
+        .annotate(day=TruncDate('lead_created_at'))
+        .values_list('day', *ROLLUP_FIELDS)
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    with transaction.atomic():
+        LeadRollup.objects.filter(account_id=account_id).delete()
+        LeadRollup.objects.bulk_create(
+            [
+                LeadRollup(
+                    account_id=account_id, day=day, status=status or '', target_city=city or '',
+                    creator_username=creator or '', count=count,
+                )
+                for day, status, city, creator, count in rows
+            ],
+            batch_size=1000,
+        )
+
+
+def rollup_totals(account_ids, group_by, since=None, until=None):
+    """
+    [(value, count), ...] of the accounts' leads grouped by one of GROUP_BY,
+    optionally limited to leads created in [since, until]. Days are returned
+    in date order, everything else by count, largest first.
+    """
+    rollups = LeadRollup.objects.filter(account_id__in=account_ids)
+    if since:
+        rollups = rollups.filter(day__gte=since)
+    if until:
+        rollups = rollups.filter(day__lte=until)
+    rows = rollups.values_list(group_by).annotate(total=Sum('count')).filter(total__gt=0)
+    if group_by == 'day':
+        return list(rows.exclude(day__isnull=True).order_by('day'))
+    return list(rows.order_by('-total', group_by))
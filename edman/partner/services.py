@@ -1,14 +1,449 @@
+import asyncio
+import concurrent.futures
+import gzip
+import json
+import queue
+import re
+import shutil
 import time
 import uuid
 import logging
 import threading
-import os
+from pathlib import Path
+from urllib.parse import urlsplit
+import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.cache import cache
+from django.db import close_old_connections
+from playwright.sync_api import Error as PlaywrightError
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 from playwright.sync_api import sync_playwright
+from redis import asyncio as aioredis
+
+from edman.utils.http import isolated_session
+
+from .models import PartnerSession
 
 logger = logging.getLogger(__name__)
 
+STREAM_ID_RE = re.compile(r"^\d+-\d+$")
+
+# Code input field selectors, in order of preference
+OTP_INPUT_SELECTORS = [
+    'input[data-testid="code-field-segment"]', # Segmented input (modern yandex)
+    'input[data-testid="text-field-input"]',   # Email code input
+    'input[name="code"]',
+    'input[type="tel"]',
+    'input[id="passp-field-phoneCode"]',
+    'input[autocomplete="one-time-code"]'
+]
+
+# Snapshot of the auth page state, evaluated in the browser in one round trip.
+# Visibility follows Playwright's definition: non-empty box and not visibility:hidden.
+PAGE_STATE_JS = """
+(otpSelectors) => {
+    const html = document.documentElement ? document.documentElement.outerHTML : '';
+    const lower = html.toLowerCase();
+    const visible = (el) => !!el && el.getClientRects().length > 0
+        && getComputedStyle(el).visibility !== 'hidden';
+    const first = (selector) => document.querySelector(selector);
+    const otpSelector = otpSelectors.find((selector) => visible(first(selector))) || null;
+    const submit = first('button[type="submit"], button[data-testid="submit-button"]');
+    const hint = first('div.description-block span');
+    const state = {
+        url: location.href,
+        title: document.title,
+        captcha: html.includes('SmartCaptcha') || html.includes('checkbox-captcha')
+            || document.title.toLowerCase().includes('robot'),
+        incorrect_password: html.includes('Incorrect password') || html.includes('Неверный пароль'),
+        webauthn_promo: html.includes('WebauthnRegStart')
+            || html.includes('Want to log in with face or fingerprint?'),
+        mentions_code: lower.includes('code') || lower.includes('sms'),
+        sms_fallback: html.includes('Incorrect password') && html.includes('Log in with SMS code'),
+        profile: !!first('div[data-testid="profile-card"], div[data-testid="user-avatar"], '
+            + 'div[data-testid="account-user-card"]'),
+        email_hint: hint ? hint.textContent : null,
+        phone_next_button: visible(first('button[data-testid="challenges-phone-confirmation-next"]')),
+        submit_button_text: visible(submit) ? submit.textContent : null,
+        webauthn_later_button: visible(first('button[data-testid="webauthn-reg-later-button"]')),
+        sms_button: visible(first('button[data-testid="auth-by-sms-button"]')),
+        otp_selector: otpSelector,
+        otp_segmented: !!first('input[data-testid="code-field-segment"]'),
+    };
+    // Everything but free text, so a ticking resend timer doesn't count as a change
+    state.signature = JSON.stringify([
+        state.url, state.title, state.captcha, state.incorrect_password, state.webauthn_promo,
+        state.profile, state.phone_next_button, state.webauthn_later_button, state.sms_button,
+        state.otp_selector,
+    ]);
+    return state;
+}
+"""
+
+# Arguments to reduce bot detection
+BROWSER_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-infobars',
+    '--window-position=0,0',
+    '--ignore-certificate-errors',
+    '--ignore-ssl-errors',
+    '--disable-gpu',
+    '--disable-software-rasterizer',
+]
+
+# Context with a realistic User Agent
+CONTEXT_OPTIONS = {
+    'user_agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
+    'viewport': {'width': 1366, 'height': 768},
+    'device_scale_factor': 1,
+    'is_mobile': False,
+    'has_touch': False,
+    'locale': 'en-US',
+    'timezone_id': 'America/New_York',
+}
+
+# Script to hide webdriver property
+STEALTH_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', {
+        get: () => undefined
+    });
+"""
+
+def storage_state_is_valid(storage_state, leads_url):
+    """
+    Check a Playwright storage_state without a browser. The partner app serves
+    its 200 shell to logged-out visitors too, so the positive signal is the
+    Yandex ID profile (PARTNER_AUTH_PROFILE_URL): it only opens for a live
+    session and sends anyone else to Passport. leads_url must not send the
+    session to Passport either.
+    """
+    # Own cookie jar for this account's cookies, pooled connections
+    http = isolated_session()
+    now = time.time()
+    for cookie in storage_state.get('cookies', []):
+        expires = cookie.get('expires', -1)
+        if expires not in (None, -1) and expires < now:
+            continue
+        http.cookies.set(
+            cookie['name'],
+            cookie['value'],
+            domain=cookie.get('domain'),
+            path=cookie.get('path', '/'),
+        )
+    profile_url = getattr(settings, 'PARTNER_AUTH_PROFILE_URL', 'https://id.yandex.ru/')
+    for url in (profile_url, leads_url):
+        try:
+            response = http.get(url, headers={'User-Agent': CONTEXT_OPTIONS['user_agent']}, timeout=10)
+        except requests.RequestException as e:
+            logger.warning(f"Stored session check failed: {e}")
+            return False
+        # An expired session is redirected to Yandex Passport
+        if not response.ok or (urlsplit(response.url).hostname or '').startswith('passport.'):
+            return False
+    return True
+
+def launch_auth_browser(playwright, headless):
+    return playwright.chromium.launch(headless=headless, args=BROWSER_ARGS)
+
+def new_auth_context(browser):
+    context = browser.new_context(**CONTEXT_OPTIONS)
+    context.add_init_script(STEALTH_SCRIPT)
+    return context
+
+
+class WarmBrowserPool:
+    """
+    Per-process pool of ready auth pages: one browser stays launched and up
+    to PARTNER_AUTH_WARM_POOL_SIZE contexts are created in advance, each
+    optionally already navigated to an App.auth_url. Contexts idle for longer
+    than PARTNER_AUTH_WARM_POOL_TTL seconds are thrown away, and the browser
+    with them once none is left.
+
+    The warm browser holds one of the PARTNER_AUTH_MAX_BROWSERS slots for as
+    long as it runs. A login that uses it takes that slot over (see
+    acquire_browser_slot) and refill() claims a new one afterwards; without a
+    free slot the pool stays empty.
+
+    Playwright's sync API is bound to the thread that started it, so with a
+    pool configured logins run on the pool's own thread (see call()), which
+    also expires idle contexts while the worker waits for the next task.
+    """
+
+    def __init__(self):
+        self._playwright = None
+        self._browser = None
+        self._thread = None
+        self._jobs: queue.Queue = queue.Queue()
+        self._idle = []  # (created_at, auth_url or None, context, page)
+        self.slot = None
+        self._slot_owner = f"warm_pool_{uuid.uuid4()}"
+
+    def call(self, func, *args):
+        """Run func(*args) on the pool's thread and return its result"""
+        if getattr(settings, 'PARTNER_AUTH_WARM_POOL_SIZE', 0) <= 0:
+            return func(*args)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._serve, name="warm-browser-pool", daemon=True)
+            self._thread.start()
+        result: concurrent.futures.Future = concurrent.futures.Future()
+        self._jobs.put((func, args, result))
+        return result.result()
+
+    def _serve(self):
+        while True:
+            try:
+                func, args, result = self._jobs.get(timeout=self._next_expiry())
+            except queue.Empty:
+                self._expire()
+                if not self._idle:
+                    # Nothing warm left: don't keep a browser and its slot for nothing
+                    self.close()
+                continue
+            close_old_connections()
+            try:
+                result.set_result(func(*args))
+            except BaseException as e:
+                result.set_exception(e)
+            finally:
+                close_old_connections()
+
+    def _next_expiry(self):
+        """Seconds until the oldest idle context expires, None to wait for the next job"""
+        if not self._idle:
+            return None
+        ttl = getattr(settings, 'PARTNER_AUTH_WARM_POOL_TTL', 300)
+        return max(0, self._idle[0][0] + ttl - time.monotonic())
+
+    def _on_pool_thread(self):
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def spare_slot(self):
+        """The warm browser's slot, for a login on the pool's thread to take over"""
+        return self.slot if self._on_pool_thread() else None
+
+    def claim(self, auth_url):
+        """Take a warm (context, page, navigated) for auth_url, or None if there is none."""
+        if not self._on_pool_thread() or not self._idle:
+            return None
+        self._expire()
+        for navigated_only in (True, False):
+            for entry in self._idle:
+                _created, url, context, page = entry
+                if (url == auth_url) if navigated_only else url is None:
+                    self._idle.remove(entry)
+                    return context, page, url is not None
+        return None
+
+    def refill(self, auth_urls=()):
+        """Top the pool up, pre-navigating new pages to auth_urls in turn"""
+        size = getattr(settings, 'PARTNER_AUTH_WARM_POOL_SIZE', 0)
+        if size <= 0 or not self._on_pool_thread():
+            return
+        if not self._hold_slot():
+            self.close()
+            return
+        try:
+            if self._browser is None or not self._browser.is_connected():
+                self._close_browser()
+                self._playwright = sync_playwright().start()
+                self._browser = launch_auth_browser(
+                    self._playwright, not getattr(settings, 'PARTNER_AUTH_SHOW_BROWSER', False)
+                )
+            self._expire()
+
+            prenavigate = getattr(settings, 'PARTNER_AUTH_WARM_POOL_PRENAVIGATE', True)
+            urls = list(auth_urls) if prenavigate else []
+            while len(self._idle) < size:
+                # Cover every app with a navigated page first, then keep blank ones
+                covered = {url for _created, url, _context, _page in self._idle}
+                url = next((u for u in urls if u not in covered), None)
+                context = new_auth_context(self._browser)
+                page = context.new_page()
+                if url:
+                    try:
+                        page.goto(url)
+                    except Exception as e:
+                        logger.warning(f"Failed to pre-navigate warm auth page to {url}: {e}")
+                        url = None
+                self._idle.append((time.monotonic(), url, context, page))
+        except Exception as e:
+            logger.warning(f"Failed to warm auth browser pool: {e}")
+            self.close()
+
+    def _hold_slot(self):
+        """Claim a global browser slot for the warm browser, or extend the one it holds"""
+        # Outlives the idle contexts a little, in case this process dies without closing
+        timeout = getattr(settings, 'PARTNER_AUTH_WARM_POOL_TTL', 300) + 60
+        if self.slot and cache.get(self.slot) == self._slot_owner:
+            cache.touch(self.slot, timeout)
+            return True
+        self.slot = _try_claim(
+            "partner_auth_slot_",
+            getattr(settings, 'PARTNER_AUTH_MAX_BROWSERS', 2),
+            self._slot_owner,
+            timeout,
+        )
+        return self.slot is not None
+
+    def _expire(self):
+        ttl = getattr(settings, 'PARTNER_AUTH_WARM_POOL_TTL', 300)
+        now = time.monotonic()
+        fresh = []
+        for entry in self._idle:
+            if now - entry[0] > ttl:
+                try:
+                    entry[2].close()
+                except Exception:
+                    pass
+            else:
+                fresh.append(entry)
+        self._idle = fresh
+
+    def close(self):
+        for _created, _url, context, _page in self._idle:
+            try:
+                context.close()
+            except Exception:
+                pass
+        self._idle = []
+        self._close_browser()
+        if self.slot and cache.get(self.slot) == self._slot_owner:
+            release_browser_slot([self.slot])
+            # The freed slot goes to the next login waiting for one
+            dispatch_auth_sessions()
+        self.slot = None
+
+    def _close_browser(self):
+        try:
+            if self._browser is not None:
+                self._browser.close()
+            if self._playwright is not None:
+                self._playwright.stop()
+        except Exception:
+            pass
+        self._browser = None
+        self._playwright = None
+
+
+warm_pool = WarmBrowserPool()
+
+
+class DebugDumpWriter:
+    """
+    Writes auth debug dumps in a background thread, gzip-compressed, to
+    debug_dumps/<session_id>/. Each session is a ring buffer: once its dumps
+    exceed PARTNER_AUTH_DEBUG_DUMPS_SESSION_MAX_BYTES the oldest are evicted,
+    and whole sessions are evicted oldest first above PARTNER_AUTH_DEBUG_DUMPS_MAX_BYTES.
+    Flat debug_dumps/*.html files from before per-session directories are
+    evicted like sessions.
+
+    Sizes are tracked in memory, the tree is only scanned on the first write and
+    every RESCAN_SECONDS (to pick up dumps of other worker processes).
+    """
+
+    RESCAN_SECONDS = 600
+
+    def __init__(self, root="debug_dumps", queue_size=100):
+        self.root = Path(root)
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        # {session dir or legacy file: [mtime, [(dump path, size), ...] oldest first]}
+        self._index: dict[Path, list] = {}
+        self._total = 0
+        self._scanned_at = None
+
+    def submit(self, session_id, name, html):
+        """Queue a dump without blocking. Returns False if the queue is full."""
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((session_id, name, html))
+        except queue.Full:
+            return False
+        return True
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="auth-dump-writer")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            session_id, name, html = self._queue.get()
+            try:
+                self._write(session_id, name, html)
+            except Exception as e:
+                logger.warning(f"Failed to write auth debug dump {name}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _scan(self):
+        index: dict[Path, list] = {}
+        if self.root.exists():
+            for entry in self.root.iterdir():
+                if entry.is_dir():
+                    # File names start with a timestamp, so sorting puts the oldest first
+                    files = [(f, f.stat().st_size) for f in sorted(entry.iterdir()) if f.is_file()]
+                    index[entry] = [entry.stat().st_mtime, files]
+                elif entry.is_file():
+                    stat = entry.stat()
+                    index[entry] = [stat.st_mtime, [(entry, stat.st_size)]]
+        self._index = index
+        self._total = sum(size for _mtime, files in index.values() for _path, size in files)
+        self._scanned_at = time.monotonic()
+
+    def _write(self, session_id, name, html):
+        if self._scanned_at is None or time.monotonic() - self._scanned_at > self.RESCAN_SECONDS:
+            self._scan()
+        session_dir = self.root / session_id
+        if session_dir not in self._index:
+            session_dir.mkdir(parents=True, exist_ok=True)
+        path = session_dir / f"{time.time_ns()}_{name}.html.gz"
+        data = gzip.compress(html.encode("utf-8"), compresslevel=6)
+        path.write_bytes(data)
+
+        entry = self._index.setdefault(session_dir, [0, []])
+        entry[0] = time.time()
+        files = entry[1]
+        files.append((path, len(data)))
+        self._total += len(data)
+
+        # The newest dump is always kept, even if it alone exceeds the budget
+        session_max = getattr(settings, 'PARTNER_AUTH_DEBUG_DUMPS_SESSION_MAX_BYTES', 5 * 1024 * 1024)
+        session_total = sum(size for _path, size in files)
+        while len(files) > 1 and session_total > session_max:
+            old, size = files.pop(0)
+            old.unlink(missing_ok=True)
+            session_total -= size
+            self._total -= size
+
+        self._evict_sessions(keep=session_dir)
+
+    def _evict_sessions(self, keep):
+        total_max = getattr(settings, 'PARTNER_AUTH_DEBUG_DUMPS_MAX_BYTES', 200 * 1024 * 1024)
+        if self._total <= total_max:
+            return
+        for entry, (_mtime, files) in sorted(self._index.items(), key=lambda item: item[1][0]):
+            if self._total <= total_max:
+                break
+            if entry == keep:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink(missing_ok=True)
+            self._total -= sum(size for _path, size in files)
+            del self._index[entry]
+
+
+dump_writer = DebugDumpWriter()
+
+
 class AuthSession:
     STATUS_INIT = 'INIT'
     STATUS_RUNNING = 'RUNNING'
@@ -19,22 +454,31 @@ class AuthSession:
     CACHE_KEY_PREFIX = "partner_auth_session_"
     OTP_KEY_PREFIX = "partner_auth_otp_"
     RESULT_KEY_PREFIX = "partner_auth_result_"
+    PARAMS_KEY_PREFIX = "partner_auth_params_"
+    EVENTS_CHANNEL_PREFIX = "partner_auth_events_"
+    LOGS_KEY_PREFIX = "partner_auth_logs_"
+    OWNER_KEY_PREFIX = "partner_auth_owner_"
+    LOG_LIMIT = 50
 
-    def __init__(self, auth_url, login, password, leads_url=None):
-        self.session_id = str(uuid.uuid4())
+    def __init__(self, auth_url, login, password, leads_url=None, user_id=None, account_id=None, session_id=None):
+        self.session_id = session_id or str(uuid.uuid4())
         self.auth_url = auth_url
         self.leads_url = leads_url
         self.login = login
         self.password = password
+        self.user_id = user_id
+        # Existing PartnerAccount whose stored session may still be valid
+        self.account_id = account_id
         self._thread = None
-        # Initialize logs
-        cache.set(f"partner_auth_logs_{self.session_id}", [], timeout=600)
+        self._status = self.STATUS_INIT
+        self._checks_deadline = None
+        # Set once run() got a browser slot
+        self.used_browser = False
+        # Initialize logs (only for a fresh session, a restored one keeps its history).
+        # On Redis the log stream is created by the first append.
+        if not session_id and get_redis_client() is None:
+            cache.set(f"{self.LOGS_KEY_PREFIX}{self.session_id}", [], timeout=600)
         
-        # Ensure debug directory exists
-        try:
-            os.makedirs("debug_dumps", exist_ok=True)
-        except Exception:
-            pass
     
     def _dump_page(self, page, name):
         """Save page content for debugging"""
@@ -42,53 +486,250 @@ class AuthSession:
             return
 
         try:
-            timestamp = int(time.time())
-            filename = f"debug_dumps/{timestamp}_{self.session_id[:5]}_{name}.html"
-            with open(filename, "w", encoding="utf-8") as f:
-                f.write(page.content())
-            self._log(f"Saved debug dump: {filename}")
+            # Grabbing the HTML has to happen on the flow's thread (Playwright
+            # sync API), compressing and writing it is left to the dump writer.
+            html = page.content()
         except Exception as e:
             self._log(f"Failed to save dump {name}: {e}")
+            return
+        if dump_writer.submit(self.session_id, name, html):
+            self._log(f"Queued debug dump: {name}")
+        else:
+            self._log(f"Dump writer is busy, skipped dump {name}")
 
     def _log(self, message):
         """Append a log message to the session logs"""
-        key = f"partner_auth_logs_{self.session_id}"
-        logs = cache.get(key, [])
         timestamp = time.strftime("%H:%M:%S")
         log_entry = f"[{timestamp}] {message}"
-        logs.append(log_entry)
-        # Keep last 50 lines
-        if len(logs) > 50:
-            logs = logs[-50:]
-        cache.set(key, logs, timeout=600)
-        # Also update status message for simple display
-        self._set_status(self._get_current_status(), message)
+
+        client = get_redis_client()
+        if client is None:
+            key = f"{self.LOGS_KEY_PREFIX}{self.session_id}"
+            logs = cache.get(key, [])
+            logs.append(log_entry)
+            # Keep last 50 lines
+            if len(logs) > self.LOG_LIMIT:
+                logs = logs[-self.LOG_LIMIT:]
+            cache.set(key, logs, timeout=600)
+            # Also update status message for simple display
+            self._set_status(self._status, message)
+            return
+
+        # One MULTI/EXEC round trip: the line is appended to a capped stream
+        # (its entry ID is the cursor readers resume from) and the status
+        # message is updated together with it.
+        key = f"{self.LOGS_KEY_PREFIX}{self.session_id}"
+        pipe = client.pipeline()
+        pipe.xadd(key, {'line': log_entry}, maxlen=self.LOG_LIMIT, approximate=False)
+        pipe.expire(key, 600)
+        pipe.publish(f"{self.EVENTS_CHANNEL_PREFIX}{self.session_id}", json.dumps({'log': log_entry}))
+        self._queue_status(pipe, self._status, message)
+        self._execute(pipe)
 
     def _get_current_status(self):
-        data = cache.get(f"{self.CACHE_KEY_PREFIX}{self.session_id}")
-        return data['status'] if data else self.STATUS_INIT
+        return self._status
 
     def start(self):
-        self._set_status(self.STATUS_INIT, "Initializing...")
-        self._thread = threading.Thread(target=self._run_auth_process)
-        self._thread.daemon = True
-        self._thread.start()
+        """
+        Queue the login flow on the dedicated auth worker pool.
+        Credentials are handed over through the cache (not the task args),
+        so they never end up in the broker or the result backend.
+        """
+        self._set_status(self.STATUS_INIT, "Queued, waiting for a free browser...")
+        cache.set(f"{self.OWNER_KEY_PREFIX}{self.session_id}", self.user_id, timeout=600)
+        cache.set(f"{self.PARAMS_KEY_PREFIX}{self.session_id}", {
+            'auth_url': self.auth_url,
+            'leads_url': self.leads_url,
+            'login': self.login,
+            'password': self.password,
+            'user_id': self.user_id,
+            'account_id': self.account_id,
+        }, timeout=600)
+
+        if getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+            # Local development: there is no worker and the cache is per-process,
+            # so keep running the flow next to the web process.
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+            return self.session_id
+
+        from .tasks import run_auth_session
+        run_auth_session.delay(self.session_id)
         return self.session_id
 
+    @classmethod
+    def restore(cls, session_id):
+        """Rebuild a queued session inside the worker. Returns None if it has expired."""
+        params = cache.get(f"{cls.PARAMS_KEY_PREFIX}{session_id}")
+        if not params:
+            return None
+        return cls(
+            params['auth_url'],
+            params['login'],
+            params['password'],
+            leads_url=params.get('leads_url'),
+            user_id=params.get('user_id'),
+            account_id=params.get('account_id'),
+            session_id=session_id,
+        )
+
+    @classmethod
+    def mark_failed(cls, session_id, message):
+        """Fail a session that never got to run, so the UI stops showing it as queued"""
+        cls(None, None, None, session_id=session_id)._set_status(cls.STATUS_FAILED, message)
+
+    def run(self, reuse_stored=True, slots=None):
+        """
+        Run the login flow in the current process. slots are the browser slots
+        dispatch_auth_sessions claimed for it; without them the session claims
+        its own, or joins its user's queue and returns False when none is free.
+        The stored session is only tried with reuse_stored, so a session that
+        waited in the queue doesn't check it again.
+        """
+        if reuse_stored and self._reuse_stored_session():
+            cache.delete(f"{self.PARAMS_KEY_PREFIX}{self.session_id}")
+            return True
+
+        if slots is None:
+            slots = self._claim_slots()
+            if slots is None:
+                auth_queue.push(self.user_id, self.session_id)
+                dispatch_auth_sessions()
+                return False
+        self.used_browser = True
+        try:
+            # Credentials are no longer needed in the cache once the flow owns them
+            cache.delete(f"{self.PARAMS_KEY_PREFIX}{self.session_id}")
+            self._run_auth_process()
+        finally:
+            release_browser_slot(slots)
+            dispatch_auth_sessions()
+        return True
+
+    def _claim_slots(self):
+        # No skipping the line: while logins wait for a browser, this one waits behind them
+        if not auth_queue.is_empty():
+            return None
+        pool_slot = warm_pool.spare_slot()
+        slots = acquire_browser_slot(self.session_id, self.user_id, global_slot=pool_slot)
+        if slots and pool_slot:
+            # The warm browser's slot now covers this login
+            warm_pool.slot = None
+        return slots
+
+    def _reuse_stored_session(self):
+        """
+        Fast path: finish right away with the account's stored storage_state
+        if it still opens leads_url, skipping the browser, captcha and OTP.
+        """
+        if not self.account_id or not self.leads_url:
+            return False
+        session_data = PartnerSession.load(self.account_id)
+        if not session_data:
+            return False
+
+        self._log("Checking stored session...")
+        if not storage_state_is_valid(session_data, self.leads_url):
+            self._log("Stored session expired, running full login.")
+            return False
+
+        self._save_result(session_data)
+        self._set_status(self.STATUS_SUCCESS, "Stored session is still valid")
+        return True
+
     def _set_status(self, status, message=None):
-        cache.set(f"{self.CACHE_KEY_PREFIX}{self.session_id}", {
-            'status': status,
-            'message': message
-        }, timeout=600)
+        self._status = status
+        client = get_redis_client()
+        if client is None:
+            cache.set(f"{self.CACHE_KEY_PREFIX}{self.session_id}", {
+                'status': status,
+                'message': message
+            }, timeout=600)
+            return
+
+        pipe = client.pipeline()
+        self._queue_status(pipe, status, message)
+        self._execute(pipe)
+
+    def _queue_status(self, pipe, status, message):
+        key = f"{self.CACHE_KEY_PREFIX}{self.session_id}"
+        pipe.hset(key, mapping={'status': status, 'message': message or ''})
+        pipe.expire(key, 600)
+        # Push to status streams listening on this session
+        pipe.publish(
+            f"{self.EVENTS_CHANNEL_PREFIX}{self.session_id}",
+            json.dumps({'status': status, 'message': message}),
+        )
+
+    def _execute(self, pipe):
+        # Like the cache (IGNORE_EXCEPTIONS), a Redis hiccup must not kill the login flow
+        try:
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to store auth status: {e}")
+
+    def _page_state(self, page):
+        """Collect every signal the auth flow branches on with one page.evaluate"""
+        return page.evaluate(PAGE_STATE_JS, OTP_INPUT_SELECTORS)
+
+    def _wait_for_page_change(self, page, signature, timeout=2000):
+        # Polls inside the browser, so waiting costs one round trip
+        try:
+            page.wait_for_function(
+                f"([selectors, signature]) => ({PAGE_STATE_JS})(selectors).signature !== signature",
+                arg=[OTP_INPUT_SELECTORS, signature],
+                timeout=timeout,
+                polling=250,
+            )
+        except PlaywrightTimeoutError:
+            return False  # Nothing changed
+        except PlaywrightError:
+            # The page navigated away mid-check, destroying the evaluation context
+            return True
+        return True
+
+    def _check_ticks(self, seconds):
+        """
+        Iteration numbers of the final state checks, for `seconds` of wall time. A DOM
+        change ends a wait early, so an iteration count would not bound the time;
+        time spent waiting for the user's code is added back (see _wait_for_otp).
+        """
+        self._checks_deadline = time.monotonic() + seconds
+        tick = 0
+        while time.monotonic() < self._checks_deadline:
+            yield tick
+            tick += 1
 
     def _save_result(self, session_data):
         cache.set(f"{self.RESULT_KEY_PREFIX}{self.session_id}", session_data, timeout=600)
 
-    def _wait_for_otp(self):
+    def _wait_for_otp(self, timeout=120):
         # Wait up to 2 minutes for OTP
-        for _ in range(120):
+        started = time.monotonic()
+        try:
+            return self._receive_otp(timeout)
+        finally:
+            # Waiting for the user doesn't eat into the final state checks
+            if self._checks_deadline is not None:
+                self._checks_deadline += time.monotonic() - started
+
+    def _receive_otp(self, timeout):
+        client = get_redis_client()
+        if client is not None:
+            # Block on the list SubmitOtpView pushes to: wakes up as soon as the
+            # code arrives and costs a single round trip while waiting.
+            try:
+                item = client.blpop(f"{self.OTP_KEY_PREFIX}queue_{self.session_id}", timeout=timeout)
+            except Exception as e:
+                self._log(f"Error waiting for code: {e}")
+                return None
+            return item[1].decode() if item else None
+
+        for _ in range(timeout):
             otp = cache.get(f"{self.OTP_KEY_PREFIX}{self.session_id}")
             if otp:
+                cache.delete(f"{self.OTP_KEY_PREFIX}{self.session_id}")
                 return otp
             time.sleep(1)
         return None
@@ -97,50 +738,27 @@ class AuthSession:
         self._set_status(self.STATUS_RUNNING, "Starting browser...")
         playwright = None
         browser = None
+        context = None
         try:
-            show_browser = getattr(settings, 'PARTNER_AUTH_SHOW_BROWSER', False)
-            headless_mode = not show_browser
-            self._log(f"Launching browser (Headless: {headless_mode})...")
-            playwright = sync_playwright().start()
-            
-            # Add arguments to reduce bot detection
-            browser = playwright.chromium.launch(
-                headless=headless_mode, 
-                args=[
-                    '--disable-blink-features=AutomationControlled',
-                    '--no-sandbox',
-                    '--disable-setuid-sandbox',
-                    '--disable-infobars',
-                    '--window-position=0,0',
-                    '--ignore-certificate-errors',
-                    '--ignore-ssl-errors',
-                    '--disable-gpu',
-                    '--disable-software-rasterizer',
-                ]
-            )
-            
-            # Create context with a realistic User Agent
-            context = browser.new_context(
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
-                viewport={'width': 1366, 'height': 768},
-                device_scale_factor=1,
-                is_mobile=False,
-                has_touch=False,
-                locale='en-US',
-                timezone_id='America/New_York'
-            )
-            
-            # Inject script to hide webdriver property
-            context.add_init_script("""
-                Object.defineProperty(navigator, 'webdriver', {
-                    get: () => undefined
-                });
-            """)
-            
-            page = context.new_page()
+            warm = warm_pool.claim(self.auth_url)
+            if warm:
+                context, page, navigated = warm
+                self._log("Using pre-warmed browser context.")
+            else:
+                # This login's slot covers one browser: don't leave the warm one next to it
+                warm_pool.close()
+                show_browser = getattr(settings, 'PARTNER_AUTH_SHOW_BROWSER', False)
+                headless_mode = not show_browser
+                self._log(f"Launching browser (Headless: {headless_mode})...")
+                playwright = sync_playwright().start()
+                browser = launch_auth_browser(playwright, headless_mode)
+                context = new_auth_context(browser)
+                page = context.new_page()
+                navigated = False
 
-            self._log(f"Navigating to {self.auth_url}...")
-            page.goto(self.auth_url)
+            if not navigated:
+                self._log(f"Navigating to {self.auth_url}...")
+                page.goto(self.auth_url)
             
             # Wait for content to load
             try:
@@ -152,7 +770,7 @@ class AuthSession:
             self._dump_page(page, "01_initial_load")
 
             # Check for Captcha (SmartCaptcha / Checkbox)
-            if "SmartCaptcha" in page.content() or "checkbox-captcha" in page.content() or "robot" in page.title().lower():
+            if self._page_state(page)['captcha']:
                 self._log("Captcha detected!")
                 self._set_status(self.STATUS_RUNNING, "Solving Captcha...")
                 self._dump_page(page, "01_captcha_found")
@@ -383,18 +1001,20 @@ class AuthSession:
             
             # Loop to check state
             success = False
-            for i in range(20): # Increased iterations to 20 (approx 40s) for slow SMS arrival/UI transitions
+            # Bounded by time (PARTNER_AUTH_CHECK_SECONDS) for slow SMS arrival/UI transitions
+            for i in self._check_ticks(getattr(settings, 'PARTNER_AUTH_CHECK_SECONDS', 40)):
                 try:
-                    url = page.url
-                    title = page.title()
-                    content = page.content()
+                    # Single round trip to the browser for every signal of this tick
+                    state = self._page_state(page)
                 except Exception as nav_err:
                     self._log(f"Navigation/Loading in progress... ({str(nav_err)})")
                     time.sleep(2)
                     continue
+                url = state['url']
+                title = state['title']
                 
                 # Check errors first
-                if "Incorrect password" in content or "Неверный пароль" in content:
+                if state['incorrect_password']:
                      self._log("ERROR: Yandex reported 'Incorrect password'.")
                      self._set_status(self.STATUS_FAILED, "Incorrect Password")
                      # We explicitly DO NOT return here immediately to allow manual correction if user is watching
@@ -417,19 +1037,7 @@ class AuthSession:
                 
                 # Check if we landed on generic Yandex ID page (Logged in successfully but not redirected)
                 # We check for URL text OR for specific elements that only appear when logged in on the profile page
-                is_profile_page = False
-                if "id.yandex." in url and "auth" not in url:
-                    is_profile_page = True
-                
-                # Enhanced check for profile page elements
-                if not is_profile_page:
-                    try:
-                        if page.locator('div[data-testid="profile-card"]').count() > 0 or \
-                           page.locator('div[data-testid="user-avatar"]').count() > 0 or \
-                           page.locator('div[data-testid="account-user-card"]').count() > 0:
-                            is_profile_page = True
-                    except:
-                        pass
+                is_profile_page = ("id.yandex." in url and "auth" not in url) or state['profile']
 
                 if is_profile_page:
                      self._log(f"Landed on Yandex ID profile. Authenticated! Redirecting to {self.leads_url}...")
@@ -443,16 +1051,14 @@ class AuthSession:
                 # Check for email code challenge
                 if "challenges/email-code" in url:
                     self._log("Email code challenge detected.")
-                    try:
+                    if state['email_hint']:
                         # Extract the masked email to inform the user
-                        hint_element = page.locator('div.description-block >> span').first
-                        hint_text = hint_element.text_content()
-                        masked_email = hint_text.split(' на ')[-1].replace('.', '')
+                        masked_email = state['email_hint'].split(' на ')[-1].replace('.', '')
                         self._log(f"Code sent to: {masked_email}")
                         self._set_status(self.STATUS_OTP_REQUIRED, f"Code sent to {masked_email}")
                         # Do not return, let the loop continue to detect the input field
-                    except Exception as e:
-                        self._log(f"Could not extract masked email: {e}")
+                    else:
+                        self._log("Could not extract masked email")
                         self._set_status(self.STATUS_OTP_REQUIRED, "Email code required")
                         # Do not return
 
@@ -462,20 +1068,18 @@ class AuthSession:
                      # Check if we need to click a button to send SMS
                      try:
                          # Look for specific phone confirmation button
-                         confirm_btn_next = page.locator('button[data-testid="challenges-phone-confirmation-next"]').first
-                         if confirm_btn_next.is_visible():
+                         if state['phone_next_button']:
                              self._log("Found 'challenges-phone-confirmation-next' button. Clicking...")
-                             confirm_btn_next.click()
+                             page.locator('button[data-testid="challenges-phone-confirmation-next"]').first.click()
                              time.sleep(2)
                              continue
 
                          # Look for common 'Confirm' or 'Send' buttons (fallback)
-                         confirm_btn = page.locator('button[type="submit"], button[data-testid="submit-button"]').first
-                         if confirm_btn.is_visible():
-                             btn_text = confirm_btn.text_content().lower()
+                         btn_text = (state['submit_button_text'] or '').lower()
+                         if state['submit_button_text'] is not None:
                              if "sms" in btn_text or "code" in btn_text or "get" in btn_text or "код" in btn_text or "смс" in btn_text or "confirm" in btn_text or "подтвердить" in btn_text:
                                  self._log(f"Found confirmation button '{btn_text}'. Clicking...")
-                                 confirm_btn.click()
+                                 page.locator('button[type="submit"], button[data-testid="submit-button"]').first.click()
                                  # Wait for input to appear
                                  time.sleep(2)
                                  continue
@@ -483,14 +1087,13 @@ class AuthSession:
                          self._log(f"Error checking confirm button: {e}")
 
                 # Check for "WebauthnRegStart" (Skip face/fingerprint login)
-                if "WebauthnRegStart" in content or "Want to log in with face or fingerprint?" in content:
+                if state['webauthn_promo']:
                      self._log("Detected Webauthn/Biometric promo page. Skipping...")
                      try:
                          # Click "Remind me later" button
-                         skip_btn = page.locator('button[data-testid="webauthn-reg-later-button"]').first
-                         if skip_btn.is_visible():
+                         if state['webauthn_later_button']:
                              self._log("Found 'Remind me later' button. Clicking...")
-                             skip_btn.click()
+                             page.locator('button[data-testid="webauthn-reg-later-button"]').first.click()
                              time.sleep(2)
                              continue
                      except Exception as e:
@@ -499,30 +1102,9 @@ class AuthSession:
                 # Check for OTP Input
                 # We need to distinguish between "Button to send SMS" and "Input for SMS"
                 # The dump showed buttons with text "Log in with SMS code", triggering false positive.
-                
-                otp_input_visible = False
-                otp_input = None
-                
-                # Specific selectors for the code input field
-                code_selectors = [
-                    'input[data-testid="code-field-segment"]', # Segmented input (modern yandex)
-                    'input[data-testid="text-field-input"]',   # Email code input
-                    'input[name="code"]', 
-                    'input[type="tel"]',
-                    'input[id="passp-field-phoneCode"]',
-                    'input[autocomplete="one-time-code"]'
-                ]
-                
-                for sel in code_selectors:
-                    # Check count first to avoid strict mode errors for is_visible()
-                    if page.locator(sel).count() > 0:
-                        # If multiple elements (like segments), check if the first one is visible
-                        if page.locator(sel).first.is_visible():
-                            otp_input_visible = True
-                            otp_input = page.locator(sel)
-                            break
-                
-                if otp_input_visible:
+                # The snapshot reports the first code input selector whose first match is visible.
+                if state['otp_selector']:
+                     otp_input = page.locator(state['otp_selector'])
                      # Identify input field for code
                      self._dump_page(page, f"05_otp_needed_{i}")
                      self._set_status(self.STATUS_OTP_REQUIRED, "Enter SMS/Code")
@@ -538,12 +1120,11 @@ class AuthSession:
                          
                          try:
                              # Try filling generic code inputs
-                             segmented = page.locator('input[data-testid="code-field-segment"]')
-                             if segmented.count() > 0:
+                             if state['otp_segmented']:
                                  self._log("Detected segmented code input. Typing...")
-                                 segmented.first.click()
+                                 page.locator('input[data-testid="code-field-segment"]').first.click()
                                  page.keyboard.type(code)
-                             elif otp_input:
+                             else:
                                  otp_input.first.fill(code)
                                  # Sometimes enter is needed
                                  page.keyboard.press("Enter")
@@ -561,20 +1142,17 @@ class AuthSession:
                              self._log(f"Error filling OTP: {e}")
                              # If error, maybe manual entry worked? Continue loop
                 
-                elif "code" in content.lower() or "sms" in content.lower():
+                elif state['mentions_code']:
                     # Should we click "Log in via SMS" if password failed?
                     # Only if we are stuck on password error page
-                    if "Incorrect password" in content and "Log in with SMS code" in content:
-                         sms_btn = page.locator('button[data-testid="auth-by-sms-button"]')
-                         if sms_btn.is_visible():
-                             self._log("Incorrect password detected. Clicking 'Log in with SMS code' fallback...")
-                             sms_btn.click()
-                             time.sleep(2)
-                             continue
-
-
+                    if state['sms_fallback'] and state['sms_button']:
+                         self._log("Incorrect password detected. Clicking 'Log in with SMS code' fallback...")
+                         page.locator('button[data-testid="auth-by-sms-button"]').first.click()
+                         time.sleep(2)
+                         continue
 
-                time.sleep(2)
+                # Instead of a fixed pause, wake up as soon as the page changes (up to 2s)
+                self._wait_for_page_change(page, state['signature'])
             
             # If we fall through here, auth failed or timed out
             self._log("Process finished without clear success. Dumping state...")
@@ -591,6 +1169,11 @@ class AuthSession:
                 time.sleep(60)
             self._set_status(self.STATUS_FAILED, f"Error: {str(e)}")
         finally:
+            if context:
+                try:
+                    context.close()
+                except:
+                    pass
             if browser:
                 try:
                     browser.close()
@@ -606,15 +1189,266 @@ class AuthSession:
             if current == self.STATUS_RUNNING:
                  self._set_status(self.STATUS_FAILED, "Process terminated unexpectedly")
 
-def get_auth_status(session_id):
-    data = cache.get(f"{AuthSession.CACHE_KEY_PREFIX}{session_id}")
-    if data:
-        # Include logs
-        logs = cache.get(f"partner_auth_logs_{session_id}", [])
-        data['logs'] = logs
-    return data
+def _try_claim(prefix, size, owner, timeout):
+    # cache.add is atomic (SET NX on Redis), which makes each key a semaphore slot
+    for index in range(size):
+        key = f"{prefix}{index}"
+        if cache.add(key, owner, timeout=timeout):
+            return key
+    return None
+
+def _try_claim_user_slot(user_id, owner, timeout):
+    return _try_claim(
+        f"partner_auth_user_slot_{user_id}_",
+        getattr(settings, 'PARTNER_AUTH_MAX_BROWSERS_PER_USER', 1),
+        owner,
+        timeout,
+    )
+
+def acquire_browser_slot(session_id, user_id=None, global_slot=None):
+    """
+    Claim one of PARTNER_AUTH_MAX_BROWSERS global slots and one of
+    PARTNER_AUTH_MAX_BROWSERS_PER_USER slots for the user, so one user
+    can't occupy the whole pool. Returns the claimed keys or None.
+    A global_slot this process already holds (the warm pool's) is taken
+    over instead of claiming another one.
+    Slots expire on their own if a worker dies mid-flow.
+    """
+    timeout = getattr(settings, 'PARTNER_AUTH_SLOT_TIMEOUT', 900)
+    claimed = []
+    if user_id is not None:
+        user_slot = _try_claim_user_slot(user_id, session_id, timeout)
+        if not user_slot:
+            return None
+        claimed.append(user_slot)
+
+    if global_slot is not None:
+        cache.set(global_slot, session_id, timeout=timeout)
+        claimed.append(global_slot)
+        return claimed
+
+    global_slot = _try_claim(
+        "partner_auth_slot_",
+        getattr(settings, 'PARTNER_AUTH_MAX_BROWSERS', 2),
+        session_id,
+        timeout,
+    )
+    if not global_slot:
+        release_browser_slot(claimed)
+        return None
+    claimed.append(global_slot)
+    return claimed
+
+def release_browser_slot(keys):
+    cache.delete_many(keys)
+
+
+class AuthQueue:
+    """
+    Logins waiting for a browser slot: a FIFO per user, served round-robin
+    across users as slots free up (see dispatch_auth_sessions), so one user's
+    burst of logins can't starve another user's and each user's logins start
+    in order. The queue is a single cache entry, changed under a cache.add lock.
+    """
+
+    KEY = "partner_auth_queue"
+    LOCK_KEY = "partner_auth_queue_lock"
+    LOCK_TIMEOUT = 5
+
+    def push(self, user_id, session_id):
+        def push(state):
+            state['waiting'].setdefault(user_id, []).append(session_id)
+            if user_id not in state['users']:
+                state['users'].append(user_id)
+        self._change(push)
+
+    def is_empty(self):
+        return not (cache.get(self.KEY) or {}).get('users')
+
+    def pop(self, claim_user_slot):
+        """
+        The session id of the next user in turn whose per-user slot
+        claim_user_slot(user_id) could claim, with that slot; None if no one
+        can start. The user moves to the back of the round.
+        """
+        def pop(state):
+            for user_id in list(state['users']):
+                sessions = state['waiting'].get(user_id)
+                if not sessions:
+                    state['users'].remove(user_id)
+                    state['waiting'].pop(user_id, None)
+                    continue
+                user_slot = claim_user_slot(user_id) if user_id is not None else None
+                if user_id is not None and user_slot is None:
+                    # This user's browsers are all busy, the next user gets the slot
+                    continue
+                session_id = sessions.pop(0)
+                state['users'].remove(user_id)
+                if sessions:
+                    state['users'].append(user_id)
+                else:
+                    del state['waiting'][user_id]
+                return session_id, user_slot
+            return None
+        return self._change(pop)
+
+    def _change(self, change):
+        # A lock left by a dead worker expires after LOCK_TIMEOUT
+        while not cache.add(self.LOCK_KEY, 1, timeout=self.LOCK_TIMEOUT):
+            time.sleep(0.01)
+        try:
+            state = cache.get(self.KEY) or {'users': [], 'waiting': {}}
+            result = change(state)
+            cache.set(self.KEY, state, timeout=None)
+            return result
+        finally:
+            cache.delete(self.LOCK_KEY)
+
+
+auth_queue = AuthQueue()
+
+
+def dispatch_auth_sessions():
+    """
+    Start queued logins while browser slots are free, taking users in turn
+    (see AuthQueue). The slots are claimed here and handed to the
+    run_auth_session task, so a login arriving meanwhile can't take them.
+    Called whenever a slot is released and when a login joins the queue.
+    """
+    from .tasks import run_auth_session
+
+    if auth_queue.is_empty():
+        return []
+    timeout = getattr(settings, 'PARTNER_AUTH_SLOT_TIMEOUT', 900)
+    started = []
+    while True:
+        global_slot = _try_claim(
+            "partner_auth_slot_", getattr(settings, 'PARTNER_AUTH_MAX_BROWSERS', 2), "dispatch", timeout
+        )
+        if not global_slot:
+            break
+        picked = auth_queue.pop(lambda user_id: _try_claim_user_slot(user_id, "dispatch", timeout))
+        if picked is None:
+            release_browser_slot([global_slot])
+            break
+        session_id, user_slot = picked
+        slots = [slot for slot in (user_slot, global_slot) if slot]
+        cache.set_many(dict.fromkeys(slots, session_id), timeout=timeout)
+        run_auth_session.delay(session_id, slots)
+        started.append(session_id)
+    return started
+
+def get_redis_client():
+    """Raw client of the Redis cache, or None when the cache isn't Redis (local dev)."""
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        return None
+
+def get_auth_status(session_id, cursor=None):
+    """
+    Current status, message and logs of a session.
+    With a cursor (returned by the previous call) only newer log lines are
+    returned. Without Redis the cursor is None and all lines are returned.
+    """
+    client = get_redis_client()
+    if client is None:
+        data = cache.get(f"{AuthSession.CACHE_KEY_PREFIX}{session_id}")
+        if data:
+            # Include logs
+            logs = cache.get(f"{AuthSession.LOGS_KEY_PREFIX}{session_id}", [])
+            data['logs'] = logs
+            data['cursor'] = None
+        return data
+
+    logs_key = f"{AuthSession.LOGS_KEY_PREFIX}{session_id}"
+    pipe = client.pipeline()
+    pipe.hgetall(f"{AuthSession.CACHE_KEY_PREFIX}{session_id}")
+    if cursor and STREAM_ID_RE.match(cursor):
+        pipe.xrange(logs_key, min=f"({cursor}")
+    else:
+        pipe.xrange(logs_key)
+    status, entries = pipe.execute()
+    if not status:
+        return None
+
+    return {
+        'status': status[b'status'].decode(),
+        'message': status[b'message'].decode() or None,
+        'logs': [fields[b'line'].decode() for _entry_id, fields in entries],
+        'cursor': entries[-1][0].decode() if entries else cursor,
+    }
+
+async def iter_auth_events(session_id, timeout=600, heartbeat=15):
+    """
+    Yield status events of an auth session as AuthSession emits them.
+    The first event is the full status (with logs), the following ones carry
+    either a new status/message or a single new log line. A None item is a
+    heartbeat. Stops once the session reaches SUCCESS/FAILED or after timeout.
+    Async, so a waiting stream holds no worker thread under ASGI.
+    """
+    finished = (AuthSession.STATUS_SUCCESS, AuthSession.STATUS_FAILED)
+    deadline = time.monotonic() + timeout
+    client = None
+    pubsub = None
+    if get_redis_client() is not None:
+        # Subscribe before reading the snapshot so nothing emitted in between is lost
+        client = aioredis.Redis.from_url(settings.REDIS_URL)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(f"{AuthSession.EVENTS_CHANNEL_PREFIX}{session_id}")
+
+    try:
+        snapshot = await sync_to_async(get_auth_status)(session_id)
+        if not snapshot:
+            return
+        yield snapshot
+        if snapshot['status'] in finished:
+            return
+
+        if pubsub is None:
+            # Without Redis fall back to watching the cache from the server side
+            last = snapshot
+            while time.monotonic() < deadline:
+                await asyncio.sleep(1)
+                current = await sync_to_async(get_auth_status)(session_id)
+                if not current:
+                    return
+                if current != last:
+                    last = current
+                    yield current
+                    if current['status'] in finished:
+                        return
+            return
+
+        while time.monotonic() < deadline:
+            message = await pubsub.get_message(timeout=heartbeat)
+            if message is None:
+                yield None
+                continue
+            event = json.loads(message['data'])
+            yield event
+            if event.get('status') in finished:
+                return
+    finally:
+        if pubsub is not None:
+            await pubsub.aclose()
+        if client is not None:
+            await client.aclose()
+
+def auth_session_owner(session_id):
+    """Id of the user who started an auth session, None once it has expired"""
+    return cache.get(f"{AuthSession.OWNER_KEY_PREFIX}{session_id}")
 
 def submit_auth_otp(session_id, code):
+    client = get_redis_client()
+    if client is not None:
+        key = f"{AuthSession.OTP_KEY_PREFIX}queue_{session_id}"
+        pipe = client.pipeline()
+        pipe.rpush(key, code)
+        pipe.expire(key, 300)
+        pipe.execute()
+        return
     cache.set(f"{AuthSession.OTP_KEY_PREFIX}{session_id}", code, timeout=300)
 
 def get_auth_result(session_id):
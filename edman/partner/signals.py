@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import PartnerAccount
+from .tasks import rebuild_lead_facets
+
+
+@receiver(post_delete, sender=PartnerAccount)
+def recount_facets_after_account_delete(sender, instance, **kwargs):
+    # The account's leads are gone with it, recount once the delete is committed
+    user_id = instance.user_id
+    transaction.on_commit(lambda: rebuild_lead_facets.delay(user_id))
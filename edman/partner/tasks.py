@@ -1,14 +1,26 @@
+import json
+import logging
 import os
+import shutil
+import socket
 import time
+from collections import Counter
+from pathlib import Path
 import pandas as pd
 from celery import chain
+from django.conf import settings
 from config import celery_app
-from .models import PartnerAccount, PartnerLead
+from .models import App, PartnerAccount, PartnerLead, PartnerSession
+from .services import AuthSession, dispatch_auth_sessions, release_browser_slot, warm_pool
+from .facets import FACET_FIELDS, apply_facet_deltas, count_change, facet_values, rebuild_facets
+from .rollups import apply_rollup_deltas, count_rollup_change, rollup_key
 from playwright.sync_api import sync_playwright
 from datetime import datetime
 from django.utils.timezone import make_aware
 from django.utils import timezone
 
+logger = logging.getLogger(__name__)
+
 def parse_date(date_str):
     if not date_str or pd.isna(date_str): return None
     try:
@@ -74,6 +86,106 @@ def extract_phone_number(page, external_id, base_url):
         print(f"❌ Error extracting phone for {external_id}: {e}")
         return None
 
+def _dir_size(path):
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+def _profile_in_use(profile):
+    """
+    Whether a running Chromium holds the profile. Its SingletonLock is a
+    symlink to "<hostname>-<pid>" that a crashed browser leaves behind.
+    """
+    try:
+        owner = os.readlink(profile / 'SingletonLock')
+    except OSError:
+        return False
+    hostname, _, pid = owner.rpartition('-')
+    if hostname != socket.gethostname() or not pid.isdigit():
+        # Locked from another host sharing the directory: can't tell, keep it
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Alive, run by another user
+    return True
+
+def prune_enrichment_profiles():
+    """
+    Evict per-account browser profiles unused for PARTNER_ENRICH_PROFILES_MAX_AGE
+    seconds, then the least recently used ones above PARTNER_ENRICH_PROFILES_MAX_BYTES.
+    Profiles a running batch has open are left alone.
+    """
+    profiles_dir = getattr(settings, 'PARTNER_ENRICH_PROFILES_DIR', '')
+    if not profiles_dir or not os.path.isdir(profiles_dir):
+        return
+    max_age = getattr(settings, 'PARTNER_ENRICH_PROFILES_MAX_AGE', 14 * 24 * 3600)
+    max_bytes = getattr(settings, 'PARTNER_ENRICH_PROFILES_MAX_BYTES', 2 * 1024 ** 3)
+
+    now = time.time()
+    profiles = []
+    for profile in Path(profiles_dir).iterdir():
+        if not profile.is_dir() or _profile_in_use(profile):
+            continue
+        last_used = profile.stat().st_mtime
+        if now - last_used > max_age:
+            shutil.rmtree(profile, ignore_errors=True)
+            continue
+        profiles.append((last_used, _dir_size(profile), profile))
+
+    total = sum(size for _last_used, size, _profile in profiles)
+    for _last_used, size, profile in sorted(profiles):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(profile, ignore_errors=True)
+        total -= size
+
+def open_enrichment_context(p, account, state):
+    """
+    Browser context for an enrichment batch. With PARTNER_ENRICH_PROFILES_DIR set,
+    each account gets a persistent profile, so the partner app's JS/CSS bundles
+    come from its HTTP disk cache (capped by PARTNER_ENRICH_CACHE_MAX_BYTES)
+    instead of being downloaded again on every batch. state is the account's
+    stored storage_state.
+    """
+    profiles_dir = getattr(settings, 'PARTNER_ENRICH_PROFILES_DIR', '')
+    if profiles_dir:
+        profile = Path(profiles_dir) / str(account.id)
+        try:
+            profile.mkdir(parents=True, exist_ok=True)
+            # Touch the profile so age based eviction sees it as recently used
+            os.utime(profile)
+            cache_size = getattr(settings, 'PARTNER_ENRICH_CACHE_MAX_BYTES', 200 * 1024 ** 2)
+            context = p.chromium.launch_persistent_context(
+                str(profile),
+                headless=True,
+                args=[f"--disk-cache-size={cache_size}"],
+            )
+            # Persistent contexts don't take storage_state: apply the stored session
+            # on top of the profile, cookies directly and localStorage on the first
+            # navigation to each origin. The sessionStorage flag keeps later pages of
+            # the batch from overwriting what the partner app has stored since.
+            if state.get('cookies'):
+                context.add_cookies(state['cookies'])
+            if state.get('origins'):
+                context.add_init_script(
+                    "(() => {"
+                    " const flag = 'edman_storage_seeded';"
+                    " if (sessionStorage.getItem(flag)) return;"
+                    " sessionStorage.setItem(flag, '1');"
+                    f" const origins = {json.dumps(state['origins'])};"
+                    " const entry = origins.find((o) => o.origin === location.origin);"
+                    " if (entry) entry.localStorage.forEach((item) => localStorage.setItem(item.name, item.value));"
+                    " })();"
+                )
+            return context
+        except Exception as e:
+            # e.g. the profile is locked by another batch of the same account
+            logger.warning(f"[{account.id}] Persistent profile unavailable, using a fresh context: {e}")
+
+    browser = p.chromium.launch(headless=True)
+    return browser.new_context(storage_state=state)
+
 @celery_app.task(time_limit=600, soft_time_limit=600)
 def process_leads_batch(account_id, leads_batch):
     """
@@ -83,10 +195,13 @@ def process_leads_batch(account_id, leads_batch):
     # Allow DB access within Playwright's loop
     os.environ["DJANGO_ALLOW_ASYNC_UNSAFE"] = "true"
     print(f"[{account_id}] Starting batch of {len(leads_batch)} items")
+    facet_deltas: Counter = Counter()
+    rollup_deltas: Counter = Counter()
     
     try:
         account = PartnerAccount.objects.get(id=account_id)
-        if not account.session_data:
+        session_data = PartnerSession.load(account_id)
+        if not session_data:
             print("No session data for account")
             return "No Session"
 
@@ -94,11 +209,16 @@ def process_leads_batch(account_id, leads_batch):
         if not base_url:
              raise ValueError(f"Leads URL is missing for App: {account.app.name}")
 
-        existing_ids = set(PartnerLead.objects.filter(account=account).values_list('external_id', flat=True))
+        # external_id -> current facet/rollup fields, to count changes of updated leads
+        existing = {
+            row['external_id']: row
+            for row in PartnerLead.objects.filter(account=account).values('external_id', 'lead_created_at', *FACET_FIELDS)
+        }
         
         with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(storage_state=account.session_data)
+            context = open_enrichment_context(p, account, session_data)
+            # None for a persistent context, which owns its browser
+            browser = context.browser
             page = context.new_page()
             
             for row in leads_batch:
@@ -133,9 +253,15 @@ def process_leads_batch(account_id, leads_batch):
                     'complaint_status': get_val('complaint_status'),
                 }
 
-                if external_id in existing_ids:
+                if external_id in existing:
                     # Update
-                    PartnerLead.objects.filter(account=account, external_id=external_id).update(**defaults)
+                    # update() skips auto_now
+                    PartnerLead.objects.filter(account=account, external_id=external_id).update(
+                        updated_at=timezone.now(), **defaults
+                    )
+                    count_change(facet_deltas, facet_values(existing[external_id]), facet_values(defaults))
+                    count_rollup_change(rollup_deltas, rollup_key(existing[external_id]), rollup_key(defaults))
+                    existing[external_id] = defaults
                 else:
                     # Create + Phone
                     phone = extract_phone_number(page, external_id, base_url)
@@ -145,12 +271,22 @@ def process_leads_batch(account_id, leads_batch):
                         phone=phone,
                         **defaults
                     )
-                    existing_ids.add(external_id)
+                    count_change(facet_deltas, None, facet_values(defaults))
+                    count_rollup_change(rollup_deltas, None, rollup_key(defaults))
+                    existing[external_id] = defaults
 
-            browser.close()
+            context.close()
+            if browser:
+                browser.close()
     except Exception as e:
         print(f"Batch task failed: {e}")
         raise e
+    finally:
+        # Also on failure: the leads written so far are already counted
+        if facet_deltas:
+            apply_facet_deltas(account.user_id, facet_deltas)
+        if rollup_deltas:
+            apply_rollup_deltas(account_id, rollup_deltas)
 
 @celery_app.task
 def process_leads_file(account_id, file_path):
@@ -178,6 +314,9 @@ def process_leads_file(account_id, file_path):
         
         print(f"Split {len(leads_data)} leads into {len(batches)} batches.")
 
+        # Keep the enrichment browser profiles within their size/age budget
+        prune_enrichment_profiles()
+
         # 4. Cleanup file immediately (since data is now memory/serialized)
         if os.path.exists(file_path):
             os.remove(file_path)
@@ -194,3 +333,49 @@ def process_leads_file(account_id, file_path):
         # Ensure cleanup on error
         if os.path.exists(file_path):
             os.remove(file_path)
+
+
+@celery_app.task(time_limit=900, soft_time_limit=870)
+def run_auth_session(session_id, slots=None):
+    """
+    Run a partner login on the dedicated auth worker pool. Without a free
+    browser slot the session joins its user's queue (see AuthQueue) and this
+    task ends; it runs again, with slots already claimed for the session, once
+    the session's turn comes.
+    """
+    session = AuthSession.restore(session_id)
+    if session is None:
+        logger.warning(f"Auth session {session_id} expired before a browser was free")
+        AuthSession.mark_failed(session_id, "Timed out waiting for a free browser")
+        if slots:
+            release_browser_slot(slots)
+            dispatch_auth_sessions()
+        return "Expired"
+
+    if not warm_pool.call(_run_and_refill, session, slots):
+        # Slots held by a worker that died are only freed by their timeout
+        dispatch_auth_queue.apply_async(countdown=getattr(settings, 'PARTNER_AUTH_SLOT_TIMEOUT', 900))
+        return "Queued"
+    return "Done"
+
+
+@celery_app.task
+def dispatch_auth_queue():
+    """Start queued logins if browser slots were freed without a release"""
+    return dispatch_auth_sessions()
+
+
+def _run_and_refill(session, slots=None):
+    try:
+        # The stored session is checked once, before the session waits for a browser
+        return session.run(reuse_stored=slots is None, slots=slots)
+    finally:
+        if session.used_browser:
+            # Get a warm context ready for the next login handled by this process
+            warm_pool.refill(App.objects.values_list('auth_url', flat=True).distinct())
+
+
+@celery_app.task
+def rebuild_lead_facets(user_id):
+    """Recount a user's lead facets, e.g. after an account and its leads were deleted"""
+    rebuild_facets(user_id)
@@ -1,3 +1,1014 @@
-from django.test import TestCase
+import importlib
+import os
+import socket
+import time
+from collections import Counter
+from datetime import UTC
+from datetime import datetime
+from datetime import timedelta
+from typing import Any
+from unittest import mock
 
-# Create your tests here.
+import pytest
+import requests
+from asgiref.sync import async_to_sync
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from playwright.sync_api import Error as PlaywrightError
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+from edman.partner import services
+from edman.partner.api.serializers import PartnerLeadSerializer
+from edman.partner.api.views import PartnerLeadCursorPagination
+from edman.partner import tasks
+from edman.partner.facets import apply_facet_deltas
+from edman.partner.facets import count_change
+from edman.partner.facets import facet_values
+from edman.partner.facets import get_facets
+from edman.partner.facets import rebuild_facets
+from edman.partner.models import App
+from edman.partner.models import LeadFacet
+from edman.partner.models import PartnerAccount
+from edman.partner.models import PartnerLead
+from edman.partner.models import PartnerSession
+from edman.partner.pagination import KeysetPage
+from edman.partner.rollups import apply_rollup_deltas
+from edman.partner.rollups import count_rollup_change
+from edman.partner.rollups import rebuild_rollups
+from edman.partner.rollups import rollup_key
+from edman.partner.rollups import rollup_totals
+from edman.partner.views import LeadListView
+from edman.users.tests.factories import UserFactory
+from edman.utils.phones import normalize_phone
+from edman.partner.services import AuthSession
+from edman.partner.services import get_auth_status
+
+
+@pytest.fixture
+def redis_client():
+    client = mock.MagicMock()
+    with mock.patch.object(services, "get_redis_client", return_value=client):
+        yield client
+
+
+def round_trips(client):
+    """Each pipeline execute() is one round trip, so is every direct command."""
+    direct = [call for call in client.method_calls if not call[0].startswith("pipeline")]
+    return client.pipeline.return_value.execute.call_count + len(direct)
+
+
+class TestAuthLogStorage:
+    def test_log_line_is_one_round_trip(self, redis_client):
+        session = AuthSession("https://auth.test/", "login", "password")
+        session._log("Navigating...")
+
+        assert round_trips(redis_client) == 1
+        pipe = redis_client.pipeline.return_value
+        pipe.xadd.assert_called_once()
+        assert pipe.xadd.call_args.kwargs["maxlen"] == AuthSession.LOG_LIMIT
+
+    def test_round_trips_per_login(self, redis_client):
+        """
+        A typical login writes ~40 log lines and ~10 status changes.
+        The old list read-modify-write storage took 4 round trips per line.
+        """
+        session = AuthSession("https://auth.test/", "login", "password")
+        for i in range(40):
+            session._log(f"Check {i}")
+        for _ in range(10):
+            session._set_status(AuthSession.STATUS_RUNNING, "Working...")
+
+        assert round_trips(redis_client) == 50  # was 40 * 4 + 10 = 170
+
+    def test_status_returns_lines_after_cursor(self, redis_client):
+        pipe = redis_client.pipeline.return_value
+        pipe.execute.return_value = (
+            {b"status": b"RUNNING", b"message": b""},
+            [(b"5-0", {b"line": b"[10:00:00] Next"})],
+        )
+
+        data = get_auth_status("abc", cursor="4-0")
+
+        pipe.xrange.assert_called_once_with(f"{AuthSession.LOGS_KEY_PREFIX}abc", min="(4-0")
+        assert data == {
+            "status": "RUNNING",
+            "message": None,
+            "logs": ["[10:00:00] Next"],
+            "cursor": "5-0",
+        }
+        assert round_trips(redis_client) == 1
+
+    def test_status_ignores_malformed_cursor(self, redis_client):
+        pipe = redis_client.pipeline.return_value
+        pipe.execute.return_value = ({}, [])
+
+        assert get_auth_status("abc", cursor="1; DROP") is None
+        pipe.xrange.assert_called_once_with(f"{AuthSession.LOGS_KEY_PREFIX}abc")
+
+
+@pytest.mark.django_db
+class TestAuthStatusViews:
+    @pytest.fixture
+    def session_id(self, user):
+        session = AuthSession("https://auth.test/", "login", "password", user_id=user.id)
+        with mock.patch.object(tasks.run_auth_session, "delay"):
+            return session.start()
+
+    def test_owner_sees_status(self, client, user, session_id):
+        client.force_login(user)
+        response = client.get(f"/partner/auth/status/{session_id}/")
+        assert response.status_code == 200
+        assert response.json()["status"] == AuthSession.STATUS_INIT
+
+    @pytest.mark.parametrize("url", ["/partner/auth/status/{}/", "/partner/auth/stream/{}/"])
+    def test_other_users_get_404(self, client, session_id, url):
+        client.force_login(UserFactory())
+        assert client.get(url.format(session_id)).status_code == 404
+
+    def test_other_users_cannot_submit_otp(self, client, session_id):
+        client.force_login(UserFactory())
+        with mock.patch("edman.partner.views.submit_auth_otp") as submit:
+            response = client.post(
+                "/partner/auth/otp/", data={"session_id": session_id, "code": "1234"}, content_type="application/json"
+            )
+        assert response.status_code == 404
+        submit.assert_not_called()
+
+    def test_stream_is_not_served_under_wsgi(self, client, user, session_id):
+        # The test client is WSGI: answer 204 so the page polls instead of holding a worker
+        client.force_login(user)
+        response = client.get(f"/partner/auth/stream/{session_id}/")
+        assert response.status_code == 204
+
+    def test_events_without_redis(self, session_id):
+        session = AuthSession("https://auth.test/", "login", "password", session_id=session_id)
+
+        async def collect():
+            events = []
+            async for event in services.iter_auth_events(session_id):
+                events.append(event)
+                if len(events) == 1:
+                    await sync_to_async(session._set_status)(AuthSession.STATUS_SUCCESS, "Done")
+            return events
+
+        with mock.patch("asyncio.sleep", mock.AsyncMock()):
+            events = async_to_sync(collect)()
+        assert [event["status"] for event in events] == [AuthSession.STATUS_INIT, AuthSession.STATUS_SUCCESS]
+
+
+class TestDebugDumpWriter:
+    @pytest.fixture
+    def writer(self, tmp_path, settings):
+        settings.PARTNER_AUTH_DEBUG_DUMPS_SESSION_MAX_BYTES = 250
+        settings.PARTNER_AUTH_DEBUG_DUMPS_MAX_BYTES = 600
+        return services.DebugDumpWriter(root=tmp_path)
+
+    @staticmethod
+    def page(i):
+        # Random-ish content so gzip keeps ~100 bytes of it
+        return "".join(chr(33 + (i * 7919 + n * 104729) % 90) for n in range(100))
+
+    def test_session_is_a_ring_buffer(self, writer, tmp_path):
+        for i in range(5):
+            writer._write("s1", f"dump{i}", self.page(i))
+        dumps = sorted((tmp_path / "s1").iterdir())
+        assert 1 <= len(dumps) < 5
+        assert dumps[-1].name.endswith("dump4.html.gz")
+        assert writer._total == sum(dump.stat().st_size for dump in dumps)
+
+    def test_oldest_sessions_and_legacy_dumps_are_evicted(self, writer, tmp_path, settings):
+        settings.PARTNER_AUTH_DEBUG_DUMPS_MAX_BYTES = 400
+        legacy = tmp_path / "01_login.html"
+        legacy.write_text(self.page(0) * 3)
+        os.utime(legacy, (0, 0))
+        for i, session_id in enumerate(["s1", "s2", "s3", "s4", "s5"]):
+            writer._write(session_id, "dump", self.page(i))
+        assert not legacy.exists()
+        assert not (tmp_path / "s1").exists()
+        assert (tmp_path / "s5").exists()
+        on_disk = sum(f.stat().st_size for f in tmp_path.rglob("*") if f.is_file())
+        assert writer._total == on_disk <= 400
+
+    def test_writes_do_not_rescan_the_tree(self, writer):
+        writer._write("s1", "dump", self.page(0))
+        with mock.patch.object(services.Path, "iterdir") as iterdir, mock.patch.object(services.Path, "stat") as stat:
+            writer._write("s1", "dump", self.page(1))
+        iterdir.assert_not_called()
+        stat.assert_not_called()
+
+
+class TestAuthChecks:
+    @pytest.fixture
+    def clock(self):
+        now = [1000.0]
+        with mock.patch.object(services.time, "monotonic", side_effect=lambda: now[0]):
+            yield now
+
+    def test_checks_are_bounded_by_time_not_iterations(self, clock):
+        session = AuthSession("https://auth.test/", "login", "password")
+        ticks = []
+        for tick in session._check_ticks(40):
+            ticks.append(tick)
+            clock[0] += 0.5  # The page changed quickly
+        assert len(ticks) == 80
+
+    def test_waiting_for_the_code_does_not_count(self, clock):
+        session = AuthSession("https://auth.test/", "login", "password")
+        ticks = session._check_ticks(40)
+        next(ticks)
+
+        def receive(timeout):
+            clock[0] += 100
+            return "1234"
+
+        with mock.patch.object(session, "_receive_otp", side_effect=receive):
+            assert session._wait_for_otp() == "1234"
+        clock[0] += 39
+        assert next(ticks) == 1
+
+    @pytest.mark.parametrize(
+        ("error", "changed"),
+        [(None, True), (PlaywrightTimeoutError("timeout"), False), (PlaywrightError("context destroyed"), True)],
+    )
+    def test_wait_for_page_change(self, error, changed):
+        session = AuthSession("https://auth.test/", "login", "password")
+        page = mock.Mock()
+        page.wait_for_function.side_effect = error
+        assert session._wait_for_page_change(page, "signature") is changed
+
+    def test_wait_for_page_change_does_not_hide_other_errors(self):
+        session = AuthSession("https://auth.test/", "login", "password")
+        page = mock.Mock()
+        page.wait_for_function.side_effect = ValueError
+        with pytest.raises(ValueError):
+            session._wait_for_page_change(page, "signature")
+
+
+class TestRunAuthSession:
+    def test_expired_params_fail_the_session(self):
+        AuthSession("https://auth.test/", "login", "password", session_id="gone")._set_status(
+            AuthSession.STATUS_INIT, "Queued, waiting for a free browser..."
+        )
+
+        assert tasks.run_auth_session.apply(args=["gone"]).get() == "Expired"
+        assert get_auth_status("gone")["status"] == AuthSession.STATUS_FAILED
+
+    @pytest.mark.parametrize(("ran", "used_browser"), [(False, False), (True, False)])
+    def test_pool_is_refilled_only_after_holding_a_slot(self, ran, used_browser):
+        session = mock.Mock(used_browser=used_browser)
+        session.run.return_value = ran
+        with mock.patch.object(tasks.warm_pool, "refill") as refill:
+            assert tasks._run_and_refill(session) is ran
+        refill.assert_not_called()
+
+    @pytest.mark.parametrize(("slots", "reuse_stored"), [(None, True), (["slot"], False)])
+    def test_stored_session_is_only_checked_before_the_wait(self, slots, reuse_stored):
+        session = mock.Mock(used_browser=False)
+        with mock.patch.object(tasks.AuthSession, "restore", return_value=session):
+            tasks.run_auth_session.apply(args=["s1", slots])
+        session.run.assert_called_once_with(reuse_stored=reuse_stored, slots=slots)
+
+    def test_queued_session_ends_the_task(self):
+        session = mock.Mock(used_browser=False)
+        session.run.return_value = False
+        with (
+            mock.patch.object(tasks.AuthSession, "restore", return_value=session),
+            mock.patch.object(tasks.dispatch_auth_queue, "apply_async") as backstop,
+        ):
+            assert tasks.run_auth_session.apply(args=["s1"]).get() == "Queued"
+        backstop.assert_called_once()
+
+    def test_expired_dispatched_session_frees_its_slots(self):
+        cache.set("partner_auth_slot_0", "gone")
+        with mock.patch.object(tasks, "dispatch_auth_sessions") as dispatch:
+            assert tasks.run_auth_session.apply(args=["gone", ["partner_auth_slot_0"]]).get() == "Expired"
+        assert cache.get("partner_auth_slot_0") is None
+        dispatch.assert_called_once()
+
+
+class TestAuthQueue:
+    @pytest.fixture(autouse=True)
+    def slots(self, settings):
+        settings.PARTNER_AUTH_MAX_BROWSERS = 1
+        settings.PARTNER_AUTH_MAX_BROWSERS_PER_USER = 1
+        cache.clear()
+        yield
+        cache.clear()
+
+    def test_users_take_turns_in_fifo_order(self):
+        for user_id, session_id in [(1, "a1"), (1, "a2"), (1, "a3"), (2, "b1"), (3, "c1")]:
+            services.auth_queue.push(user_id, session_id)
+
+        order = []
+        while (picked := services.auth_queue.pop(lambda user_id: f"slot_{user_id}")) is not None:
+            order.append(picked[0])
+        assert order == ["a1", "b1", "c1", "a2", "a3"]
+        assert services.auth_queue.is_empty()
+
+    def test_user_without_a_free_slot_is_skipped(self):
+        services.auth_queue.push(1, "a1")
+        services.auth_queue.push(2, "b1")
+
+        assert services.auth_queue.pop(lambda user_id: None if user_id == 1 else "slot") == ("b1", "slot")
+        assert services.auth_queue.pop(lambda user_id: "slot") == ("a1", "slot")
+
+    def test_busy_browsers_queue_the_login(self):
+        assert services.acquire_browser_slot("running", user_id=1)
+        waiting = AuthSession("https://auth.test/", "login", "password", user_id=2)
+        with mock.patch.object(tasks.run_auth_session, "delay") as delay:
+            assert waiting.run(reuse_stored=False) is False
+        delay.assert_not_called()
+        assert not services.auth_queue.is_empty()
+
+        # A free slot goes to the queue, not to a login that arrives later
+        cache.delete("partner_auth_slot_0")
+        later = AuthSession("https://auth.test/", "login", "password", user_id=3)
+        with mock.patch.object(tasks.run_auth_session, "delay") as delay:
+            assert later.run(reuse_stored=False) is False
+        delay.assert_called_once_with(waiting.session_id, ["partner_auth_user_slot_2_0", "partner_auth_slot_0"])
+        assert cache.get("partner_auth_slot_0") == waiting.session_id
+
+    def test_finished_login_starts_the_next_one(self):
+        services.auth_queue.push(2, "b1")
+        session = AuthSession("https://auth.test/", "login", "password", user_id=1)
+        slots = services.acquire_browser_slot(session.session_id, 1)
+        with (
+            mock.patch.object(session, "_run_auth_process"),
+            mock.patch.object(tasks.run_auth_session, "delay") as delay,
+        ):
+            assert session.run(reuse_stored=False, slots=slots) is True
+        delay.assert_called_once_with("b1", ["partner_auth_user_slot_2_0", "partner_auth_slot_0"])
+
+
+class TestStoredSessionCheck:
+    STATE = {"cookies": [{"name": "Session_id", "value": "abc", "domain": ".yandex.ru"}]}
+
+    @pytest.fixture
+    def http(self):
+        with mock.patch.object(services, "isolated_session") as isolated_session:
+            yield isolated_session.return_value
+
+    @staticmethod
+    def respond(http, profile_url, leads_url="https://leads.test/", text=""):
+        # Final URLs after redirects, by requested URL
+        final = {"https://id.yandex.ru/": profile_url, "https://leads.test/": leads_url}
+        http.get.side_effect = lambda url, **kwargs: mock.Mock(ok=True, url=final[url], text=text)
+
+    @pytest.mark.parametrize(
+        ("profile_url", "leads_url", "valid"),
+        [
+            ("https://id.yandex.ru/", "https://leads.test/", True),
+            ("https://passport.yandex.ru/auth?retpath=https%3A%2F%2Fid.yandex.ru%2F", "https://leads.test/", False),
+            ("https://id.yandex.ru/", "https://passport.yandex.ru/auth?retpath=x", False),
+        ],
+    )
+    def test_needs_a_live_yandex_session(self, http, profile_url, leads_url, valid):
+        self.respond(http, profile_url, leads_url)
+        assert services.storage_state_is_valid(self.STATE, "https://leads.test/") is valid
+
+    def test_page_text_does_not_count(self, http):
+        # A logged-out shell naming a short or common login ("a", "info") is still logged out
+        self.respond(http, "https://passport.yandex.ru/auth", text="a info admin partner.user")
+        assert services.storage_state_is_valid(self.STATE, "https://leads.test/") is False
+
+    def test_phone_login_session(self, http):
+        # Nothing on the page names a phone login; the profile check doesn't need it to
+        self.respond(http, "https://id.yandex.ru/", text='<div id="root"></div>')
+        session = AuthSession(
+            "https://auth.test/", "+7 999 123-45-67", "password", leads_url="https://leads.test/", account_id=1
+        )
+        with (
+            mock.patch.object(PartnerSession, "load", return_value=self.STATE),
+            mock.patch.object(session, "_save_result"),
+        ):
+            assert session._reuse_stored_session() is True
+        assert http.get.call_count == 2
+
+    def test_unreachable_profile(self, http):
+        http.get.side_effect = requests.ConnectionError
+        assert services.storage_state_is_valid(self.STATE, "https://leads.test/") is False
+
+    def test_dispatched_session_skips_the_stored_session(self):
+        session = AuthSession("https://auth.test/", "login", "password", leads_url="https://leads.test/", account_id=1)
+        with (
+            mock.patch.object(services, "storage_state_is_valid") as is_valid,
+            mock.patch.object(session, "_run_auth_process"),
+        ):
+            assert session.run(reuse_stored=False, slots=[]) is True
+        is_valid.assert_not_called()
+
+
+class TestEnrichmentProfiles:
+    @pytest.fixture
+    def profiles(self, tmp_path, settings):
+        settings.PARTNER_ENRICH_PROFILES_DIR = str(tmp_path)
+        settings.PARTNER_ENRICH_PROFILES_MAX_AGE = 3600
+        return tmp_path
+
+    @staticmethod
+    def profile(root, name, lock_pid=None, age=0):
+        profile = root / name
+        profile.mkdir()
+        (profile / "Cache").write_bytes(b"x" * 100)
+        if lock_pid is not None:
+            (profile / "SingletonLock").symlink_to(f"{socket.gethostname()}-{lock_pid}")
+        os.utime(profile, (time.time() - age, time.time() - age))
+        return profile
+
+    def test_profiles_in_use_are_not_pruned(self, profiles):
+        in_use = self.profile(profiles, "1", lock_pid=os.getpid(), age=7200)
+        stale_lock = self.profile(profiles, "2", lock_pid=2**22 + 1, age=7200)
+        tasks.prune_enrichment_profiles()
+        assert in_use.exists()
+        assert not stale_lock.exists()
+
+    def test_size_eviction_skips_profiles_in_use(self, profiles, settings):
+        settings.PARTNER_ENRICH_PROFILES_MAX_BYTES = 150
+        oldest = self.profile(profiles, "1", lock_pid=os.getpid(), age=30)
+        older = self.profile(profiles, "2", age=20)
+        newest = self.profile(profiles, "3", age=10)
+        tasks.prune_enrichment_profiles()
+        assert oldest.exists()
+        assert not older.exists()
+        assert newest.exists()
+
+    def test_stored_local_storage_is_seeded_once(self, profiles):
+        playwright = mock.Mock()
+        state = {
+            "cookies": [{"name": "sid", "value": "1", "domain": "partner.test", "path": "/"}],
+            "origins": [{"origin": "https://partner.test", "localStorage": [{"name": "token", "value": "t"}]}],
+        }
+        context = tasks.open_enrichment_context(playwright, mock.Mock(id=1), state)
+
+        context.add_cookies.assert_called_once_with(state["cookies"])
+        (script,), _kwargs = context.add_init_script.call_args
+        # The init script runs on every navigation: only the first one per tab may seed
+        assert script.index("sessionStorage.getItem") < script.index("localStorage.setItem")
+        assert '"token"' in script
+
+
+class TestWarmBrowserPool:
+    @pytest.fixture
+    def browser(self):
+        with mock.patch.object(services, "launch_auth_browser") as launch:
+            yield launch.return_value
+
+    @pytest.fixture
+    def pool(self, settings, browser):
+        settings.PARTNER_AUTH_WARM_POOL_SIZE = 1
+        settings.PARTNER_AUTH_WARM_POOL_PRENAVIGATE = False
+        settings.PARTNER_AUTH_MAX_BROWSERS = 1
+        cache.clear()
+        pool = services.WarmBrowserPool()
+        with mock.patch.object(services, "sync_playwright"), mock.patch.object(services, "warm_pool", pool):
+            yield pool
+            pool.call(pool.close)
+        cache.clear()
+
+    def test_warm_browser_holds_a_browser_slot(self, pool):
+        pool.call(pool.refill)
+        assert pool.slot
+        assert services.acquire_browser_slot("other") is None
+
+    def test_no_warm_browser_without_a_free_slot(self, pool, browser):
+        assert services.acquire_browser_slot("other")
+        pool.call(pool.refill)
+        assert pool.slot is None
+        assert not browser.new_context.called
+
+    def test_idle_browser_is_closed_and_its_slot_freed(self, pool, browser, settings):
+        settings.PARTNER_AUTH_WARM_POOL_TTL = 0.1
+        pool.call(pool.refill)
+        deadline = time.monotonic() + 5
+        while not browser.close.called and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert browser.close.called
+        assert services.acquire_browser_slot("other")
+
+    def test_login_takes_over_the_warm_browser_slot(self, pool):
+        pool.call(pool.refill)
+        session = AuthSession("https://auth.test/", "login", "password")
+        with mock.patch.object(session, "_run_auth_process"):
+            assert pool.call(session.run) is True
+        assert session.used_browser
+        assert pool.slot is None
+        # The login released the slot it took over
+        assert services.acquire_browser_slot("other")
+
+
+@pytest.fixture
+def account(user):
+    app = App.objects.create(name="App", auth_url="https://auth.test/", leads_url="https://leads.test/")
+    return PartnerAccount.objects.create(user=user, app=app, name="Account", login="login")
+
+
+@pytest.mark.django_db
+class TestKeysetPage:
+    def test_walks_every_lead_once(self, account):
+        ts = datetime(2025, 1, 1, tzinfo=UTC)
+        # Ties on lead_created_at and leads without a date
+        for i in range(7):
+            PartnerLead.objects.create(account=account, external_id=str(i), lead_created_at=ts)
+        for i in range(7, 10):
+            PartnerLead.objects.create(account=account, external_id=str(i))
+        qs = PartnerLead.objects.filter(account=account)
+
+        seen, pages = [], []
+        page = KeysetPage(qs, 3)
+        while True:
+            pages.append(page)
+            seen += [lead.external_id for lead in page.object_list]
+            if not page.has_next:
+                break
+            page = KeysetPage(qs, 3, after=page.next_cursor)
+
+        assert sorted(seen, key=int) == [str(i) for i in range(10)]
+        assert len(pages) == 4
+        assert seen[-3:] == ["9", "8", "7"]
+        # Every page reports the total, not the rows left after its cursor
+        assert [page.count for page in pages] == [10, 10, 10, 10]
+
+        back = KeysetPage(qs, 3, before=pages[2].previous_cursor)
+        assert back.object_list == pages[1].object_list
+        assert back.has_previous
+
+    def test_count_is_capped(self, account):
+        for i in range(5):
+            PartnerLead.objects.create(account=account, external_id=str(i))
+        page = KeysetPage(PartnerLead.objects.all(), 2, count_cap=3)
+
+        assert page.count == 3
+        assert page.count_capped
+
+    def test_malformed_cursor_starts_from_first_page(self, account):
+        PartnerLead.objects.create(account=account, external_id="1")
+        page = KeysetPage(PartnerLead.objects.all(), 2, after="not-a-cursor")
+
+        assert not page.has_previous
+        assert len(page.object_list) == 1
+
+
+@pytest.mark.django_db
+class TestLeadListIndexes:
+    """The lead list's filter combinations must not fall back to a seq scan of all leads."""
+
+    @pytest.fixture
+    def owner(self):
+        users = UserFactory.create_batch(40)
+        app = App.objects.create(name="App", auth_url="https://auth.test/", leads_url="https://leads.test/")
+        ts = datetime(2025, 1, 1, tzinfo=UTC)
+        leads = []
+        for n, user in enumerate(users):
+            account = PartnerAccount.objects.create(user=user, app=app, name=f"Account {n}", login=f"login{n}")
+            size = 10000 if n == 0 else 250
+            leads += [
+                PartnerLead(
+                    account=account,
+                    external_id=f"{n}-{i}",
+                    lead_created_at=ts + timedelta(minutes=i),
+                    status=f"status{i % 5}",
+                    target_city=f"city{i % 30}",
+                    creator_username=f"creator{i % 20}" if i % 4 else "",
+                )
+                for i in range(size)
+            ]
+        PartnerLead.objects.bulk_create(leads, batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE partner_partnerlead")
+            cursor.execute("ANALYZE partner_partneraccount")
+        return users[0]
+
+    @pytest.mark.parametrize(
+        "params",
+        [
+            {},
+            {"status": "status1"},
+            {"city": "city3"},
+            {"creator": "creator7"},
+            {"status": "status1", "city": "city3"},
+        ],
+    )
+    def test_first_page_uses_index(self, owner, params):
+        view = LeadListView()
+        view.request = RequestFactory().get("/", params)
+        view.request.user = owner
+        qs = view.get_queryset().order_by(F("lead_created_at").desc(nulls_last=True), "-id")[:51]
+
+        plan = qs.explain()
+
+        assert "Seq Scan on partner_partnerlead" not in plan
+        assert "Index Scan using partner_lead_" in plan
+        # Rows come out of the index in page order, no sort of the whole match set
+        assert "Sort" not in plan
+
+    @pytest.mark.parametrize("params", [{}, {"status": "status1"}, {"city": "city3"}])
+    def test_several_accounts_are_merged_from_their_indexes(self, owner, params):
+        app = App.objects.get()
+        ts = datetime(2025, 1, 1, tzinfo=UTC)
+        for n in range(2):
+            account = PartnerAccount.objects.create(user=owner, app=app, name=f"Extra {n}", login=f"extra{n}")
+            PartnerLead.objects.bulk_create(
+                PartnerLead(
+                    account=account,
+                    external_id=f"extra{n}-{i}",
+                    lead_created_at=ts + timedelta(minutes=i, seconds=n),
+                    status=f"status{i % 5}",
+                    target_city=f"city{i % 30}",
+                )
+                for i in range(3000)
+            )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE partner_partnerlead")
+        view = LeadListView()
+        view.request = RequestFactory().get("/", params)
+        view.request.user = owner
+        queryset = view.get_queryset()
+
+        with CaptureQueriesContext(connection) as queries:
+            _paginator, page, leads, _is_paginated = view.paginate_queryset(queryset, 50)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN {queries[0]['sql']}")
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+
+        expected = queryset.order_by(F("lead_created_at").desc(nulls_last=True), "-id")[:50]
+        assert [lead.pk for lead in leads] == [lead.pk for lead in expected]
+        nodes = [line.split("(cost")[0].strip(" ->") for line in plan.splitlines() if "(cost" in line]
+        assert "Merge Append" in nodes
+        assert "Sort" not in nodes
+        assert "Index Scan using partner_lead_" in plan
+
+
+@pytest.mark.django_db
+class TestLeadSearchIndexes:
+    @pytest.fixture(autouse=True)
+    def _require_trgm(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                pytest.skip("pg_trgm is not installed in this database")
+
+    @pytest.fixture
+    def leads(self, account):
+        PartnerLead.objects.bulk_create(
+            PartnerLead(account=account, external_id=f"{i:09d}", phone=f"+7 (9{i % 100:02d}) {i:07d}")
+            for i in range(20000)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE partner_partnerlead")
+
+    @pytest.mark.parametrize(
+        ("lookup", "index"),
+        [
+            ({"external_id__icontains": "12345"}, "partner_lead_external_id_trgm"),
+            ({"phone__icontains": "1234567"}, "partner_lead_phone_trgm"),
+            ({"status__icontains": "rewarded"}, "partner_lead_status_trgm"),
+        ],
+    )
+    def test_substring_search_uses_trigram_index(self, leads, lookup, index):
+        plan = PartnerLead.objects.filter(**lookup).explain()
+
+        assert index in plan
+        assert "Seq Scan on partner_partnerlead" not in plan
+
+
+@pytest.mark.parametrize(
+    ("raw", "normalized"),
+    [
+        ("+7 (999) 123-45-67", "79991234567"),
+        ("8 999 123 45 67", "79991234567"),
+        ("9991234567", "79991234567"),
+        ("+375 29 123-45-67", "375291234567"),
+        ("", ""),
+        (None, ""),
+    ],
+)
+def test_normalize_phone(raw, normalized):
+    assert normalize_phone(raw) == normalized
+
+
+@pytest.mark.django_db
+def test_lead_phone_search_matches_any_format(client, user, account):
+    PartnerLead.objects.create(account=account, external_id="1", phone="+7 (999) 123-45-67")
+    PartnerLead.objects.create(account=account, external_id="2", phone="+7 (912) 000-00-00")
+    client.force_login(user)
+
+    for query in ("89991234567", "+7 999 123", "123-45"):
+        response = client.get("/partner/leads/", {"phone": query})
+        assert [lead.external_id for lead in response.context["leads"]] == ["1"], query
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("lookup", [{"phone_normalized": "79990001234"}, {"phone_normalized__startswith": "799900012"}])
+def test_lead_phone_lookup_uses_index(account, lookup):
+    PartnerLead.objects.bulk_create(
+        PartnerLead(account=account, external_id=str(i), phone_normalized=f"7999{i:07d}" if i % 4 else "")
+        for i in range(20000)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE partner_partnerlead")
+
+    plan = PartnerLead.objects.filter(**lookup).explain()
+
+    assert "partner_lead_phone_norm" in plan
+    assert "Seq Scan on partner_partnerlead" not in plan
+
+
+@pytest.mark.django_db
+def test_lead_export_streams_filtered_leads(client, user, account):
+    PartnerLead.objects.create(account=account, external_id="1", status="new", phone="+7 999 123-45-67")
+    PartnerLead.objects.create(account=account, external_id="2", status="closed")
+    client.force_login(user)
+
+    response = client.get("/partner/leads/export/", {"status": "new"})
+
+    assert response.streaming
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    assert lines[0].startswith("external_id,account,")
+    assert len(lines) == 2
+    assert lines[1].startswith("1,Account,")
+
+
+@pytest.mark.django_db
+class TestPartnerLeadApi:
+    url = "/api/partner-leads/"
+
+    @pytest.fixture
+    def api_client(self, client, user):
+        client.force_login(user)
+        return client
+
+    def test_cursor_pages_with_sparse_fields(self, api_client, account):
+        for i in range(3):
+            PartnerLead.objects.create(account=account, external_id=str(i), status="new")
+        other = PartnerAccount.objects.create(user=UserFactory(), app=account.app, name="Other", login="other")
+        PartnerLead.objects.create(account=other, external_id="foreign")
+
+        data = api_client.get(self.url, {"fields": "external_id,status", "page_size": 2}).json()
+        assert data["results"] == [{"external_id": "0", "status": "new"}, {"external_id": "1", "status": "new"}]
+
+        data = api_client.get(data["next"]).json()
+        assert data["results"] == [{"external_id": "2", "status": "new"}]
+        assert data["next"] is None
+
+    def test_updated_since(self, api_client, account):
+        old = PartnerLead.objects.create(account=account, external_id="old")
+        PartnerLead.objects.filter(pk=old.pk).update(updated_at=datetime(2024, 1, 1, tzinfo=UTC))
+        PartnerLead.objects.create(account=account, external_id="new")
+
+        data = api_client.get(self.url, {"updated_since": "2025-01-01T00:00:00Z", "fields": "external_id"}).json()
+        assert data["results"] == [{"external_id": "new"}]
+
+        assert api_client.get(self.url, {"updated_since": "yesterday"}).status_code == 400
+
+    def test_conditional_get(self, api_client, account):
+        lead = PartnerLead.objects.create(account=account, external_id="1")
+
+        response = api_client.get(f"{self.url}{lead.pk}/")
+        assert response.status_code == 200
+        assert response["Last-Modified"]
+
+        response = api_client.get(f"{self.url}{lead.pk}/", headers={"if-none-match": response["ETag"]})
+        assert response.status_code == 304
+
+        response = api_client.get(self.url)
+        assert api_client.get(self.url, headers={"if-none-match": response["ETag"]}).status_code == 304
+        PartnerLead.objects.create(account=account, external_id="2")
+        assert api_client.get(self.url, headers={"if-none-match": response["ETag"]}).status_code == 200
+
+    def test_not_modified_list_is_not_serialized(self, api_client, account):
+        for i in range(3):
+            PartnerLead.objects.create(account=account, external_id=str(i))
+        etag = api_client.get(self.url)["ETag"]
+
+        with (
+            mock.patch.object(PartnerLeadSerializer, "to_representation") as to_representation,
+            CaptureQueriesContext(connection) as queries,
+        ):
+            response = api_client.get(self.url, headers={"if-none-match": etag})
+        assert response.status_code == 304
+        assert response["ETag"] == etag
+        to_representation.assert_not_called()
+        # Session, user, the user's accounts and the page; no COUNT over the leads
+        selects = [query["sql"] for query in queries if query["sql"].startswith("SELECT")]
+        assert len(selects) == 4
+        assert not any("COUNT(" in sql for sql in selects)
+
+        # Deleting a lead of the page changes its ETag
+        PartnerLead.objects.filter(external_id="0").delete()
+        assert api_client.get(self.url, headers={"if-none-match": etag}).status_code == 200
+
+    def test_cursor_pages_through_tied_updated_at(self, api_client, account):
+        # More ties than CursorPagination's offset_cutoff
+        PartnerLead.objects.bulk_create(
+            PartnerLead(account=account, external_id=str(i)) for i in range(PartnerLeadCursorPagination.offset_cutoff + 100)
+        )
+        PartnerLead.objects.update(updated_at=datetime(2025, 1, 1, tzinfo=UTC))
+
+        seen = []
+        url = f"{self.url}?fields=external_id&page_size=400"
+        for _page in range(4):
+            data = api_client.get(url).json()
+            seen += [lead["external_id"] for lead in data["results"]]
+            url = data["next"]
+            if url is None:
+                break
+        assert url is None
+        assert sorted(seen, key=int) == [str(i) for i in range(1100)]
+
+        previous = api_client.get(data["previous"]).json()
+        assert [lead["external_id"] for lead in previous["results"]] == seen[400:800]
+
+    def test_invalid_cursor(self, api_client):
+        assert api_client.get(self.url, {"cursor": "bad"}).status_code == 404
+
+    def test_migration_backfills_distinct_updated_at(self, account):
+        migration = importlib.import_module("edman.partner.migrations.0006_partnerlead_updated_at")
+        leads = PartnerLead.objects.bulk_create(PartnerLead(account=account, external_id=str(i)) for i in range(3))
+        PartnerLead.objects.update(updated_at=datetime(2025, 1, 1, tzinfo=UTC))
+
+        migration.backfill_updated_at(django_apps, None)
+        backfilled = list(PartnerLead.objects.order_by("id").values_list("updated_at", flat=True))
+        assert len(set(backfilled)) == len(leads)
+        assert backfilled == sorted(backfilled)
+        assert backfilled[-1] <= timezone.now()
+
+
+@pytest.mark.django_db
+class TestLeadFacets:
+    LEADS = {
+        "1": {"target_city": "Moscow", "status": "new", "creator_username": "anna"},
+        "2": {"target_city": "Kazan", "status": "new", "creator_username": ""},
+        "3": {"target_city": "Kazan", "status": "done", "creator_username": "anna"},
+    }
+
+    def test_deltas_match_a_rebuild(self, user, account, django_capture_on_commit_callbacks):
+        other = PartnerAccount.objects.create(user=user, app=account.app, name="Other", login="other")
+        deltas: Counter = Counter()
+        for external_id, fields in self.LEADS.items():
+            PartnerLead.objects.create(account=other if external_id == "3" else account, external_id=external_id, **fields)
+            count_change(deltas, None, facet_values(fields))
+        # An update that moves a lead to another city and status
+        moved = {**self.LEADS["1"], "target_city": "Kazan", "status": "done"}
+        PartnerLead.objects.filter(external_id="1").update(**moved)
+        count_change(deltas, facet_values(self.LEADS["1"]), facet_values(moved))
+        apply_facet_deltas(user.id, deltas)
+
+        incremental = get_facets(user.id)
+        rebuild_facets(user.id)
+        assert incremental == get_facets(user.id) == {
+            "target_city": [("Kazan", 3)],
+            "status": [("done", 2), ("new", 1)],
+            "creator_username": [("anna", 2)],
+        }
+
+        # Deleting an account recounts its user's facets without its leads
+        with (
+            mock.patch.object(tasks.rebuild_lead_facets, "delay", side_effect=tasks.rebuild_lead_facets),
+            django_capture_on_commit_callbacks(execute=True),
+        ):
+            other.delete()
+        assert get_facets(user.id) == {
+            "target_city": [("Kazan", 2)],
+            "status": [("done", 1), ("new", 1)],
+            "creator_username": [("anna", 1)],
+        }
+
+    def test_migration_backfill_matches_a_rebuild(self, user, account):
+        migration = importlib.import_module("edman.partner.migrations.0002_leadfacet")
+        for external_id, fields in self.LEADS.items():
+            PartnerLead.objects.create(account=account, external_id=external_id, **fields)
+
+        migration.backfill_lead_facets(django_apps, None)
+        backfilled = sorted(LeadFacet.objects.values_list("user_id", "field", "value", "count"))
+        rebuild_facets(user.id)
+        assert backfilled == sorted(LeadFacet.objects.values_list("user_id", "field", "value", "count"))
+        assert ("target_city", "Kazan", 2) in [row[1:] for row in backfilled]
+
+
+@pytest.mark.django_db
+class TestLeadRollups:
+    def test_deltas_match_a_rebuild(self, account):
+        day = datetime(2025, 3, 1, 12, tzinfo=UTC)
+        leads: dict[str, dict[str, Any]] = {
+            "1": {"lead_created_at": day, "status": "new", "target_city": "Moscow"},
+            "2": {"lead_created_at": day, "status": "new", "target_city": "Kazan"},
+            "3": {"lead_created_at": None, "status": "new", "target_city": "Kazan"},
+        }
+        deltas: Counter = Counter()
+        for external_id, fields in leads.items():
+            PartnerLead.objects.create(account=account, external_id=external_id, **fields)
+            count_rollup_change(deltas, None, rollup_key(fields))
+        # Status change of an existing lead
+        changed = {**leads["2"], "status": "done"}
+        PartnerLead.objects.filter(external_id="2").update(status="done")
+        count_rollup_change(deltas, rollup_key(leads["2"]), rollup_key(changed))
+        apply_rollup_deltas(account.id, deltas)
+
+        incremental = rollup_totals([account.id], "status")
+        rebuild_rollups(account.id)
+
+        assert incremental == rollup_totals([account.id], "status") == [("new", 2), ("done", 1)]
+        assert rollup_totals([account.id], "day") == [(day.date(), 2)]
+
+    def test_dashboard_and_api(self, client, user, account):
+        PartnerLead.objects.create(account=account, external_id="1", status="new", lead_created_at=datetime.now(UTC))
+        rebuild_rollups(account.id)
+        client.force_login(user)
+
+        response = client.get("/partner/leads/dashboard/")
+        assert response.status_code == 200
+        assert response.context["funnel"] == [("new", 1, 100)]
+
+        data = client.get("/api/partner-lead-rollups/", {"group_by": "target_city"}).json()
+        assert data == {"group_by": "target_city", "results": [{"value": "", "count": 1}]}
+        assert client.get("/api/partner-lead-rollups/", {"group_by": "phone"}).status_code == 400
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("compress", [True, False])
+def test_partner_session_round_trip(settings, account, compress):
+    settings.PARTNER_SESSION_COMPRESS = compress
+    state = {"cookies": [{"name": "Session_id", "value": "x" * 10000}], "origins": []}
+
+    PartnerSession.store(account.id, state)
+
+    assert PartnerSession.load(account.id) == state
+    assert PartnerSession.objects.get().compressed is compress
+    assert PartnerSession.load(account.id + 1) == {}
+
+
+@pytest.mark.django_db
+class TestHotViewBudgets:
+    """
+    Query and time budgets of the partner pages and their admin. More rows are
+    seeded than fit on a page, so a per-row query blows the budget.
+    """
+
+    @pytest.fixture
+    def seeded(self, user):
+        accounts = [
+            PartnerAccount.objects.create(
+                user=user,
+                app=App.objects.create(name=f"App {i}", auth_url="https://auth.test/", leads_url="https://leads.test/"),
+                name=f"Account {i}",
+                login=f"login{i}",
+            )
+            for i in range(5)
+        ]
+        PartnerLead.objects.bulk_create(
+            PartnerLead(
+                account=accounts[i % 5],
+                external_id=str(i),
+                lead_created_at=datetime(2025, 1, 1, tzinfo=UTC) + timedelta(hours=i),
+                status=f"status{i % 4}",
+                target_city=f"city{i % 7}",
+                phone="+7 999 000-00-00",
+            )
+            for i in range(300)
+        )
+        for account in accounts:
+            rebuild_rollups(account.id)
+        return PartnerLead.objects.first()
+
+    @pytest.mark.parametrize(
+        ("url", "queries"),
+        [
+            ("/partner/", 6),
+            ("/partner/leads/", 9),
+            ("/partner/leads/?status=status1&city=city1", 9),
+            ("/partner/leads/{lead}/", 6),
+            ("/partner/leads/dashboard/", 9),
+            ("/partner/leads/export/", 4),
+            ("/partner/leads/upload/", 5),
+            ("/api/partner-leads/", 6),
+            ("/api/partner-lead-rollups/?group_by=day", 6),
+        ],
+    )
+    def test_view(self, client, user, seeded, perf_budget, url, queries):
+        client.force_login(user)
+        with perf_budget(queries=queries, seconds=0.5):
+            response = client.get(url.format(lead=seeded.pk))
+            if response.streaming:
+                b"".join(response.streaming_content)
+        assert response.status_code == 200
+
+    @pytest.mark.parametrize(
+        ("url", "queries"),
+        [
+            ("/admin/partner/partnerlead/", 10),
+            ("/admin/partner/partnerlead/?q=12", 10),
+            ("/admin/partner/partnerlead/{lead}/change/", 7),
+            ("/admin/partner/partneraccount/", 9),
+            ("/admin/partner/leadrollup/", 8),
+        ],
+    )
+    def test_admin(self, admin_client, seeded, perf_budget, url, queries):
+        with perf_budget(queries=queries, seconds=0.5):
+            response = admin_client.get(url.format(lead=seeded.pk))
+        assert response.status_code == 200
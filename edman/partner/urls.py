@@ -3,10 +3,13 @@ from .views import (
     AccountListView, 
     StartAuthView, 
     CheckAuthStatusView, 
+    AuthStatusStreamView,
     SubmitOtpView, 
     SaveAccountView,
     LeadUploadView,
     LeadListView,
+    LeadExportView,
+    LeadDashboardView,
     LeadDetailView
 )
 
@@ -16,9 +19,12 @@ urlpatterns = [
     path("", AccountListView.as_view(), name="list"),
     path("auth/start/", StartAuthView.as_view(), name="auth_start"),
     path("auth/status/<str:session_id>/", CheckAuthStatusView.as_view(), name="auth_status"),
+    path("auth/stream/<str:session_id>/", AuthStatusStreamView.as_view(), name="auth_stream"),
     path("auth/otp/", SubmitOtpView.as_view(), name="auth_otp"),
     path("auth/save/", SaveAccountView.as_view(), name="auth_save"),
     path("leads/upload/", LeadUploadView.as_view(), name="lead_upload"),
     path("leads/", LeadListView.as_view(), name="lead_list"),
+    path("leads/export/", LeadExportView.as_view(), name="lead_export"),
+    path("leads/dashboard/", LeadDashboardView.as_view(), name="lead_dashboard"),
     path("leads/<int:pk>/", LeadDetailView.as_view(), name="lead_detail"),
 ]
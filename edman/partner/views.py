@@ -1,18 +1,32 @@
+import csv
 import json
 import logging
-from django.views.generic import ListView, FormView, DetailView
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.views.generic import ListView, FormView, DetailView, TemplateView
 from django.views import View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Q
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.utils.decorators import method_decorator
 from django.urls import reverse_lazy
+from django.utils import timezone
 from django.core.files.storage import default_storage
 
-from .models import PartnerAccount, App, PartnerLead
-from .services import AuthSession, get_auth_status, submit_auth_otp, get_auth_result
+from edman.utils.phones import normalize_phone
+
+from .models import PartnerAccount, PartnerSession, App, PartnerLead
+from .services import AuthSession, get_auth_status, submit_auth_otp, get_auth_result, iter_auth_events
+from .services import auth_session_owner
 from .forms import LeadUploadForm
+from .facets import get_facets
+from .pagination import KeysetPage
+from .rollups import rollup_totals
 from .tasks import process_leads_file
 
 logger = logging.getLogger(__name__)
@@ -24,7 +38,8 @@ class AccountListView(LoginRequiredMixin, ListView):
     context_object_name = "accounts"
 
     def get_queryset(self):
-        return PartnerAccount.objects.filter(user=self.request.user)
+        # The table shows account.app.name for every row
+        return PartnerAccount.objects.filter(user=self.request.user).select_related('app')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -45,8 +60,16 @@ class StartAuthView(LoginRequiredMixin, View):
             except App.DoesNotExist:
                 return JsonResponse({'error': 'App not found'}, status=404)
             
+            # Re-adding an account first tries its stored session
+            account_id = PartnerAccount.objects.filter(
+                user=request.user, app=app, login=login
+            ).values_list('id', flat=True).first()
+
             # Start auth session
-            session = AuthSession(app.auth_url, login, password, leads_url=app.leads_url)
+            session = AuthSession(
+                app.auth_url, login, password,
+                leads_url=app.leads_url, user_id=request.user.id, account_id=account_id,
+            )
             session_id = session.start()
             
             return JsonResponse({'session_id': session_id, 'status': 'initiated'})
@@ -55,17 +78,53 @@ class StartAuthView(LoginRequiredMixin, View):
 
 class CheckAuthStatusView(LoginRequiredMixin, View):
     def get(self, request, session_id):
-        status_data = get_auth_status(session_id)
+        if auth_session_owner(session_id) != request.user.id:
+            return JsonResponse({'status': 'UNKNOWN'}, status=404)
+        # Clients pass back the cursor they got to receive only new log lines
+        status_data = get_auth_status(session_id, cursor=request.GET.get('cursor'))
         if not status_data:
              return JsonResponse({'status': 'UNKNOWN'}, status=404)
         
         return JsonResponse(status_data)
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class AuthStatusStreamView(View):
+    """
+    Server-sent events stream of auth status and log lines. Async, so an open
+    login page holds no worker under ASGI (config.asgi). Under WSGI it answers
+    204, which stops the EventSource, and the page polls CheckAuthStatusView.
+    """
+
+    async def get(self, request, session_id):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({'status': 'UNKNOWN'}, status=403)
+        if await sync_to_async(auth_session_owner)(session_id) != user.id:
+            return JsonResponse({'status': 'UNKNOWN'}, status=404)
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse(status=204)
+
+        async def stream():
+            yield "retry: 2000\n\n"
+            async for event in iter_auth_events(session_id):
+                if event is None:
+                    # Heartbeat comment, keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"data: {json.dumps(event)}\n\n"
+
+        response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 class SubmitOtpView(LoginRequiredMixin, View):
     def post(self, request):
         data = json.loads(request.body)
         session_id = data.get('session_id')
         code = data.get('code')
+        if auth_session_owner(session_id) != request.user.id:
+            return JsonResponse({'status': 'UNKNOWN'}, status=404)
         submit_auth_otp(session_id, code)
         return JsonResponse({'status': 'submitted'})
 
@@ -81,7 +140,7 @@ class SaveAccountView(LoginRequiredMixin, View):
             logger.info(f"Attempting to save account. Session: {session_id}, Login: {login}")
             
             # Verify Session
-            status = get_auth_status(session_id)
+            status = get_auth_status(session_id) if auth_session_owner(session_id) == request.user.id else None
             if not status or status['status'] != AuthSession.STATUS_SUCCESS:
                 logger.error(f"Save failed: Auth status is {status.get('status') if status else 'None'}")
                 return JsonResponse({'error': f"Auth not complete. Status: {status.get('status') if status else 'None'}"}, status=404)
@@ -101,10 +160,10 @@ class SaveAccountView(LoginRequiredMixin, View):
                     login=login,
                     defaults={
                         'name': name,
-                        'session_data': session_data,
                         'is_active': True
                     }
                 )
+                PartnerSession.store(account.id, session_data)
                 logger.info(f"Account saved successfully. ID: {account.id}")
                 return JsonResponse({'status': 'saved', 'id': account.id})
             except Exception as e:
@@ -147,15 +206,21 @@ class LeadUploadView(LoginRequiredMixin, FormView):
 from django.views.generic import DetailView
 from .models import PartnerLead
 
-class LeadListView(LoginRequiredMixin, ListView):
-    model = PartnerLead
-    template_name = "partner/lead_list.html"
-    context_object_name = "leads"
-    paginate_by = 50
+class LeadFilterMixin:
+    """Leads of the current user narrowed by the lead list's GET filters"""
+
+    # Set by the view this is mixed into
+    request: HttpRequest
+    # Accounts the leads can come from, for KeysetPage's per-account merge
+    account_ids: list[int] | None = None
 
     def get_queryset(self):
-        # Base QuerySet limited to user
-        qs = PartnerLead.objects.filter(account__user=self.request.user).select_related('account')
+        # Base QuerySet limited to user. Filtering on account ids instead of joining
+        # on account__user lets the planner read the (account, lead_created_at, id)
+        # indexes in order and stop after one page.
+        account_ids = list(PartnerAccount.objects.filter(user=self.request.user).values_list('id', flat=True))
+        self.account_ids = account_ids
+        qs = PartnerLead.objects.filter(account_id__in=account_ids)
         
         # Filtering
         city = self.request.GET.get('city')
@@ -171,23 +236,55 @@ class LeadListView(LoginRequiredMixin, ListView):
             qs = qs.filter(status=status)
         if account_id:
             qs = qs.filter(account_id=account_id)
+            self.account_ids = None
+        # Substring searches are served by pg_trgm indexes (migration 0004)
         if search_id:
             qs = qs.filter(external_id__icontains=search_id)
         if phone:
-            qs = qs.filter(phone__icontains=phone)
+            digits = normalize_phone(phone)
+            if len(digits) >= 11:
+                # Full number: exact match on the normalized column
+                qs = qs.filter(phone_normalized=digits)
+            elif digits:
+                qs = qs.filter(Q(phone_normalized__startswith=digits) | Q(phone__icontains=phone))
+            else:
+                qs = qs.filter(phone__icontains=phone)
         if creator:
             qs = qs.filter(creator_username=creator)
             
-        return qs.order_by('-lead_created_at')
+        return qs
+
+
+class LeadListView(LoginRequiredMixin, LeadFilterMixin, ListView):
+    model = PartnerLead
+    template_name = "partner/lead_list.html"
+    context_object_name = "leads"
+    paginate_by = 50
+    count_cap = 1000
+
+    def get_queryset(self):
+        # Ordering (-lead_created_at, -id) is applied by the keyset paginator
+        return super().get_queryset().select_related('account')
+
+    def paginate_queryset(self, queryset, page_size):
+        page = KeysetPage(
+            queryset,
+            page_size,
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'),
+            count_cap=self.count_cap,
+            account_ids=self.account_ids,
+        )
+        return None, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user_leads = PartnerLead.objects.filter(account__user=self.request.user)
         
-        # Get unique values for filters
-        context['cities'] = user_leads.values_list('target_city', flat=True).distinct().order_by('target_city')
-        context['statuses'] = user_leads.values_list('status', flat=True).distinct().order_by('status')
-        context['creators'] = user_leads.values_list('creator_username', flat=True).distinct().order_by('creator_username')
+        # Unique values (with counts) for filters, maintained by ingestion
+        facets = get_facets(self.request.user.id)
+        context['cities'] = facets['target_city']
+        context['statuses'] = facets['status']
+        context['creators'] = facets['creator_username']
         context['accounts'] = PartnerAccount.objects.filter(user=self.request.user)
         
         # Current filters state to keep in form
@@ -197,9 +294,91 @@ class LeadListView(LoginRequiredMixin, ListView):
         context['current_account'] = int(self.request.GET.get('account', 0)) if self.request.GET.get('account') else ''
         context['current_id'] = self.request.GET.get('id', '')
         context['current_phone'] = self.request.GET.get('phone', '')
+
+        # Filters to carry over in pagination links
+        filters = self.request.GET.copy()
+        for key in ('after', 'before', 'page'):
+            filters.pop(key, None)
+        context['filter_query'] = filters.urlencode()
         
         return context
 
+class Echo:
+    """File-like object whose write() hands the line back to csv.writer's caller"""
+
+    def write(self, value):
+        return value
+
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class LeadExportView(LoginRequiredMixin, LeadFilterMixin, View):
+    """
+    Streams the filtered leads as CSV. Rows are read through a server-side
+    cursor in chunks and written as they arrive, so memory stays flat however
+    many leads match. Not wrapped in the request transaction: the response body
+    is produced after the view has returned.
+    """
+    chunk_size = 2000
+    columns = (
+        'external_id', 'account__name', 'lead_created_at', 'updated_ts', 'first_name', 'last_name',
+        'phone', 'target_city', 'status', 'eats_order_number', 'rewarded_at', 'closed_reason',
+        'utm_campaign', 'utm_content', 'utm_medium', 'utm_source', 'utm_term',
+        'creator_username', 'reward', 'complaint_status',
+    )
+
+    def get(self, request, *args, **kwargs):
+        rows = (
+            self.get_queryset()
+            .order_by(F('lead_created_at').desc(nulls_last=True), '-id')
+            .values_list(*self.columns)
+            .iterator(chunk_size=self.chunk_size)
+        )
+        writer = csv.writer(Echo())
+        header = [column.replace('account__name', 'account') for column in self.columns]
+
+        def stream():
+            yield writer.writerow(header)
+            for row in rows:
+                yield writer.writerow(row)
+
+        response = StreamingHttpResponse(stream(), content_type='text/csv; charset=utf-8')
+        filename = f"leads_{timezone.now():%Y%m%d_%H%M}.csv"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class LeadDashboardView(LoginRequiredMixin, TemplateView):
+    """Lead funnel and per-day counts, read from the LeadRollup table"""
+    template_name = "partner/lead_dashboard.html"
+    days = 30
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        accounts = PartnerAccount.objects.filter(user=self.request.user)
+        account_ids = [account.id for account in accounts]
+        account = self.request.GET.get('account')
+        current_account: int | str = ''
+        if account and account.isdigit() and int(account) in account_ids:
+            current_account = int(account)
+            account_ids = [current_account]
+
+        since = timezone.localdate() - timedelta(days=self.days - 1)
+        context['accounts'] = accounts
+        context['current_account'] = current_account
+        context['days'] = self.days
+        context['funnel'] = with_share(rollup_totals(account_ids, 'status'))
+        context['cities'] = with_share(rollup_totals(account_ids, 'target_city')[:10])
+        context['creators'] = with_share(rollup_totals(account_ids, 'creator_username')[:10])
+        context['per_day'] = with_share(rollup_totals(account_ids, 'day', since=since))
+        return context
+
+
+def with_share(rows):
+    """(value, count) rows as (value, count, percent of the largest count) for bar widths"""
+    top = max((count for _value, count in rows), default=0)
+    return [(value, count, round(count * 100 / top) if top else 0) for value, count in rows]
+
+
 class LeadDetailView(LoginRequiredMixin, DetailView):
     model = PartnerLead
     template_name = "partner/lead_detail.html"
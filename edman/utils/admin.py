@@ -0,0 +1,65 @@
+import json
+from typing import TYPE_CHECKING
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+if TYPE_CHECKING:
+    from django.contrib.admin import ModelAdmin as _ModelAdmin
+else:
+    _ModelAdmin = object
+
+# Highest primary key that a numeric search term may be compared with
+MAX_PK = 2**63 - 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists of big tables. Asks the planner how many
+    rows the (filtered) changelist query returns; past `exact_below` rows that
+    estimate is shown instead of running COUNT(*) over millions of rows, and
+    `count_is_estimate` is set so the changelist marks the count as approximate
+    (templates/admin/pagination.html).
+    """
+
+    exact_below = 100_000
+    count_is_estimate = False
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql":
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]["Plan"]["Plan Rows"])
+            if estimate >= self.exact_below:
+                self.count_is_estimate = True
+                return estimate
+        return super().count
+
+
+class ScalableAdminMixin(_ModelAdmin):
+    """
+    ModelAdmin settings for tables with millions of rows: estimated counts, no
+    second unfiltered COUNT(*), and a numeric search term also matches the
+    primary key through its index (an "=id" search field casts id to text).
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if term.isdigit() and int(term) <= MAX_PK:
+            results |= queryset.filter(pk=int(term))
+        return results, may_have_duplicates
@@ -0,0 +1,120 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_lock = threading.Lock()
+
+
+class ProcessState:
+    """The adapter and shared session of the process (pid) that built them"""
+
+    def __init__(self):
+        self.pid: int | None = None
+        self.session: requests.Session | None = None
+        self.adapter: HTTPAdapter | None = None
+
+
+_state = ProcessState()
+
+
+class RateLimitRetry(Retry):
+    """
+    Retry idempotent requests on 429 and 5xx, and any request on 429: a rate-limited
+    POST was not processed, while a POST that got a 5xx may have been. Waits for
+    Retry-After, at most HTTP_MAX_RETRY_AFTER seconds.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429 and self.total:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_retry_after(self, response):
+        # A Retry-After of minutes or hours would hold the worker that long
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, getattr(settings, "HTTP_MAX_RETRY_AFTER", 30))
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    Adapter whose requests get the (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT) timeout
+    unless the call passes its own
+    """
+
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+
+
+def build_adapter():
+    retry = RateLimitRetry(
+        total=getattr(settings, "HTTP_RETRIES", 3),
+        backoff_factor=getattr(settings, "HTTP_BACKOFF_FACTOR", 0.5),
+        status_forcelist=RETRY_STATUSES,
+        respect_retry_after_header=True,
+        # Hand the last response back instead of raising, callers check the status
+        raise_on_status=False,
+    )
+    return TimeoutHTTPAdapter(
+        timeout=(getattr(settings, "HTTP_CONNECT_TIMEOUT", 5), getattr(settings, "HTTP_READ_TIMEOUT", 30)),
+        max_retries=retry,
+        pool_connections=getattr(settings, "HTTP_POOL_HOSTS", 20),
+        pool_maxsize=getattr(settings, "HTTP_POOL_MAXSIZE", 10),
+    )
+
+
+def _adapter():
+    # Built once per process; a forked worker must not share its parent's sockets
+    if _state.pid != os.getpid():
+        with _lock:
+            if _state.pid != os.getpid():
+                _state.adapter = build_adapter()
+                _state.session = None
+                _state.pid = os.getpid()
+    return _state.adapter
+
+
+def _mount(session, adapter):
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """
+    The process-wide HTTP session for outbound calls (hh.ru, Bitrix, messengers):
+    keep-alive pools per host, default timeouts and retries with backoff. It
+    stores no cookies, so one tenant's cookies never go out with another's request.
+    """
+    adapter = _adapter()
+    session = _state.session
+    if session is None:
+        with _lock:
+            session = _state.session
+            if session is None:
+                session = _mount(requests.Session(), adapter)
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                _state.session = session
+    return session
+
+
+def isolated_session():
+    """
+    A session with its own cookie jar that shares the process-wide connection pools.
+    Don't close() it, that would close the shared pools.
+    """
+    return _mount(requests.Session(), _adapter())
@@ -0,0 +1,17 @@
+import re
+
+NON_DIGITS_RE = re.compile(r'\D')
+
+
+def normalize_phone(value):
+    """
+    Canonical digits-only form of a phone number, '' if it has no digits.
+    Russian numbers are brought to the 7XXXXXXXXXX form, so "+7 (999) 123-45-67",
+    "8 999 123 45 67" and "9991234567" all normalize to "79991234567".
+    """
+    digits = NON_DIGITS_RE.sub('', value or '')
+    if len(digits) == 11 and digits.startswith('8'):
+        return '7' + digits[1:]
+    if len(digits) == 10 and digits.startswith('9'):
+        return '7' + digits
+    return digits